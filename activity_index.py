@@ -0,0 +1,128 @@
+from datetime import date, datetime
+from typing import NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from sqlalchemy import text
+
+# Days of history kept per user; bit i of a user's mask means "active on today - i".
+# 62 fits a signed bigint in SQL and always covers the current month plus a week.
+ACTIVITY_DAYS = 62
+
+# One pass over user_streaks: per-user day bitmask plus all-time night owl / early bird counts
+_ACTIVITY_SCAN_SQL = """
+    SELECT user_id,
+           COALESCE(bit_or(CAST(1 AS bigint) << (CAST(:today AS date) - streak_date::date))
+                    FILTER (WHERE streak_date::date BETWEEN CAST(:today AS date) - :days + 1 AND CAST(:today AS date)),
+                    0) AS mask,
+           COUNT(*) FILTER (WHERE streak_date::time >= '22:00:00') AS night_count,
+           COUNT(*) FILTER (WHERE streak_date::time < '09:00:00')  AS early_count
+    FROM user_streaks
+    {where}
+    GROUP BY user_id
+"""
+ACTIVITY_SCAN_QUERY = text(_ACTIVITY_SCAN_SQL.format(where=""))
+# Same scan for users in (start_after, end_at], e.g. one shard's lease
+ACTIVITY_RANGE_SCAN_QUERY = text(_ACTIVITY_SCAN_SQL.format(
+    where="WHERE user_id > CAST(:start_after AS uuid) AND user_id <= CAST(:end_at AS uuid)"))
+
+
+class UserActivity(NamedTuple):
+    consecutive_days: int      # active days in a row ending today (0 if not active today)
+    month_to_date: int         # distinct active days since the 1st of the month
+    missed_yesterday: bool     # inactive yesterday but active the day before
+    night_count: int
+    early_count: int
+
+
+def popcount(masks: np.ndarray) -> np.ndarray:
+    """Number of set bits in each uint64."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(masks).astype(np.int64)
+    return np.unpackbits(masks.view(np.uint8)).reshape(-1, 64).sum(axis=1).astype(np.int64)
+
+
+def consecutive_days(masks: np.ndarray, days: int = ACTIVITY_DAYS) -> np.ndarray:
+    """Trailing run of set bits from bit 0 (today), per user."""
+    inverted = ~masks
+    lowest_unset = inverted & (~inverted + np.uint64(1))
+    # lowest_unset is an exact power of two, so log2 in float64 is exact
+    run = np.log2(lowest_unset.astype(np.float64)).astype(np.int64)
+    return np.minimum(run, days)
+
+
+def month_to_date(masks: np.ndarray, today: date) -> np.ndarray:
+    """Active days from the 1st of today's month through today."""
+    month_bits = np.uint64((1 << today.day) - 1)
+    return popcount(masks & month_bits)
+
+
+def missed_yesterday(masks: np.ndarray) -> np.ndarray:
+    """Inactive yesterday (bit 1) but active the day before (bit 2)."""
+    return ((masks & np.uint64(0b010)) == 0) & ((masks & np.uint64(0b100)) != 0)
+
+
+class ActivityIndex:
+    """
+    In-memory activity bitmaps for a batch of users, built from one scan of
+    user_streaks. Per-user stats are computed for the whole batch at once
+    with NumPy and looked up by user id afterwards, so the badge checks can
+    evaluate every user without further queries.
+    """
+
+    def __init__(self, today: date, user_ids, masks, night_counts, early_counts, days: int = ACTIVITY_DAYS):
+        self.today = today
+        self.days = days
+        self._index = {str(uid): i for i, uid in enumerate(user_ids)}
+        self.masks = np.asarray(masks, dtype=np.int64).view(np.uint64)
+        self.night_counts = np.asarray(night_counts, dtype=np.int64)
+        self.early_counts = np.asarray(early_counts, dtype=np.int64)
+
+        self.consecutive = consecutive_days(self.masks, days)
+        self.month_to_date = month_to_date(self.masks, today)
+        self.missed_yesterday = missed_yesterday(self.masks)
+
+    @classmethod
+    def build(cls, db, check_date: Union[date, datetime], days: int = ACTIVITY_DAYS, partition_size: int = 50000,
+              user_range: Optional[Tuple[str, str]] = None):
+        """
+        Streams the grouped scan of user_streaks in partitions into column arrays. With
+        `user_range` (start_after, end_at) only those users' rows are read.
+        """
+        today = check_date.date() if isinstance(check_date, datetime) else check_date
+        params = {"today": today, "days": days}
+        query = ACTIVITY_SCAN_QUERY
+        if user_range is not None:
+            query = ACTIVITY_RANGE_SCAN_QUERY
+            params.update(start_after=user_range[0], end_at=user_range[1])
+        result = db.execution_options(stream_results=True).execute(query, params)
+        user_ids, masks, nights, earlies = [], [], [], []
+        for partition in result.partitions(partition_size):
+            for user_id, mask, night, early in partition:
+                user_ids.append(user_id)
+                masks.append(mask)
+                nights.append(night)
+                earlies.append(early)
+        return cls(today, user_ids, masks, nights, earlies, days)
+
+    def __contains__(self, user_id) -> bool:
+        return str(user_id) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, user_id) -> UserActivity:
+        """Stats for one user; users with no streak rows get all zeros."""
+        i = self._index.get(str(user_id))
+        if i is None:
+            return UserActivity(0, 0, False, 0, 0)
+        return UserActivity(
+            int(self.consecutive[i]),
+            int(self.month_to_date[i]),
+            bool(self.missed_yesterday[i]),
+            int(self.night_counts[i]),
+            int(self.early_counts[i]),
+        )
+
+    def active_on(self, user_id, day_offset: int) -> bool:
+        i = self._index.get(str(user_id))
+        return i is not None and bool(self.masks[i] & np.uint64(1 << day_offset))
@@ -0,0 +1,121 @@
+"""
+Event-driven badge and plant checks. Triggers NOTIFY `user_activity` with the user id
+when a user crosses a threshold the checks report on: a badge reaching 90% or 100% of its
+required progress, or a plant reaching a 6-day water streak or the medium stage
+(migrations 0023-0026). The checks are state-based, so firing on every write would resend
+the same push on each watering. This process LISTENs, collects ids for
+ACTIVITY_BATCH_SECONDS (or until ACTIVITY_BATCH_MAX ids), and runs
+run_checks.check_users for just those users.
+
+    python activity_listener.py
+
+NOTIFY is not durable: events raised while no listener is connected are lost, so
+keep the periodic run_checks scan as a (less frequent) safety net.
+"""
+import logging
+import os
+import select
+import time
+from typing import Callable, List
+
+from sqlalchemy import text
+
+from db import get_db, get_engine
+from retry_queue import backoff_delay
+from run_checks import check_users
+
+ACTIVITY_CHANNEL = "user_activity"
+ACTIVITY_BATCH_SECONDS = float(os.getenv("ACTIVITY_BATCH_SECONDS", "2"))
+ACTIVITY_BATCH_MAX = int(os.getenv("ACTIVITY_BATCH_MAX", "1000"))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def check_active_users(user_ids: List[str]):
+    """Runs the badge/plant checks for one batch of user ids, reading from the primary."""
+    db = get_db("prod")
+    try:
+        users = db.execute(
+            text("SELECT id, push_token FROM users WHERE id = ANY(CAST(:ids AS uuid[]))"),
+            {"ids": user_ids},
+        ).all()
+        check_users(db, users, source="activity_listener", plant_db="prod")
+    finally:
+        db.close()
+
+
+class ActivityListener:
+    """
+    Batches user ids from NOTIFY payloads on one dedicated autocommit connection.
+    Reconnects with jittered backoff if the connection drops.
+    """
+
+    def __init__(self, on_batch: Callable[[List[str]], None] = check_active_users,
+                 channel: str = ACTIVITY_CHANNEL, window_seconds: float = ACTIVITY_BATCH_SECONDS,
+                 max_batch: int = ACTIVITY_BATCH_MAX):
+        self.on_batch = on_batch
+        self.channel = channel
+        self.window = window_seconds
+        self.max_batch = max_batch
+        self.stats = {"events": 0, "batches": 0, "users": 0, "reconnects": 0}
+
+    def _connect(self):
+        raw = get_engine("prod").raw_connection()
+        conn = raw.driver_connection
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {self.channel}")
+        logger.info("Listening on %s", self.channel)
+        return raw, conn
+
+    def _dispatch(self, pending: set):
+        user_ids = sorted(pending)
+        started = time.monotonic()
+        try:
+            self.on_batch(user_ids)
+        except Exception as e:
+            logger.error("Activity batch of %d users failed: %s", len(user_ids), e)
+        self.stats["batches"] += 1
+        self.stats["users"] += len(user_ids)
+        logger.info("Checked %d active users in %.2fs (%s)", len(user_ids), time.monotonic() - started, self.stats)
+
+    def run_forever(self):
+        attempt = 0
+        while True:
+            raw = None
+            try:
+                raw, conn = self._connect()
+                attempt = 0
+                self._loop(conn)
+            except Exception as e:
+                attempt += 1
+                self.stats["reconnects"] += 1
+                wait = backoff_delay(attempt, 1.0, cap=60.0)
+                logger.warning("Listener connection lost: %s. Reconnecting in %.1fs", e, wait)
+                if raw is not None:
+                    raw.invalidate()
+                time.sleep(wait)
+
+    def _loop(self, conn):
+        pending = set()
+        opened_at = None
+        while True:
+            timeout = self.window if opened_at is None else max(0.0, opened_at + self.window - time.monotonic())
+            if select.select([conn], [], [], timeout) != ([], [], []):
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    self.stats["events"] += 1
+                    pending.add(notify.payload)
+                    if opened_at is None:
+                        opened_at = time.monotonic()
+
+            if pending and (len(pending) >= self.max_batch or time.monotonic() - opened_at >= self.window):
+                batch, pending, opened_at = pending, set(), None
+                # Notifications arriving meanwhile wait in the connection and are read next loop
+                self._dispatch(batch)
+
+
+if __name__ == "__main__":
+    ActivityListener().run_forever()
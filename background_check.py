@@ -2,30 +2,22 @@
 import json
 from datetime import datetime, timezone
 from badge_checks import check_plant_badges_upcoming, get_single_app_streak_message, get_upcoming_achievements
-from notifier import send_push_notification
-# from db import get_users_to_notify  # hypothetically
+from activity_index import ActivityIndex
 
-# users = get_users_to_notify()
-tokens = ["dDP3xJ0tTK-21L1aQYH8Ic:APA91bFZBDECRjVW-mzGytvdfHCR5Srvzjs1P9o6Gb3UT_0-ugtWJU8CUcPT0Y_HoD3ey-asL_4c5-GLMS_Ijok9DCjgBzYMEnuaeh-Enx839HhzudsLQzQ", "frMgjKkYcEcevbYPulSQms:APA91bHCBGu5Z005euBShEnW2SM-jrEeNru22fwxte3SgFEw3NwiQUdpaKM17D_bmZZEdX_D6-4oyTOGwhHsE9GpAtzcZclhv6Ep8Ni62_oZ-FMvNE2dgEg"]
 
-# send_push_notification(
-#     tokens=tokens,
-#     title="You're inactive 😴",
-#     body="Time to return to the app and check your messages!"
-# )
-
-
-def background_checks(user_id: str, current_streak: int, last_watered_date: datetime, check_date: datetime = None):
+def background_checks(user_id: str, current_streak: int, last_watered_date: datetime, check_date: datetime = None,
+                      activity: ActivityIndex = None):
     """
     Call both plant and app streak checks.
     Returns upcoming nudges (for notifications).
+    With an ActivityIndex, app streaks are evaluated without querying user_streaks.
     """
     # Get plant-based upcoming badges
-    plant_upcoming = check_plant_badges_upcoming(user_id, last_watered_date, current_streak)
+    plant_upcoming = check_plant_badges_upcoming(user_id, last_watered_date, current_streak, check_date)
 
     # Get app usage-based upcoming achievements
-    app_single_upcoming = get_single_app_streak_message(user_id, check_date)
-    # app_upcoming = get_upcoming_achievements(user_id, check_date)
+    app_single_upcoming = get_single_app_streak_message(user_id, check_date, activity=activity)
+    # app_upcoming = get_upcoming_achievements(user_id, check_date, activity=activity)
 
     return {
         'plant': plant_upcoming,
@@ -1,10 +1,12 @@
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import text
 from constants import BADGES, PLANT_BADGES, get_plant_messages
 from db import get_db
 from random import choice
 import json
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+from cachetools import TTLCache
+from activity_index import ActivityIndex, UserActivity
+from statements import register, run
 
 
 # === Creative Templates ===
@@ -146,14 +148,120 @@ FALLBACK = {
     "type": "consistent"
 }
 
-def get_single_app_streak_message(user_id: str, date: datetime = None) -> Dict[str, Any]:
+_badge_cache = TTLCache(maxsize=256, ttl=600)
+# Badge rows served without expiry or queries, e.g. from an offline snapshot (see pin_badges)
+_pinned_badges: Dict[str, Any] = {}
+
+BADGE_BY_NAME_QUERY = register("badge_by_name", "SELECT id, name FROM badges WHERE name = :name")
+
+RECENT_STREAK_DATES_QUERY = register("streak_recent_dates", """
+    SELECT DATE(streak_date) AS streak_date
+    FROM user_streaks
+    WHERE user_id = :user_id
+      AND streak_date >= :start_date
+    ORDER BY streak_date DESC
+""")
+
+MONTH_STREAK_DAYS_QUERY = register("streak_month_days", """
+    SELECT COUNT(DISTINCT DATE(streak_date)) AS count
+    FROM user_streaks
+    WHERE user_id = :user_id
+      AND streak_date >= :start_date
+      AND streak_date <= :end_date
+""")
+
+NIGHT_STREAK_COUNT_QUERY = register("streak_night_count", """
+    SELECT COUNT(*) AS count
+    FROM user_streaks
+    WHERE user_id = :user_id
+      AND streak_date::time >= '22:00:00'
+""")
+
+EARLY_STREAK_COUNT_QUERY = register("streak_early_count", """
+    SELECT COUNT(*) AS count
+    FROM user_streaks
+    WHERE user_id = :user_id
+      AND streak_date::time < '09:00:00'
+""")
+
+
+def get_badge(db, name: str):
+    """
+    Badge row (id, name) by name. Badges rarely change, so lookups are cached. With
+    db=None a prod session is only opened on a cache miss.
+    """
+    if name in _pinned_badges:
+        return _pinned_badges[name]
+    if name in _badge_cache:
+        return _badge_cache[name]
+    if db is None:
+        db = get_db()
+        try:
+            badge = run(db, BADGE_BY_NAME_QUERY, {"name": name}).fetchone()
+        finally:
+            db.close()
+    else:
+        badge = run(db, BADGE_BY_NAME_QUERY, {"name": name}).fetchone()
+    _badge_cache[name] = badge
+    return badge
+
+
+def pin_badges(badges: Dict[str, Any]):
+    """Serves these {name: row} badges from memory; names not in the dict are treated as missing."""
+    _pinned_badges.clear()
+    _pinned_badges.update(badges)
+    for name in list(BADGES.values()) + list(PLANT_BADGES.values()):
+        _pinned_badges.setdefault(name, None)
+
+
+def get_app_activity(db, user_id: str, date: datetime) -> UserActivity:
+    """
+    Per-user streak stats straight from user_streaks, for callers without an
+    ActivityIndex. Same fields as ActivityIndex.get (consecutive days capped at 7).
+    """
+    week_ago = date - timedelta(days=6)  # last 7 days including today
+    result = run(db, RECENT_STREAK_DATES_QUERY, {"user_id": user_id, "start_date": week_ago.date()})
+    streak_dates = {row.streak_date.isoformat() for row in result}
+
+    # Count consecutive days from today backward
+    consecutive_count = 0
+    check_date = date
+    for _ in range(7):
+        if check_date.date().isoformat() in streak_dates:
+            consecutive_count += 1
+        else:
+            break
+        check_date -= timedelta(days=1)
+
+    yesterday = (date - timedelta(days=1)).date().isoformat()
+    day_before = (date - timedelta(days=2)).date().isoformat()
+
+    start_of_month = date.replace(day=1)
+    end_of_month = (date.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    row = run(db, MONTH_STREAK_DAYS_QUERY, {
+        "user_id": user_id, "start_date": start_of_month, "end_date": end_of_month
+    }).fetchone()
+    night_count = run(db, NIGHT_STREAK_COUNT_QUERY, {"user_id": user_id}).fetchone().count
+    early_count = run(db, EARLY_STREAK_COUNT_QUERY, {"user_id": user_id}).fetchone().count
+
+    return UserActivity(
+        consecutive_days=consecutive_count,
+        month_to_date=row.count if row.count else 0,
+        missed_yesterday=yesterday not in streak_dates and day_before in streak_dates,
+        night_count=night_count,
+        early_count=early_count,
+    )
+
+
+def get_single_app_streak_message(user_id: str, date: datetime = None, activity: Optional[ActivityIndex] = None) -> Dict[str, Any]:
     """
     Returns a rich motivational nudge for the most urgent upcoming app streak.
     Returns: { "title": "...", "description": "...", "type": "consistent|inconsistent|losing_streak" }
+    Pass a prebuilt ActivityIndex to evaluate without querying user_streaks.
     """
     if date is None:
         date = datetime.now(timezone.utc)
-    db = get_db()  # Use prod DB
+    stats = activity.get(user_id) if activity is not None else get_app_activity(get_db(), user_id, date)  # Use prod DB
     candidates = []  # List of (urgency_score, result_dict)
 
     def random_choice(templates, **kwargs):
@@ -175,42 +283,14 @@ def get_single_app_streak_message(user_id: str, date: datetime = None) -> Dict[s
         ))
 
     # ================= Weekly Warrior =================
-    week_ago = date - timedelta(days=6)
-    result = db.execute(
-        text("""
-            SELECT DATE(streak_date) AS streak_date
-            FROM user_streaks
-            WHERE user_id = :user_id
-              AND streak_date >= :start_date
-            ORDER BY streak_date DESC
-        """),
-        {"user_id": user_id, "start_date": week_ago.date()}
-    )
-    streak_dates = [row.streak_date.isoformat() for row in result]
-
-    consecutive_count = 0
-    total_weekly_active = 0
-    current = date
-
-    for _ in range(7):
-        d = current.date().isoformat()
-        if d in streak_dates:
-            total_weekly_active += 1
-            if consecutive_count == 0 or (current + timedelta(days=1)).date().isoformat() in streak_dates:
-                consecutive_count += 1
-            else:
-                break
-        else:
-            break
-        current -= timedelta(days=1)
+    consecutive_count = min(stats.consecutive_days, 7)
+    total_weekly_active = consecutive_count
 
     if consecutive_count < 7:
         days_remaining = 7 - consecutive_count
-        yesterday = (date - timedelta(days=1)).date().isoformat()
-        day_before = (date - timedelta(days=2)).date().isoformat()
 
         # Losing streak: had 2+ day streak, missed yesterday
-        if consecutive_count == 1 and yesterday not in streak_dates and day_before in streak_dates:
+        if consecutive_count == 1 and stats.missed_yesterday:
             add_candidate(
                 1, "losing_streak", "weekly",
                 count=consecutive_count - 1,
@@ -232,23 +312,10 @@ def get_single_app_streak_message(user_id: str, date: datetime = None) -> Dict[s
             )
 
     # ================= Monthly Master =================
-    start_of_month = date.replace(day=1)
     next_month = (date.replace(day=28) + timedelta(days=4)).replace(day=1)
     end_of_month = next_month - timedelta(days=1)
     total_days_in_month = end_of_month.day
-
-    result = db.execute(
-        text("""
-            SELECT COUNT(DISTINCT DATE(streak_date)) AS count
-            FROM user_streaks
-            WHERE user_id = :user_id
-              AND streak_date >= :start_date
-              AND streak_date <= :end_date
-        """),
-        {"user_id": user_id, "start_date": start_of_month, "end_date": end_of_month}
-    )
-    row = result.fetchone()
-    days_active = row.count if row.count else 0
+    days_active = stats.month_to_date
 
     if days_active < total_days_in_month:
         days_remaining = total_days_in_month - days_active
@@ -268,16 +335,7 @@ def get_single_app_streak_message(user_id: str, date: datetime = None) -> Dict[s
             )
 
     # ================= Night Owl =================
-    result = db.execute(
-        text("""
-            SELECT COUNT(*) AS count
-            FROM user_streaks
-            WHERE user_id = :user_id
-              AND streak_date::time >= '22:00:00'
-        """),
-        {"user_id": user_id}
-    )
-    night_count = result.fetchone().count
+    night_count = stats.night_count
 
     if night_count < 30:
         days_remaining = 30 - night_count
@@ -297,16 +355,7 @@ def get_single_app_streak_message(user_id: str, date: datetime = None) -> Dict[s
             )
 
     # ================= Early Bird =================
-    result = db.execute(
-        text("""
-            SELECT COUNT(*) AS count
-            FROM user_streaks
-            WHERE user_id = :user_id
-              AND streak_date::time < '09:00:00'
-        """),
-        {"user_id": user_id}
-    )
-    early_count = result.fetchone().count
+    early_count = stats.early_count
 
     if early_count < 30:
         days_remaining = 30 - early_count
@@ -340,15 +389,16 @@ def get_single_app_streak_message(user_id: str, date: datetime = None) -> Dict[s
 
 
 
-def get_upcoming_achievements(user_id: str, date: datetime = None):
+def get_upcoming_achievements(user_id: str, date: datetime = None, activity: Optional[ActivityIndex] = None):
     """
     Returns list of upcoming achievement nudges based on app usage streaks.
-    Does NOT award badges.
+    Does NOT award badges. Pass a prebuilt ActivityIndex to skip the user_streaks queries.
     """
     if date is None:
         date = datetime.now(timezone.utc)
         
     db = get_db()
+    stats = activity.get(user_id) if activity is not None else get_app_activity(db, user_id, date)
     upcoming = []
 
     # Helper to randomize message
@@ -358,35 +408,11 @@ def get_upcoming_achievements(user_id: str, date: datetime = None):
         return template.format(days=days_remaining, day_s=day_s)
 
     # ================= Weekly Warrior =================
-    week_ago = date - timedelta(days=6)  # last 7 days including today
-    result = db.execute(
-        text("""
-            SELECT DATE(streak_date) AS streak_date
-            FROM user_streaks
-            WHERE user_id = :user_id
-              AND streak_date >= :start_date
-            ORDER BY streak_date DESC
-        """),
-        {"user_id": user_id, "start_date": week_ago.date()}
-    )
-    streak_dates = [row.streak_date.isoformat() for row in result]
-
-    # Count consecutive days from today backward
-    consecutive_count = 0
-    check_date = date
-    for _ in range(7):
-        if check_date.date().isoformat() in streak_dates:
-            consecutive_count += 1
-        else:
-            break
-        check_date -= timedelta(days=1)
+    consecutive_count = min(stats.consecutive_days, 7)
 
     if consecutive_count < 7:
         days_remaining = 7 - consecutive_count
-        badge = db.execute(
-            text("SELECT id, name FROM badges WHERE name = :name"),
-            {"name": BADGES['WEEKLY']}
-        ).fetchone()
+        badge = get_badge(db, BADGES['WEEKLY'])
 
         if badge:
             weekly_messages = [
@@ -405,37 +431,17 @@ def get_upcoming_achievements(user_id: str, date: datetime = None):
             })
 
     # ================= Monthly Master =================
-    start_of_month = date.replace(day=1)
     if date.month == 12:
         next_month = date.replace(year=date.year + 1, month=1, day=1)
     else:
         next_month = date.replace(month=date.month + 1, day=1)
     end_of_month = next_month - timedelta(days=1)
     total_days_in_month = end_of_month.day
-
-    result = db.execute(
-        text("""
-            SELECT COUNT(DISTINCT DATE(streak_date)) AS count
-            FROM user_streaks
-            WHERE user_id = :user_id
-              AND streak_date >= :start_date
-              AND streak_date <= :end_date
-        """),
-        {
-            "user_id": user_id,
-            "start_date": start_of_month,
-            "end_date": end_of_month
-        }
-    )
-    row = result.fetchone()
-    days_active = row.count if row.count else 0
+    days_active = stats.month_to_date
 
     if days_active < total_days_in_month:
         days_remaining = total_days_in_month - days_active
-        badge = db.execute(
-            text("SELECT id, name FROM badges WHERE name = :name"),
-            {"name": BADGES['MONTHLY']}
-        ).fetchone()
+        badge = get_badge(db, BADGES['MONTHLY'])
 
         if badge:
             message = f"You're {days_remaining} day{'s' if days_remaining > 1 else ''} away from the Monthly Master badge!"
@@ -446,23 +452,11 @@ def get_upcoming_achievements(user_id: str, date: datetime = None):
             })
 
     # ================= Night Owl =================
-    result = db.execute(
-        text("""
-            SELECT COUNT(*) AS count
-            FROM user_streaks
-            WHERE user_id = :user_id
-            AND streak_date::time >= '22:00:00'
-        """),
-        {"user_id": user_id}
-    )
-    night_count = result.fetchone().count
+    night_count = stats.night_count
 
     if night_count < 30:
         days_remaining = 30 - night_count
-        badge = db.execute(
-            text("SELECT id, name FROM badges WHERE name = :name"),
-            {"name": BADGES['NIGHT_OWL']}
-        ).fetchone()
+        badge = get_badge(db, BADGES['NIGHT_OWL'])
 
         if badge:
             night_messages = [
@@ -481,23 +475,11 @@ def get_upcoming_achievements(user_id: str, date: datetime = None):
             })
 
     # ================= Early Bird =================
-    result = db.execute(
-        text("""
-            SELECT COUNT(*) AS count
-            FROM user_streaks
-            WHERE user_id = :user_id
-            AND streak_date::time < '09:00:00'
-        """),
-        {"user_id": user_id}
-    )
-    early_count = result.fetchone().count
+    early_count = stats.early_count
 
     if early_count < 30:
         days_remaining = 30 - early_count
-        badge = db.execute(
-            text("SELECT id, name FROM badges WHERE name = :name"),
-            {"name": BADGES['EARLY_BIRD']}
-        ).fetchone()
+        badge = get_badge(db, BADGES['EARLY_BIRD'])
 
         if badge:
             early_messages = [
@@ -616,15 +598,15 @@ PLANT_FALLBACK = {
     "type": "hopeful"
 }
 
-def check_plant_badges_upcoming(user_id: str, last_watered_date: datetime, current_streak: int) -> List[Dict[str, Any]]:
+def check_plant_badges_upcoming(user_id: str, last_watered_date: datetime, current_streak: int,
+                                check_date: Optional[datetime] = None) -> List[Dict[str, Any]]:
     """
     Returns a list of upcoming plant badge nudges with:
     - title
     - description
     - type: emotional state ('thriving', 'hopeful', 'sad', 'neglected', 'urgent', 'upcoming')
     """
-    db = get_db()
-    today = datetime.now(timezone.utc).date()
+    today = (check_date or datetime.now(timezone.utc)).date()
 
     # === 1. Find next badge milestone ===
     next_milestone = None
@@ -637,10 +619,7 @@ def check_plant_badges_upcoming(user_id: str, last_watered_date: datetime, curre
         return []
 
     badge_name = PLANT_BADGES[next_milestone]
-    result = db.execute(
-        text("SELECT id, name FROM badges WHERE name = :name"),
-        {"name": badge_name}
-    ).fetchone()
+    result = get_badge(None, badge_name)
 
     if not result:
         return []
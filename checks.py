@@ -1,26 +1,35 @@
 from db import get_db
 from sqlalchemy import text
 
+# Badge progress along with badge metadata
+BADGE_PROGRESS_QUERY = text("""
+    SELECT 
+        bp.badge_id,
+        bp.progress,
+        b.name AS badge_name,
+        b.required_progress,
+        b.rarity
+    FROM badge_progress bp
+    JOIN badges b ON b.id = bp.badge_id
+    WHERE bp.user_id = :uid
+""")
+
+EARNED_BADGES_QUERY = text("""
+    SELECT badge_id FROM user_badges WHERE user_id = :uid
+""")
+
+ACTIVE_PLANTS_QUERY = text("""
+    SELECT id, name, current_stage, water_streak, last_watered_date
+    FROM user_plants
+    WHERE user_id = :uid AND is_active = true
+""")
 
 def check_user_badge_progress(user_id: str):
     db = get_db("prod")
     
-    # Fetch badge progress along with badge metadata
-    badge_progress_list = db.execute(text("""
-        SELECT 
-            bp.badge_id,
-            bp.progress,
-            b.name AS badge_name,
-            b.required_progress,
-            b.rarity
-        FROM badge_progress bp
-        JOIN badges b ON b.id = bp.badge_id
-        WHERE bp.user_id = :uid
-    """), {"uid": user_id}).mappings().all()
-
-    earned_badges = db.execute(text("""
-        SELECT badge_id FROM user_badges WHERE user_id = :uid
-    """), {"uid": user_id}).scalars().all()
+    badge_progress_list = db.execute(BADGE_PROGRESS_QUERY, {"uid": user_id}).mappings().all()
+
+    earned_badges = db.execute(EARNED_BADGES_QUERY, {"uid": user_id}).scalars().all()
 
     notifications = []
 
@@ -55,14 +64,12 @@ def check_user_badge_progress(user_id: str):
 
 
 
-def check_user_plant_progress(user_id: str):
-    db = get_db("prod")
+def check_user_plant_progress(user_id: str, db_type: str = "replica"):
+    # Read-only, so it can be served by a replica (event-driven callers pass "prod" to see the
+    # write that triggered them)
+    db = get_db(db_type)
 
-    plants = db.execute(text("""
-        SELECT id, name, current_stage, water_streak, last_watered_date
-        FROM user_plants
-        WHERE user_id = :uid AND is_active = true
-    """), {"uid": user_id}).mappings().all()
+    plants = db.execute(ACTIVE_PLANTS_QUERY, {"uid": user_id}).mappings().all()
 
     notifications = []
 
@@ -76,4 +83,5 @@ def check_user_plant_progress(user_id: str):
         elif stage == "medium":
             notifications.append(f"🌿 '{name}' is now at the medium stage!")
 
+    db.close()
     return notifications
@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Per-dependency thresholds; override with e.g. FCM_BREAKER_OPEN_SECONDS=60
+BREAKER_DEFAULTS = {
+    "fcm": {
+        "failure_rate": 0.5,
+        "slow_call_seconds": 5.0,
+        "slow_call_rate": 0.8,
+        "window": 50,
+        "min_calls": 10,
+        "open_seconds": 30.0,
+        "half_open_calls": 3,
+    },
+    "prod_db": {
+        "failure_rate": 0.5,
+        "slow_call_seconds": 2.0,
+        "slow_call_rate": 0.8,
+        "window": 50,
+        "min_calls": 10,
+        "open_seconds": 15.0,
+        "half_open_calls": 3,
+    },
+}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} circuit open; retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Count-based circuit breaker. Opens when, over the last `window` calls (and at
+    least `min_calls`), the failure rate or the rate of calls slower than
+    `slow_call_seconds` reaches its threshold. After `open_seconds` it lets
+    `half_open_calls` probes through; all must succeed to close it again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 5.0,
+        slow_call_rate: float = 0.8,
+        window: int = 50,
+        min_calls: int = 10,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 3,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._calls = deque(maxlen=window)  # (failed, slow)
+        self._probes_started = 0
+        self._probes_ok = 0
+        self.transitions = deque(maxlen=100)  # (wall time, from, to, reason)
+        self.rejected = 0
+
+    # ---- state ----
+    def _transition(self, new_state: str, reason: str):
+        self.transitions.append((time.time(), self._state, new_state, reason))
+        self._state = new_state
+        if new_state == OPEN:
+            self._opened_at = self.clock()
+        if new_state in (HALF_OPEN, CLOSED):
+            self._probes_started = self._probes_ok = 0
+        if new_state == CLOSED:
+            self._calls.clear()
+
+    def _refresh(self):
+        if self._state == OPEN and self.clock() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, "open timeout elapsed")
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (self.clock() - self._opened_at))
+
+    # ---- calls ----
+    def allow(self) -> bool:
+        """Returns True if a call may go through now (and reserves a probe slot when half-open)."""
+        with self._lock:
+            self._refresh()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes_started < self.half_open_calls:
+                self._probes_started += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, failed: bool, duration: float):
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN, "probe failed" if failed else f"probe slow ({duration:.2f}s)")
+                else:
+                    self._probes_ok += 1
+                    if self._probes_ok >= self.half_open_calls:
+                        self._transition(CLOSED, "probes succeeded")
+                return
+            if self._state != CLOSED:
+                return
+
+            self._calls.append((failed, slow))
+            n = len(self._calls)
+            if n < self.min_calls:
+                return
+            failures = sum(1 for f, _ in self._calls if f)
+            slows = sum(1 for _, s in self._calls if s)
+            if failures / n >= self.failure_rate:
+                self._transition(OPEN, f"failure rate {failures}/{n}")
+            elif slows / n >= self.slow_call_rate:
+                self._transition(OPEN, f"slow call rate {slows}/{n}")
+
+    @contextmanager
+    def guard(self):
+        """`with breaker.guard(): ...` — raises CircuitOpenError while open, records the outcome otherwise."""
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after())
+        start = self.clock()
+        try:
+            yield
+        except Exception:
+            self.record(True, self.clock() - start)
+            raise
+        self.record(False, self.clock() - start)
+
+    def call(self, fn: Callable, *args, **kwargs):
+        with self.guard():
+            return fn(*args, **kwargs)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            self._refresh()
+            n = len(self._calls)
+            return {
+                "name": self.name,
+                "state": self._state,
+                "calls_in_window": n,
+                "failure_rate": (sum(1 for f, _ in self._calls if f) / n) if n else 0.0,
+                "slow_call_rate": (sum(1 for _, s in self._calls if s) / n) if n else 0.0,
+                "rejected": self.rejected,
+                "transitions": [
+                    {"at": at, "from": old, "to": new, "reason": reason}
+                    for at, old, new, reason in list(self.transitions)[-10:]
+                ],
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def _env_config(name: str) -> Dict:
+    config = dict(BREAKER_DEFAULTS.get(name, {}))
+    for key, default in list(config.items()):
+        value = os.getenv(f"{name.upper()}_BREAKER_{key.upper()}")
+        if value is not None:
+            config[key] = type(default)(value)
+    return config
+
+
+def get_breaker(name: str, clock: Optional[Callable[[], float]] = None) -> CircuitBreaker:
+    """Returns the process-wide breaker for a dependency, creating it from BREAKER_DEFAULTS + env."""
+    with _breakers_lock:
+        if name not in _breakers:
+            config = _env_config(name)
+            if clock is not None:
+                config["clock"] = clock
+            _breakers[name] = CircuitBreaker(name, **config)
+        return _breakers[name]
+
+
+def breaker_states() -> Dict[str, Dict]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in breakers}
@@ -45,9 +45,9 @@ def main():
                 # Run background check for first user to get dynamic message
                 sample = chunk[0]
                 result = background_checks(
-                    user_id=sample["user_id"],
-                    current_streak=sample["current_streak"],
-                    last_watered_date=sample["last_watered_date"],
+                    user_id=sample.user_id,
+                    current_streak=sample.current_streak,
+                    last_watered_date=sample.last_watered_date,
                     check_date=check_date
                 )
 
@@ -70,7 +70,7 @@ def send_chunked_notifications(users_chunk, title: str, body: str):
     """
     Send push notifications in chunks of 100 (or your provider’s limit).
     """
-    tokens = [u["token"] for u in users_chunk]
+    tokens = [u.token for u in users_chunk]
     if not tokens:
         return
 
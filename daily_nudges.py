@@ -1,9 +1,10 @@
 
+import argparse
 import os
 import time
 import json
 import logging
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Optional, Tuple, Union
 from datetime import datetime, timezone
 from functools import partial
 
@@ -12,22 +13,36 @@ from sqlalchemy.exc import SQLAlchemyError
 
 # local app imports assumed to be available in same package
 from background_check import background_checks
-from notifier import send_push_notification
+from push_lanes import BULK, send_in_lane, lane_stats
+from digest import DIGEST_WINDOW_SECONDS, push, queue_pushes
+from user_records import UserRecord, SCHEDULE_INDEX, SCHEDULE_KEYS
+from retry_queue import RetryScheduler, backoff_delay
+from circuit_breaker import get_breaker
+from frequency_cap import FrequencyCap
+from activity_index import ActivityIndex
+from db import get_read_engine
+from job_runs import JobRun
+from profiling import NO_PROFILER, RunProfiler
+from shard_leases import SHARD_COUNT, LeaseLost, ShardCoordinator, ShardLease
 
 # ======== Configuration ========
 MAIN_DATABASE_URL = os.getenv("MAIN_DATABASE_URL")
 MAX_BATCH = 100
+NUDGE_BATCH_SIZE = int(os.getenv("NUDGE_BATCH_SIZE", "1000"))  # users per checkpointed batch
+JOB_NAME = "daily_nudges"
+FIRST_USER_ID = "00000000-0000-0000-0000-000000000000"
+LAST_USER_ID = "ffffffff-ffff-ffff-ffff-ffffffffffff"
 DB_RETRY_ATTEMPTS = 3
-DB_RETRY_BACKOFF = 2  # seconds (exponential)
+DB_RETRY_BACKOFF = 2  # seconds (exponential, jittered)
 PUSH_RETRY_ATTEMPTS = 3
-PUSH_RETRY_BACKOFF = 1  # seconds (exponential)
+PUSH_RETRY_BACKOFF = 1  # seconds (exponential, jittered; Retry-After wins if longer)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 logger = logging.getLogger(__name__)
 
 
 # ======== DB utilities (simplified) ========
-def get_all_users(db):
+def get_all_users(db) -> List[UserRecord]:
     query = text("""
         SELECT 
             u.id AS user_id,
@@ -44,31 +59,48 @@ def get_all_users(db):
     """)
     
     result = db.execute(query)
-    rows = result.fetchall()
+    return [UserRecord.from_row(r) for r in result]
 
-    users = []
-    for r in rows:
-        users.append({
-            "user_id": r.user_id,
-            "token": r.push_token,
-            "current_streak": r.current_streak or 0,
-            "last_watered_date": r.last_watered_date,
-        })
 
-    return users
+def get_users_page(db, after_user_id: str, limit: int, end_at: str = LAST_USER_ID) -> List[UserRecord]:
+    """
+    Next `limit` users with a push token after `after_user_id` (up to `end_at`), in user_id order.
+    One row per user (their most recently watered active plant), so a user never
+    straddles two pages.
+    """
+    query = text("""
+        SELECT DISTINCT ON (u.id)
+            u.id AS user_id,
+            u.push_token AS push_token,
+            gs.current_streak AS current_streak,
+            p.last_watered_date AS last_watered_date
+        FROM users u
+        LEFT JOIN garden_stats gs
+            ON gs.user_id = u.id
+        LEFT JOIN user_plants p
+            ON p.user_id = u.id
+           AND p.is_active = true
+        WHERE u.push_token IS NOT NULL
+          AND u.id > CAST(:after AS uuid)
+          AND u.id <= CAST(:end_at AS uuid)
+        ORDER BY u.id, p.last_watered_date DESC NULLS LAST
+        LIMIT :limit
+    """)
+    result = db.execute(query, {"after": after_user_id, "end_at": end_at, "limit": limit})
+    return [UserRecord.from_row(r) for r in result]
 
 
 
 # ======== Classification and scheduling ========
 
-def classify_user(user: Dict, check_date: datetime) -> Dict:
+def classify_user(user: UserRecord, check_date: datetime) -> UserRecord:
+    """Annotates the record in place with app_type / plant_type and returns it."""
     now = check_date
 
     # No last_streak_date returned from SQL, so treat streak freshness using watering streak only
     # Since garden_stats.current_streak is your streak source
 
-    current_streak = user.get("current_streak", 0)
-    last_watered = user.get("last_watered_date")
+    last_watered = user.last_watered_date
 
     # Convert last_watered (date) into datetime
     if last_watered:
@@ -104,12 +136,9 @@ def classify_user(user: Dict, check_date: datetime) -> Dict:
     else:
         plant_type = "neglected"
 
-    return {
-        **user,
-        "app_type": app_type,
-        "plant_type": plant_type,
-        "current_streak": current_streak,
-    }
+    user.app_type = app_type
+    user.plant_type = plant_type
+    return user
 
 
 SCHEDULE_RULES = {
@@ -132,15 +161,16 @@ def choose_schedule_type(app_type: str, plant_type: str) -> str:
 
 
 # ======== Notification helpers ========
-def build_message_for_user(user: Dict, check_date: datetime) -> Tuple[str, str]:
+def build_message_for_user(user: UserRecord, check_date: datetime, activity: ActivityIndex = None) -> Tuple[str, str]:
     """Run background checks and return (title, body) for a single user.
     Handles both dict and list responses from plant badge logic.
     """
     res = background_checks(
-        user_id=user["user_id"],
-        current_streak=user.get("current_streak", 0),
-        last_watered_date=user.get("last_watered_date"),
+        user_id=user.user_id,
+        current_streak=user.current_streak,
+        last_watered_date=user.last_watered_date,
         check_date=check_date,
+        activity=activity,
     )
 
     # Handle plant nudges: may be dict OR list OR empty
@@ -164,87 +194,270 @@ def build_message_for_user(user: Dict, check_date: datetime) -> Tuple[str, str]:
     return "Keep Growing", "Your garden is listening 🌿"
 
 
-def retry_send(tokens: List[str], title: str, body: str) -> bool:
-    """Attempt to send push notification with retries and exponential backoff.
-    Returns True on success, False on final failure.
-    """
-    attempt = 0
-    while attempt < PUSH_RETRY_ATTEMPTS:
+# ======== Main orchestration ========
+
+def _with_db_retry(what: str, fn):
+    """Runs fn under the prod_db breaker, retrying with jittered backoff. Returns None if every attempt failed."""
+    for attempt in range(1, DB_RETRY_ATTEMPTS + 1):
         try:
-            # send_push_notification(tokens=tokens, title=title, body=body)
-            logger.info("Sent %d tokens (title='%s')", len(tokens), title)
-            return True
+            with get_breaker("prod_db").guard():
+                return fn()
+        except LeaseLost:
+            raise
         except Exception as e:
-            attempt += 1
-            wait = PUSH_RETRY_BACKOFF * (2 ** (attempt - 1))
-            logger.warning("Push send failed (attempt %d/%d): %s. Retrying in %ds", attempt, PUSH_RETRY_ATTEMPTS, e, wait)
+            if attempt == DB_RETRY_ATTEMPTS:
+                logger.critical("%s failed after %d attempts: %s", what, DB_RETRY_ATTEMPTS, e)
+                return None
+            wait = backoff_delay(attempt, DB_RETRY_BACKOFF)
+            logger.warning("%s failed (attempt %d/%d): %s. Retrying in %.1fs", what, attempt, DB_RETRY_ATTEMPTS, e, wait)
             time.sleep(wait)
-    logger.error("Failed to send push after %d attempts", PUSH_RETRY_ATTEMPTS)
-    return False
 
 
-# ======== Main orchestration ========
+def _start_or_resume(engine, resume_run_id: Optional[str]) -> Optional[JobRun]:
+    with engine.connect() as conn:
+        if not resume_run_id:
+            run = JobRun.start(conn, JOB_NAME, datetime.now(timezone.utc))
+            logger.info("Started run %s (resume with --resume %s)", run.run_id, run.run_id)
+            return run
+        run = JobRun.load(conn, resume_run_id, JOB_NAME)
+    if run is None:
+        logger.error("No %s run with id %s", JOB_NAME, resume_run_id)
+    elif run.status == "done":
+        logger.info("Run %s already finished (%d batches); nothing to resume", run.run_id, run.batches)
+        return None
+    else:
+        logger.info("Resuming run %s after user %s (%d batches done)", run.run_id, run.last_key, run.batches)
+    return run
+
 
-def main():
+def plan_batch(users: List[UserRecord], check_date: datetime, activity: ActivityIndex,
+               cap: FrequencyCap, counters: Dict, profiler: RunProfiler = NO_PROFILER):
+    """
+    Classifies users and builds their nudges without sending anything. Returns
+    (schedules[time_slot][(title, body)] -> tokens, user ids scheduled).
+    """
+    schedules: Dict[str, Dict[Tuple[str, str], List[str]]] = {}
+    slots = counters.setdefault("slots", {})
+
+    scheduled_user_ids = []
+    with profiler.stage("classify_and_build"):
+        for u in users:
+            with profiler.user(u.user_id, f"streak={u.current_streak}"):
+                classify_user(u, check_date)
+                # Drop users already at their hourly/daily push cap before doing any work for them
+                if not cap.allow(u.user_id):
+                    counters["capped"] = counters.get("capped", 0) + 1
+                    continue
+                scheduled_user_ids.append(u.user_id)
+                u.schedule = SCHEDULE_INDEX[choose_schedule_type(u.app_type, u.plant_type)]
+                time_slot, default_body = SCHEDULE_RULES[SCHEDULE_KEYS[u.schedule]]
+
+                # Build personalized title/body
+                title, body = build_message_for_user(u, check_date, activity)
+                # If background_checks returned nothing useful, fall back to schedule message
+                if not title or not body:
+                    title = "Keep Growing"
+                    body = default_body
+
+                schedules.setdefault(time_slot, {}).setdefault((title, body), []).append(u.token)
+                slots[time_slot] = slots.get(time_slot, 0) + 1
+    return schedules, scheduled_user_ids
+
+
+def process_batch(users: List[UserRecord], check_date: datetime, activity: ActivityIndex,
+                  cap: FrequencyCap, retries: RetryScheduler, counters: Dict,
+                  profiler: RunProfiler = NO_PROFILER) -> Tuple[List, List[Dict]]:
+    """
+    Classifies, builds and sends nudges for one page of users. Returns (user ids delivered
+    to, pushes to queue for the digest); with DIGEST_WINDOW_SECONDS set nothing is sent here
+    and the pushes are queued with the batch's checkpoint instead.
+    """
+    schedules, scheduled_user_ids = plan_batch(users, check_date, activity, cap, counters, profiler)
+    scheduled = set(scheduled_user_ids)
+    owners = {u.token: u.user_id for u in users if u.user_id in scheduled}
+    counters["users"] = counters.get("users", 0) + len(users)
+
+    if DIGEST_WINDOW_SECONDS:
+        return [], [push(owners[token], token, title, body)
+                    for messages in schedules.values()
+                    for (title, body), tokens in messages.items()
+                    for token in tokens]
+
+    # Send: for each timeslot, group identical messages and batch. Failed tokens are parked
+    # in the retry queue and resent between batches; the queue is drained before the batch
+    # is checkpointed, so a committed batch never has sends still pending.
+    with profiler.stage("send"):
+        for time_slot, messages in schedules.items():
+            for (title, body), tokens in messages.items():
+                for i in range(0, len(tokens), MAX_BATCH):
+                    retries.submit(tokens[i:i + MAX_BATCH], title, body)
+                    retries.run_due()
+        retries.drain()
+
+    # Only delivered pushes count against the cap; rejected or abandoned tokens don't
+    return [owners[t] for t in retries.take_delivered() if t in owners], []
+
+
+def _load_run_state(engine, check_date: datetime, profiler: RunProfiler, cap: Optional[FrequencyCap] = None,
+                    user_range: Optional[Tuple[str, str]] = None):
+    """
+    Per-run state: activity bitmaps (replica) and delivery counts (primary, so sends
+    logged by other jobs moments ago still count - including this run's committed batches).
+    With `user_range` (start_after, end_at) only those users are loaded, into `cap` if given.
+    Returns (activity, cap), or None if the preload failed.
+    """
+    cap = cap or FrequencyCap(source="daily_nudges")
+
+    def load_state():
+        with get_read_engine(default=engine).connect() as conn:
+            activity = ActivityIndex.build(conn, check_date, user_range=user_range)
+        with engine.connect() as conn:
+            cap.preload(conn, user_range=user_range)
+        return activity
+
+    with profiler.stage("preload"):
+        activity = _with_db_retry("Activity/cap preload", load_state)
+    if activity is None:
+        return None
+    return activity, cap
+
+
+def _run_batches(engine, run: Union[JobRun, ShardLease], check_date: datetime, activity: ActivityIndex,
+                 cap: FrequencyCap, retries: RetryScheduler, profiler: RunProfiler = NO_PROFILER,
+                 start_after: str = FIRST_USER_ID, end_at: str = LAST_USER_ID,
+                 should_stop: Callable[[], bool] = lambda: False) -> bool:
+    """
+    Walks users in (start_after, end_at] by keyset on user_id, one committed checkpoint on
+    `run` per batch, continuing from its last checkpoint. Returns True once the range is done.
+    """
+    after = run.last_key or start_after
+    while not should_stop():
+        def fetch_page():
+            with get_read_engine(default=engine).connect() as conn:
+                return get_users_page(conn, after, NUDGE_BATCH_SIZE, end_at)
+
+        with profiler.stage("fetch_page"):
+            users = _with_db_retry("User page fetch", fetch_page)
+        if users is None:
+            return False
+        if not users:
+            return True
+
+        sent_to, queued = process_batch(users, check_date, activity, cap, retries, run.counters, profiler)
+        cap.record(sent_to)
+        last_key = str(users[-1].user_id)
+
+        def commit_batch():
+            with engine.connect() as conn:
+                logged = cap.flush(conn, commit=False)
+                # The digest flusher sends these and logs their deliveries
+                queue_pushes(conn, queued, "daily_nudges")
+                run.save(conn, last_key)
+            # Only now are the deliveries durable; until then a retry writes them again
+            cap.ack(logged)
+            return True
+
+        with profiler.stage("checkpoint"):
+            committed = _with_db_retry("Checkpoint", commit_batch)
+        if not committed:
+            logger.critical("Batch after %s was sent but not checkpointed", after)
+            return False
+        after = last_key
+        logger.info("Batch %d done (last user %s): %s", run.batches, last_key, run.counters)
+    return False
+
+
+def main(resume_run_id: Optional[str] = None, profiler: RunProfiler = NO_PROFILER):
     if not MAIN_DATABASE_URL:
         logger.error("MAIN_DATABASE_URL not set")
         return
 
     engine = create_engine(MAIN_DATABASE_URL)
-    check_date = datetime.now(timezone.utc)
-
-    # 1) Fetch users with DB retry
-    users = None
-    for attempt in range(1, DB_RETRY_ATTEMPTS + 1):
-        try:
-            with engine.connect() as conn:
-                users = get_all_users(conn)
-            break
-        except Exception as e:
-            wait = DB_RETRY_BACKOFF * (2 ** (attempt - 1))
-            logger.warning("DB fetch failed (attempt %d/%d): %s. Retrying in %ds", attempt, DB_RETRY_ATTEMPTS, e, wait)
-            time.sleep(wait)
-
-    if users is None:
-        logger.critical("Could not fetch users after %d attempts. Aborting.", DB_RETRY_ATTEMPTS)
+    run = _with_db_retry("Run checkpoint", lambda: _start_or_resume(engine, resume_run_id))
+    if run is None:
         return
+    check_date = run.check_date
 
-    logger.info("Fetched %d users", len(users))
+    state = _load_run_state(engine, check_date, profiler)
+    if state is None:
+        return
+    activity, cap = state
 
-    # 2) classify and annotate users
-    classified = [classify_user(u, check_date) for u in users]
+    retries = RetryScheduler(partial(send_in_lane, BULK), max_attempts=PUSH_RETRY_ATTEMPTS, base_delay=PUSH_RETRY_BACKOFF,
+                             track_delivered=True)
+    if not _run_batches(engine, run, check_date, activity, cap, retries, profiler):
+        logger.critical("Stopping; resume with --resume %s", run.run_id)
+        return
 
-    # 3) assign schedule and build personalized messages
-    # structure: schedules[time_slot][(title,body)] -> list of tokens
-    schedules: Dict[str, Dict[Tuple[str, str], List[str]]] = {}
+    with engine.connect() as conn:
+        run.finish(conn)
+    logger.info("Push retry stats: %s", retries.stats)
+    logger.info("Push lane stats: %s", lane_stats())
+    logger.info("Frequency cap stats: %s", cap.stats)
+    logger.info("Run %s done: %s", run.run_id, run.counters)
 
-    for u in classified:
-        schedule_key = choose_schedule_type(u["app_type"], u["plant_type"])
-        time_slot, default_body = SCHEDULE_RULES[schedule_key]
 
-        # Build personalized title/body
-        title, body = build_message_for_user(u, check_date)
-        # If background_checks returned nothing useful, fall back to schedule message
-        if not title or not body:
-            title = "Keep Growing"
-            body = default_body
+def main_sharded(run_key: str, shards: int = SHARD_COUNT, profiler: RunProfiler = NO_PROFILER):
+    """
+    One of several cooperating instances: every host started with the same run_key claims
+    user-id shards until none are left (see shard_leases.py). Re-running with the same
+    run_key picks up unfinished shards from their checkpoints.
+    """
+    if not MAIN_DATABASE_URL:
+        logger.error("MAIN_DATABASE_URL not set")
+        return
 
-        schedules.setdefault(time_slot, {}).setdefault((title, body), []).append(u["token"])
+    engine = create_engine(MAIN_DATABASE_URL)
+    coordinator = ShardCoordinator(JOB_NAME, run_key, shards)
 
-    # 4) send notifications: for each timeslot, group identical messages and batch
-    for time_slot, messages in schedules.items():
-        logger.info("Processing timeslot %s with %d distinct messages", time_slot, len(messages))
-        for (title, body), tokens in messages.items():
-            # chunk tokens into provider-friendly size
-            for i in range(0, len(tokens), MAX_BATCH):
-                batch = tokens[i:i + MAX_BATCH]
-                success = retry_send(batch, title, body)
-                if not success:
-                    # optionally persist failures to a dead-letter table or alerting system
-                    logger.error("Failed to send batch for timeslot %s; title=%s", time_slot, title)
+    def setup():
+        with engine.connect() as conn:
+            return coordinator.ensure(conn, datetime.now(timezone.utc))
 
-    logger.info("Done processing nudges for %s users", len(users))
+    check_date = _with_db_retry("Shard setup", setup)
+    if check_date is None:
+        return
+    # Shards are disjoint in users, so each lease loads only its own users' activity and caps
+    cap = FrequencyCap(source="daily_nudges")
+    retries = RetryScheduler(partial(send_in_lane, BULK), max_attempts=PUSH_RETRY_ATTEMPTS, base_delay=PUSH_RETRY_BACKOFF,
+                             track_delivered=True)
+
+    def process_shard(lease: ShardLease) -> bool:
+        state = _load_run_state(engine, check_date, profiler, cap, (lease.start_after, lease.end_at))
+        if state is None:
+            return False
+        finished = _run_batches(engine, lease, check_date, state[0], cap, retries, profiler,
+                                lease.start_after, lease.end_at, lease.lost.is_set)
+        if lease.lost.is_set():
+            raise LeaseLost(lease)
+        return finished
+
+    coordinator.run(engine, process_shard)
+    logger.info("Push retry stats: %s", retries.stats)
+    logger.info("Push lane stats: %s", lane_stats())
+    logger.info("Frequency cap stats: %s", cap.stats)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Send the daily nudges.")
+    parser.add_argument("--resume", metavar="RUN_ID", help="continue an interrupted run from its last checkpoint")
+    parser.add_argument("--shards", type=int, metavar="N",
+                        help="cooperate with other hosts on N user-id shards (all hosts must pass the same N and run key)")
+    parser.add_argument("--run-key", help="shared name of the sharded run (default: today's UTC date)")
+    parser.add_argument("--profile", action="store_true", help="profile the run and write a report")
+    parser.add_argument("--profile-out", metavar="PATH", help="report path (default profile-daily_nudges-<time>.txt)")
+    args = parser.parse_args()
+    if args.shards and args.resume:
+        parser.error("--resume is for single-host runs; rerun a sharded run with the same --run-key instead")
+
+    profiler = RunProfiler(JOB_NAME, enabled=args.profile)
+    profiler.start()
+    try:
+        if args.shards:
+            main_sharded(args.run_key or datetime.now(timezone.utc).strftime("%Y-%m-%d"), args.shards, profiler)
+        else:
+            main(args.resume, profiler)
+    finally:
+        report = profiler.report(args.profile_out)
+        if report:
+            logger.info("Profile report written to %s", report)
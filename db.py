@@ -1,6 +1,10 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, make_url, text
 from sqlalchemy.orm import sessionmaker, declarative_base
+import itertools
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()  # Load .env file
@@ -8,33 +12,236 @@ load_dotenv()  # Load .env file
 PROD_DATABASE_URL = os.getenv("PROD_DATABASE_URL")
 DEV_DATABASE_URL = os.getenv("DEV_DATABASE_URL")
 AI_DATABASE_URL = os.getenv("AI_DATABASE_URL")
+# asyncpg URL for the async paths; defaults to PROD_DATABASE_URL with the driver swapped.
+# Set it explicitly when the prod URL carries psycopg2-only query options (e.g. sslmode).
+ASYNC_PROD_DATABASE_URL = os.getenv("ASYNC_PROD_DATABASE_URL")
 
-# Production Database
-prod_engine = create_engine(PROD_DATABASE_URL)
-ProdSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=prod_engine)
+# Read replicas of the prod database, comma-separated. Batch reads opt in with get_db("replica").
+REPLICA_DATABASE_URLS = [u.strip() for u in os.getenv("REPLICA_DATABASE_URLS", "").split(",") if u.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "10"))
+# Friend fan-outs read through a server-side cursor on a second connection while their
+# session commits between chunks. Those cursors come from a pool of their own, so fan-outs
+# can't exhaust the main pool by each holding two of its connections. Size it to the
+# fan-out concurrency (PHASE_CHANGE_WORKERS); a fan-out beyond it waits for a cursor.
+STREAM_POOL_SIZE = int(os.getenv("STREAM_POOL_SIZE", "8"))
 
-# Development Database
-dev_engine = create_engine(DEV_DATABASE_URL)
-DevSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=dev_engine)
+logger = logging.getLogger(__name__)
 
-# AI Memory Database
-ai_engine = create_engine(AI_DATABASE_URL)
-AISessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=ai_engine)
+DATABASE_URLS = {"prod": PROD_DATABASE_URL, "dev": DEV_DATABASE_URL, "ai": AI_DATABASE_URL}
 
-# Database selection helper
+# Engines and session factories are created on first use, so importing this module
+# builds no engines and a script that only touches prod doesn't need the other URLs set.
+_engines = {}
+_session_factories = {}
+_engine_lock = threading.Lock()
+
+
+def get_engine(name='prod'):
+    engine = _engines.get(name)
+    if engine is None:
+        with _engine_lock:
+            engine = _engines.get(name)
+            if engine is None:
+                url = DATABASE_URLS.get(name)
+                if not url:
+                    raise RuntimeError(f"{name.upper()}_DATABASE_URL is not set")
+                engine = create_engine(url)
+                _session_factories[name] = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                _engines[name] = engine
+    return engine
+
+
+def get_streaming_engine():
+    """Prod engine reserved for long-lived server-side cursors: STREAM_POOL_SIZE connections, no overflow."""
+    engine = _engines.get("stream")
+    if engine is None:
+        with _engine_lock:
+            engine = _engines.get("stream")
+            if engine is None:
+                if not PROD_DATABASE_URL:
+                    raise RuntimeError("PROD_DATABASE_URL is not set")
+                engine = _engines["stream"] = create_engine(
+                    PROD_DATABASE_URL, pool_size=STREAM_POOL_SIZE, max_overflow=0, pool_pre_ping=True
+                )
+    return engine
+
+
+def _new_session(name):
+    get_engine(name)
+    return _session_factories[name]()
+
+
+def prewarm_engine(name='prod', connections=1):
+    """Opens `connections` pool connections up front and returns them to the pool."""
+    engine = get_engine(name)
+    opened = []
+    try:
+        for _ in range(connections):
+            conn = engine.connect()
+            conn.execute(text("SELECT 1"))
+            opened.append(conn)
+    finally:
+        for conn in opened:
+            conn.close()
+
+
+class ReplicaRouter:
+    """
+    Hands out read-only work to healthy replicas, round-robin. A replica is
+    healthy if it answers and its replay lag is under max_lag_seconds; health is
+    re-checked at most every check_interval seconds. With no healthy replica,
+    reads fall back to the primary.
+    """
+
+    LAG_QUERY = text("""
+        SELECT CASE WHEN pg_is_in_recovery()
+                    THEN COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+                    ELSE 0 END
+    """)
+
+    def __init__(self, replica_urls, max_lag_seconds=REPLICA_MAX_LAG_SECONDS, check_interval=REPLICA_HEALTH_INTERVAL):
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval = check_interval
+        self.replicas = [
+            {
+                "engine": create_engine(url, pool_pre_ping=True),
+                "healthy": True,
+                "lag": None,
+                "checked_at": 0.0,
+            }
+            for url in replica_urls
+        ]
+        for r in self.replicas:
+            r["sessions"] = sessionmaker(autocommit=False, autoflush=False, bind=r["engine"])
+        self._rr = itertools.count()
+        self._lock = threading.Lock()
+
+    def _check(self, replica):
+        """Probes one replica; returns its lag, or None if it didn't answer. Takes no lock."""
+        try:
+            with replica["engine"].connect() as conn:
+                return float(conn.execute(self.LAG_QUERY).scalar() or 0)
+        except Exception as e:
+            logger.warning("Replica %s health check failed: %s", replica["engine"].url.host, e)
+            return None
+
+    def healthy_replicas(self):
+        now = time.monotonic()
+        with self._lock:
+            # Claim the due checks so concurrent callers don't probe the same replica
+            due = [r for r in self.replicas if now - r["checked_at"] >= self.check_interval]
+            for replica in due:
+                replica["checked_at"] = now
+
+        # Probe outside the lock: a hung replica must not stall reads routed to the others
+        results = [(replica, self._check(replica)) for replica in due]
+
+        with self._lock:
+            for replica, lag in results:
+                healthy = lag is not None and lag <= self.max_lag_seconds
+                if healthy != replica["healthy"]:
+                    logger.warning("Replica %s is now %s (lag=%s)", replica["engine"].url.host,
+                                   "healthy" if healthy else "unhealthy", lag)
+                replica["lag"] = lag
+                replica["healthy"] = healthy
+                replica["checked_at"] = time.monotonic()
+            return [r for r in self.replicas if r["healthy"]]
+
+    def _pick(self):
+        healthy = self.healthy_replicas()
+        if not healthy:
+            return None
+        return healthy[next(self._rr) % len(healthy)]
+
+    def read_engine(self):
+        replica = self._pick()
+        return replica["engine"] if replica else None
+
+    def read_session(self):
+        replica = self._pick()
+        return replica["sessions"]() if replica else None
+
+    def status(self):
+        return [
+            {"host": r["engine"].url.host, "healthy": r["healthy"], "lag_seconds": r["lag"]}
+            for r in self.replicas
+        ]
+
+
+_replica_router = None
+
+
+def get_replica_router():
+    global _replica_router
+    if _replica_router is None:
+        with _engine_lock:
+            if _replica_router is None:
+                _replica_router = ReplicaRouter(REPLICA_DATABASE_URLS)
+    return _replica_router
+
+
+def get_read_engine(default=None):
+    """Engine for a read-only batch query: a healthy replica, else `default` (the prod engine)."""
+    return get_replica_router().read_engine() or default or get_engine('prod')
+
+
+_async_prod_engine = None
+_AsyncProdSessionLocal = None
+_async_lock = threading.Lock()
+
+
+def get_async_prod_engine():
+    """Async (asyncpg) engine for prod, created on first use."""
+    global _async_prod_engine, _AsyncProdSessionLocal
+    if _async_prod_engine is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        with _async_lock:
+            if _async_prod_engine is None:
+                url = ASYNC_PROD_DATABASE_URL or make_url(PROD_DATABASE_URL).set(drivername="postgresql+asyncpg")
+                _async_prod_engine = create_async_engine(url, pool_pre_ping=True)
+                _AsyncProdSessionLocal = async_sessionmaker(
+                    bind=_async_prod_engine, autoflush=False, expire_on_commit=False
+                )
+    return _async_prod_engine
+
+
+def get_async_streaming_engine():
+    """Async counterpart of get_streaming_engine, for the asyncpg fan-out."""
+    engine = _engines.get("async_stream")
+    if engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        with _async_lock:
+            engine = _engines.get("async_stream")
+            if engine is None:
+                url = ASYNC_PROD_DATABASE_URL or make_url(PROD_DATABASE_URL).set(drivername="postgresql+asyncpg")
+                engine = _engines["async_stream"] = create_async_engine(
+                    url, pool_size=STREAM_POOL_SIZE, max_overflow=0, pool_pre_ping=True
+                )
+    return engine
+
+
+def get_async_db():
+    """AsyncSession on prod; use as `async with get_async_db() as db:`."""
+    get_async_prod_engine()
+    return _AsyncProdSessionLocal()
+
+
+# Database selection helper. 'replica' is for read-only queries that tolerate
+# REPLICA_MAX_LAG_SECONDS of staleness; anything that writes must use 'prod'.
 def get_db(db_type='dev'):
-    if db_type == 'prod':
-        return ProdSessionLocal()
-    elif db_type == 'ai':
-        return AISessionLocal()
-    elif db_type == 'dev':
-        return DevSessionLocal()
+    if db_type in DATABASE_URLS:
+        return _new_session(db_type)
+    elif db_type == 'replica':
+        return get_replica_router().read_session() or _new_session('prod')
     else:
-        raise ValueError("Invalid database type. Use 'prod' or 'ai'.")
+        raise ValueError("Invalid database type. Use 'prod', 'replica', 'dev' or 'ai'.")
 
 # Dependency: Get Prod DB
 def get_prod_db():
-    db = ProdSessionLocal()
+    db = _new_session('prod')
     try:
         yield db
     finally:
@@ -42,7 +249,7 @@ def get_prod_db():
 
 # Dependency: Get Dev DB
 def get_dev_db():
-    db = DevSessionLocal()
+    db = _new_session('dev')
     try:
         yield db
     finally:
@@ -50,7 +257,7 @@ def get_dev_db():
 
 # Dependency: Get AI DB
 def get_ai_db():
-    db = AISessionLocal()
+    db = _new_session('ai')
     try:
         yield db
     finally:
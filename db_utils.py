@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta, timezone
 import os
+import threading
 from db import get_db
 from sqlalchemy import text
 from dotenv import load_dotenv
@@ -7,119 +8,151 @@ from typing import List, Dict, Any
 
 from collections import defaultdict
 import pytz
+from cachetools import TTLCache
+
+from user_records import UserRecord, SCHEDULE_INDEX
 
 
 
 load_dotenv()  
 
 
-def get_user_by_id(user_id: str):
+# Recent-activity limits for the personalization context
+POSTS_LIMIT = int(os.getenv("POSTS_LIMIT", "10"))
+LIKED_LIMIT = int(os.getenv("LIKED_LIMIT", "10"))
+COMMENTED_LIMIT = int(os.getenv("COMMENTED_LIMIT", "10"))
+VOYAGE_DAYS = 30
+
+# Optional per-user context cache; disabled when the TTL is 0
+USER_CONTEXT_CACHE_TTL = int(os.getenv("USER_CONTEXT_CACHE_TTL", "0"))
+USER_CONTEXT_CACHE_SIZE = int(os.getenv("USER_CONTEXT_CACHE_SIZE", "10000"))
+USER_CONTEXT_BATCH_SIZE = 500
+
+_user_context_cache = TTLCache(maxsize=USER_CONTEXT_CACHE_SIZE, ttl=max(USER_CONTEXT_CACHE_TTL, 1))
+_user_context_lock = threading.Lock()
+
+# user core + phase name, voyages last 30 days, recent posts, liked posts and
+# commented posts, all in one round trip
+USER_CONTEXT_QUERY = text(
+    """
+    SELECT  u.id, u.name, u.username, u.dob,
+            u.gender, u.pronouns, u.device_type,
+            p.name AS current_phase,
+            COALESCE(v.phases, '[]')           AS phases,
+            COALESCE(rp.recent_posts, '[]')    AS recent_posts,
+            COALESCE(lp.liked_posts, '[]')     AS liked_posts,
+            COALESCE(cp.commented_posts, '[]') AS commented_posts
+    FROM    users   AS u
+    LEFT JOIN phases AS p ON p.id = u.current_phase
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+                   'phase_id', v.phase_id::text,
+                   'name', vp.name,
+                   'timestamp', v.created_at
+               ) ORDER BY v.created_at DESC) AS phases
+        FROM   voyages v
+        JOIN   phases  vp ON vp.id = v.phase_id
+        WHERE  v.user_id = u.id
+          AND  v.deleted_at IS NULL
+          AND  v.created_at >= :since
+    ) v ON true
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+                   'post_id', x.id::text,
+                   'description', x.description,
+                   'timestamp', x.created_at
+               ) ORDER BY x.created_at DESC) AS recent_posts
+        FROM (
+            SELECT id, description, created_at
+            FROM   posts
+            WHERE  user_id = u.id AND deleted_at IS NULL
+            ORDER  BY created_at DESC
+            LIMIT  :posts_limit
+        ) x
+    ) rp ON true
+    LEFT JOIN LATERAL (
+        SELECT json_agg(x.description ORDER BY x.liked_at DESC NULLS LAST, x.created_at DESC) AS liked_posts
+        FROM (
+            SELECT lpp.description, pl.created_at AS liked_at, lpp.created_at
+            FROM   post_likes pl
+            JOIN   posts      lpp ON lpp.id = pl.post_id
+            WHERE  pl.user_id = u.id AND lpp.deleted_at IS NULL
+            ORDER  BY pl.created_at DESC NULLS LAST, lpp.created_at DESC
+            LIMIT  :liked_limit
+        ) x
+    ) lp ON true
+    LEFT JOIN LATERAL (
+        SELECT json_agg(x.description || ' – ' || x.comment ORDER BY x.created_at DESC) AS commented_posts
+        FROM (
+            SELECT cpp.description, c.comment, c.created_at
+            FROM   comments c
+            JOIN   posts    cpp ON cpp.id = c.post_id
+            WHERE  c.user_id = u.id AND cpp.deleted_at IS NULL
+            ORDER  BY c.created_at DESC
+            LIMIT  :commented_limit
+        ) x
+    ) cp ON true
+    WHERE   u.id = ANY(CAST(:uids AS uuid[]))
+    """
+)
+
+
+def _fetch_user_contexts(db, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    rows = db.execute(
+        USER_CONTEXT_QUERY,
+        {
+            "uids": list(user_ids),
+            "since": datetime.now(timezone.utc) - timedelta(days=VOYAGE_DAYS),
+            "posts_limit": POSTS_LIMIT,
+            "liked_limit": LIKED_LIMIT,
+            "commented_limit": COMMENTED_LIMIT,
+        },
+    ).mappings().all()
+    return {str(row["id"]): dict(row) for row in rows}
+
+
+def get_users_by_ids(user_ids: List[str], use_cache: bool = USER_CONTEXT_CACHE_TTL > 0) -> Dict[str, Dict[str, Any]]:
+    """
+    Batch version of get_user_by_id: one round trip per USER_CONTEXT_BATCH_SIZE users.
+    Returns { user_id: user_context } for the users that exist.
+    """
+    user_ids = [str(uid) for uid in user_ids]
+    found: Dict[str, Dict[str, Any]] = {}
+
+    if use_cache:
+        with _user_context_lock:
+            for uid in user_ids:
+                cached = _user_context_cache.get(uid)
+                if cached is not None:
+                    found[uid] = cached
+    missing = [uid for uid in dict.fromkeys(user_ids) if uid not in found]
+    if not missing:
+        return found
+
     db = get_db("prod")
     try:
-        # 1️⃣ user core + phase name -------------------------------------------------------------
-        user_row = (
-            db.execute(
-                text(
-                    """
-                    SELECT  u.id, u.name, u.username, u.dob,
-                            u.gender, u.pronouns, u.device_type,
-                            p.name AS current_phase
-                    FROM    users   AS u
-                    LEFT JOIN phases AS p ON p.id = u.current_phase
-                    WHERE   u.id = :uid
-                    """
-                ),
-                {"uid": user_id},
-            ).mappings().first()
-        )
-        if not user_row:
-            return None
-        user = dict(user_row)
-
-        # 2️⃣ voyages last 30 days --------------------------------------------------------------
-        since = datetime.now(timezone.utc) - timedelta(days=30)
-        voyages = db.execute(
-            text(
-                """
-                SELECT v.phase_id, v.created_at, p.name AS phase_name
-                FROM   voyages v
-                JOIN   phases  p ON p.id = v.phase_id
-                WHERE  v.user_id = :uid
-                  AND  v.deleted_at IS NULL
-                  AND  v.created_at >= :since
-                ORDER  BY v.created_at DESC
-                """
-            ),
-            {"uid": user_id, "since": since},
-        ).mappings().all()
-        user["phases"] = [
-            {
-                "phase_id": str(v["phase_id"]),
-                "name": v["phase_name"],
-                "timestamp": v["created_at"].isoformat() if v["created_at"] else None,
-            }
-            for v in voyages
-        ]
-
-        # 3️⃣ recent authored posts -------------------------------------------------------------
-        posts = db.execute(
-            text(
-                """
-                SELECT id, description, created_at
-                FROM   posts
-                WHERE  user_id = :uid AND deleted_at IS NULL
-                ORDER  BY created_at DESC
-                LIMIT  :lim
-                """
-            ),
-            {"uid": user_id, "lim": POSTS_LIMIT},
-        ).mappings().all()
-        user["recent_posts"] = [
-            {
-                "post_id": str(p["id"]),
-                "description": p["description"],
-                "timestamp": p["created_at"].isoformat() if p["created_at"] else None,
-            }
-            for p in posts
-        ]
-
-        # 4️⃣ liked posts (descriptions only) ---------------------------------------------------
-        liked = db.execute(
-            text(
-                """
-                SELECT p.description
-                FROM   post_likes pl
-                JOIN   posts      p ON p.id = pl.post_id
-                WHERE  pl.user_id = :uid AND p.deleted_at IS NULL
-                ORDER  BY pl.created_at DESC NULLS LAST, p.created_at DESC
-                LIMIT  :lim
-                """
-            ),
-            {"uid": user_id, "lim": LIKED_LIMIT},
-        ).all()
-        user["liked_posts"] = [row[0] for row in liked]
-
-        # 5️⃣ commented posts -------------------------------------------------------------------
-        comments = db.execute(
-            text(
-                """
-                SELECT p.description, c.comment
-                FROM   comments c
-                JOIN   posts    p ON p.id = c.post_id
-                WHERE  c.user_id = :uid AND p.deleted_at IS NULL
-                ORDER  BY c.created_at DESC
-                LIMIT  :lim
-                """
-            ),
-            {"uid": user_id, "lim": COMMENTED_LIMIT},
-        ).all()
-        user["commented_posts"] = [
-            f"{desc} – {comm}" for desc, comm in comments
-        ]
-
-        return user
+        for i in range(0, len(missing), USER_CONTEXT_BATCH_SIZE):
+            fetched = _fetch_user_contexts(db, missing[i:i + USER_CONTEXT_BATCH_SIZE])
+            found.update(fetched)
+            if use_cache:
+                with _user_context_lock:
+                    _user_context_cache.update(fetched)
     finally:
         db.close()
+    return found
+
+
+def get_user_by_id(user_id: str, use_cache: bool = USER_CONTEXT_CACHE_TTL > 0):
+    return get_users_by_ids([user_id], use_cache=use_cache).get(str(user_id))
+
+
+def invalidate_user_context(user_id: str = None):
+    """Drops one user's cached context, or the whole cache when user_id is None."""
+    with _user_context_lock:
+        if user_id is None:
+            _user_context_cache.clear()
+        else:
+            _user_context_cache.pop(str(user_id), None)
 
 
 
@@ -148,11 +181,11 @@ def get_all_users(db):
 
 
 
-def classify_user(row, check_date: datetime):
+def classify_user(row, check_date: datetime) -> UserRecord:
     now = check_date
-    last_streak = row.last_streak_date
-    last_watered = row.last_watered_date
-    current_streak = row.current_streak or 0
+    user = UserRecord.from_row(row)
+    last_streak = getattr(row, "last_streak_date", None)
+    last_watered = user.last_watered_date
 
     days_since_streak = (now - last_streak).days if last_streak else 999
     days_since_watered = (now - last_watered).days if last_watered else 999
@@ -177,50 +210,44 @@ def classify_user(row, check_date: datetime):
     else:
         plant_type = "neglected"
 
-    return {
-        "user_id": row.user_id,
-        "token": row.push_token,
-        "current_streak": current_streak,
-        "last_watered_date": last_watered,
-        "app_type": app_type,
-        "plant_type": plant_type
-    }
+    user.app_type = app_type
+    user.plant_type = plant_type
+    return user
+
 
 
+# Define schedule logic
+SCHEDULE_RULES = {
+    "lost_streak": ("8:00", "Your plant misses you 💔 Tap to water!"),
+    "inconsistent": ("12:00", "Keep going — you're so close!"),
+    "consistent": ("18:00", "You're on fire! Just one more day!"),
+    "not_started": ("14:00", "Your garden is waiting 🌱 Start today!")
+}
+
 
 def group_users_by_schedule(users, check_date: datetime):
     """
     Group users by notification time and message type.
     Returns: { "8:00": [users], "12:00": [users], ... }
+    Users are the same UserRecord objects, tagged with their schedule index;
+    the default body is SCHEDULE_RULES[user.schedule_key][1].
     """
-    # Define schedule logic
-    SCHEDULE_RULES = {
-        "lost_streak": ("8:00", "Your plant misses you 💔 Tap to water!"),
-        "inconsistent": ("12:00", "Keep going — you're so close!"),
-        "consistent": ("18:00", "You're on fire! Just one more day!"),
-        "not_started": ("14:00", "Your garden is waiting 🌱 Start today!")
-    }
-
     grouped = defaultdict(list)
 
     for user in users:
         # Use the most urgent type
-        urgency_type = user["app_type"] if user["app_type"] != "consistent" else user["plant_type"]
+        urgency_type = user.app_type if user.app_type != "consistent" else user.plant_type
 
         if urgency_type in ["losing_streak", "neglected"]:
             key = "lost_streak"
-        elif urgency_type == "inconsistent" or user["plant_type"] == "sad":
+        elif urgency_type == "inconsistent" or user.plant_type == "sad":
             key = "inconsistent"
-        elif urgency_type == "consistent" or user["plant_type"] == "thriving":
+        elif urgency_type == "consistent" or user.plant_type == "thriving":
             key = "consistent"
         else:
             key = "not_started"
 
-        time_slot, default_body = SCHEDULE_RULES[key]
-        grouped[time_slot].append({
-            "user_id": user["user_id"],
-            "token": user["token"],
-            "default_body": default_body
-        })
+        user.schedule = SCHEDULE_INDEX[key]
+        grouped[SCHEDULE_RULES[key][0]].append(user)
 
     return grouped
\ No newline at end of file
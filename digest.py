@@ -0,0 +1,187 @@
+"""
+Per-recipient push digests across every source. With DIGEST_WINDOW_SECONDS set, the
+daily nudges, run_checks and the phase-change fan-outs don't send; they `queue_pushes`
+into `pending_pushes` (migrations 0033-0034) in the same transaction as their own writes.
+A flusher (`flush_due`, run by the API lifespan or `python digest.py`) sends one merged
+push per recipient once the recipient's oldest item is DIGEST_WINDOW_SECONDS old or it
+has DIGEST_MAX_ITEMS items, and logs the deliveries for the frequency caps.
+
+With the window at 0 (the default) sources call `send_pushes` and push right away.
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import Future, wait
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from frequency_cap import log_deliveries
+from push_lanes import REALTIME, TRANSACTIONAL, BULK, submit_push
+from retry_queue import delivered_tokens, retryable_tokens
+
+# How long to hold a recipient's messages before merging them (0 = send immediately)
+DIGEST_WINDOW_SECONDS = float(os.getenv("DIGEST_WINDOW_SECONDS", "0"))
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", "5"))
+# Recipients claimed per flush pass, and how often the flusher looks for due ones
+DIGEST_FLUSH_BATCH = int(os.getenv("DIGEST_FLUSH_BATCH", "1000"))
+DIGEST_FLUSH_SECONDS = float(os.getenv("DIGEST_FLUSH_SECONDS", "1"))
+# Flushes a recipient's items survive while their token keeps failing retryably
+DIGEST_MAX_ATTEMPTS = int(os.getenv("DIGEST_MAX_ATTEMPTS", "3"))
+DIGEST_BODY_LINES = 3
+MULTICAST_LIMIT = 500
+
+LANE_PRIORITY = (REALTIME, TRANSACTIONAL, BULK)
+
+logger = logging.getLogger(__name__)
+
+# Every item of the oldest due recipients, locked so concurrent flushers split the work
+DUE_PUSHES_QUERY = text("""
+    WITH due AS (
+        SELECT token
+        FROM pending_pushes
+        GROUP BY token
+        HAVING MIN(created_at) <= NOW() - make_interval(secs => :window) OR COUNT(*) >= :max_items
+        ORDER BY MIN(created_at)
+        LIMIT :limit
+    )
+    SELECT p.id, p.user_id, p.token, p.title, p.body, p.data, p.lane, p.attempts
+    FROM pending_pushes p
+    JOIN due ON due.token = p.token
+    ORDER BY p.token, p.id
+    FOR UPDATE OF p SKIP LOCKED
+""")
+
+
+def merge_items(items: List[Dict]) -> Tuple[str, str, Dict[str, str]]:
+    """Merges pending items for one recipient into a single (title, body, data)."""
+    if len(items) == 1:
+        return items[0]["title"], items[0]["body"], items[0]["data"]
+
+    title = f"{items[0]['title']} (+{len(items) - 1} more)"
+    lines = [f"• {item['body']}" for item in items[:DIGEST_BODY_LINES]]
+    if len(items) > DIGEST_BODY_LINES:
+        lines.append(f"…and {len(items) - DIGEST_BODY_LINES} more")
+    data = {
+        "type": "digest",
+        "count": str(len(items)),
+        # FCM data values must be strings
+        "items": json.dumps([{"title": i["title"], "body": i["body"], **i["data"]} for i in items], ensure_ascii=False),
+    }
+    return title, "\n".join(lines), data
+
+
+def push(user_id, token: str, title: str, body: str, data: Optional[Dict[str, str]] = None, lane: str = BULK) -> Dict:
+    """One message for one recipient, as `queue_pushes` and `send_pushes` take them."""
+    return {"user_id": str(user_id), "token": token, "title": title, "body": body, "data": data or {}, "lane": lane}
+
+
+def queue_pushes(db, pushes: List[Dict], source: str):
+    """Adds pushes to pending_pushes in one INSERT ... SELECT unnest. Caller commits."""
+    if not pushes:
+        return
+    db.execute(
+        text("""
+            INSERT INTO pending_pushes (user_id, token, title, body, data, lane, source)
+            SELECT user_id, token, title, body, CAST(data AS jsonb), lane, :source
+            FROM unnest(CAST(:user_ids AS uuid[]), CAST(:tokens AS text[]), CAST(:titles AS text[]),
+                        CAST(:bodies AS text[]), CAST(:data AS text[]), CAST(:lanes AS text[]))
+                 AS t(user_id, token, title, body, data, lane)
+        """),
+        {
+            "user_ids": [p["user_id"] for p in pushes],
+            "tokens": [p["token"] for p in pushes],
+            "titles": [p["title"] for p in pushes],
+            "bodies": [p["body"] for p in pushes],
+            "data": [json.dumps(p["data"], ensure_ascii=False) for p in pushes],
+            "lanes": [p["lane"] for p in pushes],
+            "source": source,
+        },
+    )
+
+
+def _submit_merged(pushes: List[Dict]) -> List[Tuple[Future, List[str]]]:
+    """
+    Merges pushes per token, then sends recipients whose merged message is identical
+    together as multicasts on the highest-priority lane among their items.
+    """
+    by_token: Dict[str, List[Dict]] = {}
+    for p in pushes:
+        by_token.setdefault(p["token"], []).append(p)
+
+    groups: Dict[Tuple[str, str, str, str], List[str]] = {}
+    merged_data: Dict[str, Dict[str, str]] = {}
+    for token, items in by_token.items():
+        title, body, data = merge_items(items)
+        lane = min((i["lane"] for i in items), key=LANE_PRIORITY.index)
+        data_key = json.dumps(data, sort_keys=True)
+        merged_data[data_key] = data
+        groups.setdefault((lane, title, body, data_key), []).append(token)
+
+    sent = []
+    for (lane, title, body, data_key), tokens in groups.items():
+        for i in range(0, len(tokens), MULTICAST_LIMIT):
+            batch = tokens[i:i + MULTICAST_LIMIT]
+            sent.append((submit_push(lane, tokens=batch, title=title, body=body, data=merged_data[data_key]), batch))
+    return sent
+
+
+def send_pushes(pushes: List[Dict]) -> List[Future]:
+    """Sends now: one merged push per recipient, identical ones multicast. Returns the send Futures."""
+    return [future for future, _ in _submit_merged(pushes)]
+
+
+def flush_due(engine, window: float = DIGEST_WINDOW_SECONDS, max_items: int = DIGEST_MAX_ITEMS,
+              limit: int = DIGEST_FLUSH_BATCH) -> int:
+    """
+    Sends one merged push to each of up to `limit` due recipients. Their items are deleted,
+    and the deliveries logged, only once the sends have finished, in the transaction that
+    locked them. Items of tokens that failed retryably are held for another window, up to
+    DIGEST_MAX_ATTEMPTS times. Returns how many recipients were flushed.
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(DUE_PUSHES_QUERY, {"window": window, "max_items": max_items, "limit": limit}).mappings().all()
+        if not rows:
+            conn.rollback()
+            return 0
+
+        sent = _submit_merged([dict(r, data=r["data"] or {}) for r in rows])
+        wait([future for future, _ in sent])
+        delivered, retry = set(), set()
+        for future, tokens in sent:
+            result = future.result() if future.exception() is None else {"success": False, "error": str(future.exception())}
+            delivered.update(delivered_tokens(result))
+            retry.update(retryable_tokens(result, tokens))
+
+        kept = [r["id"] for r in rows if r["token"] in retry and r["attempts"] + 1 < DIGEST_MAX_ATTEMPTS]
+        kept_ids = set(kept)
+        conn.execute(text("DELETE FROM pending_pushes WHERE id = ANY(:ids)"),
+                     {"ids": [r["id"] for r in rows if r["id"] not in kept_ids]})
+        if kept:
+            # Restarting the window is the retry backoff
+            conn.execute(text("UPDATE pending_pushes SET attempts = attempts + 1, created_at = NOW() WHERE id = ANY(:ids)"),
+                         {"ids": kept})
+        log_deliveries(conn, sorted({str(r["user_id"]) for r in rows if r["token"] in delivered}), "digest")
+        conn.commit()
+    return len({r["token"] for r in rows})
+
+
+def run_flusher(engine, interval: float = DIGEST_FLUSH_SECONDS):
+    """Flushes due recipients forever; passes run back to back while a full batch is due."""
+    while True:
+        try:
+            if flush_due(engine) >= DIGEST_FLUSH_BATCH:
+                continue
+        except Exception:
+            logger.exception("Digest flush failed")
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    from db import get_engine
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not DIGEST_WINDOW_SECONDS:
+        raise SystemExit("DIGEST_WINDOW_SECONDS is 0: pushes are sent directly, nothing to flush")
+    run_flusher(get_engine("prod"))
@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+# Max pushes per user per sliding hour / day across every job (0 = no cap)
+FREQ_CAP_PER_HOUR = int(os.getenv("FREQ_CAP_PER_HOUR", "2"))
+FREQ_CAP_PER_DAY = int(os.getenv("FREQ_CAP_PER_DAY", "4"))
+# The caps read at most the previous day's window; older deliveries are pruned
+PUSH_DELIVERIES_RETENTION_DAYS = int(os.getenv("PUSH_DELIVERIES_RETENTION_DAYS", "3"))
+PRUNE_BATCH_SIZE = int(os.getenv("PRUNE_BATCH_SIZE", "10000"))
+
+HOUR = 3600
+DAY = 86400
+
+# state slots: [hour window index, this hour, previous hour, day window index, today, previous day]
+_H_IDX, _H_CUR, _H_PREV, _D_IDX, _D_CUR, _D_PREV = range(6)
+
+
+def _estimate(state: List[int], now: float, size: int, idx_slot: int) -> float:
+    """Sliding-window estimate: this window's count plus the overlapping share of the previous one."""
+    window = int(now // size)
+    cur, prev = state[idx_slot + 1], state[idx_slot + 2]
+    if state[idx_slot] != window:
+        # state is from an older window; shift it forward
+        prev = cur if state[idx_slot] == window - 1 else 0
+        cur = 0
+    elapsed = (now % size) / size
+    return cur + prev * (1 - elapsed)
+
+
+def _advance(state: List[int], now: float, size: int, idx_slot: int):
+    window = int(now // size)
+    if state[idx_slot] != window:
+        state[idx_slot + 2] = state[idx_slot + 1] if state[idx_slot] == window - 1 else 0
+        state[idx_slot + 1] = 0
+        state[idx_slot] = window
+
+
+def log_deliveries(db, user_ids: List, source: str, sent_at: Optional[datetime] = None):
+    """Appends deliveries to push_deliveries in one INSERT ... SELECT unnest. Caller commits."""
+    if not user_ids:
+        return
+    db.execute(
+        text("""
+            INSERT INTO push_deliveries (user_id, sent_at, source)
+            SELECT unnest(CAST(:user_ids AS uuid[])), :sent_at, :source
+        """),
+        {"user_ids": [str(u) for u in user_ids], "sent_at": sent_at or datetime.now(timezone.utc), "source": source},
+    )
+
+
+def prune_deliveries(db, days: int = PUSH_DELIVERIES_RETENTION_DAYS, batch_size: int = PRUNE_BATCH_SIZE) -> int:
+    """
+    Deletes deliveries older than `days` in batches of `batch_size`, committing each, so
+    the log stays about two days' worth of rows. Returns how many were deleted.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    deleted = 0
+    while True:
+        result = db.execute(
+            text("""
+                DELETE FROM push_deliveries
+                WHERE ctid = ANY(ARRAY(
+                    SELECT ctid FROM push_deliveries WHERE sent_at < :cutoff LIMIT :batch_size
+                ))
+            """),
+            {"cutoff": cutoff, "batch_size": batch_size},
+        )
+        db.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
+class FrequencyCap:
+    """
+    Per-user sliding-window counters (hour and day) with O(1) checks.
+    Preload once per job from push_deliveries, call `allow()` before each send,
+    `record()` with the users actually delivered to, and `flush()` to write the new
+    deliveries back in bulk.
+    """
+
+    def __init__(self, per_hour: int = FREQ_CAP_PER_HOUR, per_day: int = FREQ_CAP_PER_DAY,
+                 source: str = "batch", clock=time.time):
+        self.per_hour = per_hour
+        self.per_day = per_day
+        self.source = source
+        self.clock = clock
+        self._counters: Dict[str, List[int]] = {}
+        self._unlogged: List[str] = []
+        self._lock = threading.Lock()
+        self.stats = {"allowed": 0, "capped": 0}
+
+    def preload(self, db, user_ids: Optional[List] = None, user_range: Optional[Tuple[str, str]] = None):
+        """
+        Loads the current and previous hour/day counts for every user (or just `user_ids`, or
+        the users in `user_range` (start_after, end_at]) in one query.
+        """
+        now = self.clock()
+        hour, day = int(now // HOUR), int(now // DAY)
+        bounds = {
+            "prev_hour": datetime.fromtimestamp((hour - 1) * HOUR, timezone.utc),
+            "hour": datetime.fromtimestamp(hour * HOUR, timezone.utc),
+            "prev_day": datetime.fromtimestamp((day - 1) * DAY, timezone.utc),
+            "day": datetime.fromtimestamp(day * DAY, timezone.utc),
+        }
+        user_filter = ""
+        if user_ids is not None:
+            user_filter = "AND user_id = ANY(CAST(:user_ids AS uuid[]))"
+            bounds["user_ids"] = [str(u) for u in user_ids]
+        elif user_range is not None:
+            user_filter = "AND user_id > CAST(:start_after AS uuid) AND user_id <= CAST(:end_at AS uuid)"
+            bounds["start_after"], bounds["end_at"] = user_range
+        rows = db.execute(
+            text(f"""
+                SELECT user_id,
+                       COUNT(*) FILTER (WHERE sent_at >= :hour)                          AS hour_cur,
+                       COUNT(*) FILTER (WHERE sent_at >= :prev_hour AND sent_at < :hour) AS hour_prev,
+                       COUNT(*) FILTER (WHERE sent_at >= :day)                           AS day_cur,
+                       COUNT(*) FILTER (WHERE sent_at < :day)                            AS day_prev
+                FROM push_deliveries
+                WHERE sent_at >= :prev_day {user_filter}
+                GROUP BY user_id
+            """),
+            bounds,
+        )
+        with self._lock:
+            for user_id, hour_cur, hour_prev, day_cur, day_prev in rows:
+                self._counters[str(user_id)] = [hour, hour_cur, hour_prev, day, day_cur, day_prev]
+
+    def allow(self, user_id) -> bool:
+        """True if one more push to this user stays under both caps. Counts capped calls."""
+        now = self.clock()
+        with self._lock:
+            state = self._counters.get(str(user_id))
+            ok = state is None or (
+                (not self.per_hour or _estimate(state, now, HOUR, _H_IDX) < self.per_hour)
+                and (not self.per_day or _estimate(state, now, DAY, _D_IDX) < self.per_day)
+            )
+            self.stats["allowed" if ok else "capped"] += 1
+            return ok
+
+    def record(self, user_ids: List):
+        """Counts delivered sends to these users and queues them for the next `flush()`."""
+        now = self.clock()
+        with self._lock:
+            for user_id in user_ids:
+                user_id = str(user_id)
+                state = self._counters.get(user_id)
+                if state is None:
+                    state = self._counters[user_id] = [int(now // HOUR), 0, 0, int(now // DAY), 0, 0]
+                _advance(state, now, HOUR, _H_IDX)
+                _advance(state, now, DAY, _D_IDX)
+                state[_H_CUR] += 1
+                state[_D_CUR] += 1
+                self._unlogged.append(user_id)
+
+    def flush(self, db, commit: bool = True) -> List[str]:
+        """
+        Writes recorded deliveries to push_deliveries and commits. With commit=False the
+        caller commits; the rows stay queued until it calls `ack()` with the returned list,
+        so a failed commit just means the next flush writes them again.
+        """
+        with self._lock:
+            pending = list(self._unlogged)
+        if not pending:
+            return pending
+        log_deliveries(db, pending, self.source)
+        if commit:
+            db.commit()
+            self.ack(pending)
+        return pending
+
+    def ack(self, logged: List[str]):
+        """Drops deliveries returned by `flush(commit=False)` once their transaction has committed."""
+        with self._lock:
+            # record() only appends, so what flush() took is still the head of the queue
+            del self._unlogged[:len(logged)]
+
+
+if __name__ == "__main__":
+    # Daily: python frequency_cap.py
+    from db import get_engine
+
+    with get_engine("prod").connect() as conn:
+        print(f"🧹 Pruned {prune_deliveries(conn)} push deliveries older than {PUSH_DELIVERIES_RETENTION_DAYS} days")
@@ -0,0 +1,77 @@
+import json
+import uuid
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+
+class JobRun:
+    """
+    Checkpoint row in job_runs for a resumable batch job. `save()` is meant to run
+    in the same transaction as the batch's own writes, so a committed checkpoint
+    always matches the work that was committed with it.
+    """
+
+    def __init__(self, run_id: str, job: str, check_date: datetime, last_key: Optional[str] = None,
+                 batches: int = 0, counters: Optional[Dict] = None, status: str = "running"):
+        self.run_id = run_id
+        self.job = job
+        self.check_date = check_date
+        self.last_key = last_key
+        self.batches = batches
+        self.counters = counters or {}
+        self.status = status
+
+    @classmethod
+    def start(cls, db, job: str, check_date: datetime) -> "JobRun":
+        run = cls(str(uuid.uuid4()), job, check_date)
+        db.execute(
+            text("INSERT INTO job_runs (run_id, job, check_date) VALUES (:run_id, :job, :check_date)"),
+            {"run_id": run.run_id, "job": job, "check_date": check_date},
+        )
+        db.commit()
+        return run
+
+    @classmethod
+    def load(cls, db, run_id: str, job: str) -> Optional["JobRun"]:
+        row = db.execute(
+            text("""
+                SELECT run_id, job, check_date, last_key, batches, counters, status
+                FROM job_runs WHERE run_id = :run_id AND job = :job
+            """),
+            {"run_id": run_id, "job": job},
+        ).mappings().first()
+        if not row:
+            return None
+        counters = row["counters"]
+        if isinstance(counters, str):
+            counters = json.loads(counters)
+        return cls(str(row["run_id"]), row["job"], row["check_date"], row["last_key"],
+                   row["batches"], counters, row["status"])
+
+    def save(self, db, last_key: str):
+        """
+        Records a finished batch and commits, together with whatever the batch wrote on
+        `db`. State on this object only advances once the commit succeeded.
+        """
+        db.execute(
+            text("""
+                UPDATE job_runs
+                SET last_key = :last_key, batches = :batches, counters = CAST(:counters AS jsonb), updated_at = NOW()
+                WHERE run_id = :run_id
+            """),
+            {"run_id": self.run_id, "last_key": last_key, "batches": self.batches + 1,
+             "counters": json.dumps(self.counters)},
+        )
+        db.commit()
+        self.last_key = last_key
+        self.batches += 1
+
+    def finish(self, db):
+        self.status = "done"
+        db.execute(
+            text("UPDATE job_runs SET status = 'done', updated_at = NOW() WHERE run_id = :run_id"),
+            {"run_id": self.run_id},
+        )
+        db.commit()
@@ -1,13 +1,69 @@
-from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 
-from requests import Session
-from db import get_db
-from notifier import send_push_notification
+from db import get_db, get_engine, get_prod_db, get_replica_router
+from digest import DIGEST_FLUSH_BATCH, DIGEST_FLUSH_SECONDS, DIGEST_WINDOW_SECONDS, flush_due
+from notifier import PUSH_OUTBOX_PATH, replay_outbox, send_push_notification
 from usecases.phase_change import process_phase_change
+from usecases.phase_change_async import process_phase_change_async
+from usecases.inbox import list_notifications, mark_read
+from user_db_utils import invalidate_user
+from circuit_breaker import breaker_states
+from push_lanes import lane_stats
+from task_pool import PoolFull, get_phase_change_pool, pool_stats
+from startup import prewarm_async
+
+# Run phase-change fan-outs on the event loop (asyncpg + async FCM) instead of the threadpool
+PHASE_CHANGE_ASYNC = os.getenv("PHASE_CHANGE_ASYNC", "0") == "1"
+# How often to retry sends spilled to PUSH_OUTBOX_PATH while the FCM breaker was open
+PUSH_OUTBOX_REPLAY_SECONDS = float(os.getenv("PUSH_OUTBOX_REPLAY_SECONDS", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+async def _replay_outbox_forever():
+    while True:
+        await asyncio.sleep(PUSH_OUTBOX_REPLAY_SECONDS)
+        try:
+            replayed = await asyncio.to_thread(replay_outbox)
+            if replayed:
+                logger.info("Replayed %d spilled notifications", replayed)
+        except Exception:
+            logger.exception("Outbox replay failed")
+
 
-app = FastAPI()
+async def _flush_digests_forever():
+    engine = get_engine("prod")
+    while True:
+        try:
+            if await asyncio.to_thread(flush_due, engine) >= DIGEST_FLUSH_BATCH:
+                continue
+        except Exception:
+            logger.exception("Digest flush failed")
+        await asyncio.sleep(DIGEST_FLUSH_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Engines and the push transport are lazy; warm them before taking traffic
+    await prewarm_async(async_path=PHASE_CHANGE_ASYNC)
+    tasks = []
+    if PUSH_OUTBOX_PATH:
+        tasks.append(asyncio.create_task(_replay_outbox_forever()))
+    if DIGEST_WINDOW_SECONDS:
+        tasks.append(asyncio.create_task(_flush_digests_forever()))
+    yield
+    for task in tasks:
+        task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 
 class NotificationRequest(BaseModel):
     tokens: List[str]
@@ -16,6 +72,9 @@ class NotificationRequest(BaseModel):
     image: Optional[str] = None
     data: Optional[Dict[str, str]] = None
 
+class MarkReadRequest(BaseModel):
+    ids: Optional[List[str]] = None  # omit to mark everything read
+
 @app.post("/send-notifications")
 def send_notification(req: NotificationRequest):
     result = send_push_notification(
@@ -27,6 +86,12 @@ def send_notification(req: NotificationRequest):
     )
 
     if not result.get("success"):
+        if result.get("retry_after") is not None:
+            raise HTTPException(
+                status_code=503,
+                detail=result.get("error"),
+                headers={"Retry-After": str(max(1, int(result["retry_after"])))},
+            )
         raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
 
     return result
@@ -36,12 +101,60 @@ def send_notification(req: NotificationRequest):
 @app.post("/send-phase-notifications")
 async def send_phase_notifications(
     previous_phase_name: str,
-    background_tasks: BackgroundTasks,
     user_id: str = None  # replace with your auth layer
 ):
-    background_tasks.add_task(
-        process_phase_change,
-        user_id=user_id,
-        previous_phase=previous_phase_name
-    )
-    return {"message": "Notifications processing started"}
\ No newline at end of file
+    # The user's phase just changed, so their cached profile is stale
+    invalidate_user(user_id)
+    # Bounded pool instead of BackgroundTasks: a spike gets 429s, not an unbounded backlog
+    # in this web worker. Coroutines run on the loop, plain functions on the pool's threads.
+    try:
+        get_phase_change_pool().submit(
+            process_phase_change_async if PHASE_CHANGE_ASYNC else process_phase_change,
+            user_id=user_id,
+            previous_phase=previous_phase_name
+        )
+    except PoolFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, int(e.retry_after)))},
+        )
+    return {"message": "Notifications processing started"}
+
+
+@app.get("/users/{user_id}/notifications")
+def get_notifications(user_id: str, limit: int = 20, cursor: Optional[str] = None, db=Depends(get_prod_db)):
+    try:
+        return list_notifications(db, user_id, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@app.post("/users/{user_id}/notifications/read")
+def read_notifications(user_id: str, req: MarkReadRequest, db=Depends(get_prod_db)):
+    try:
+        return {"marked_read": mark_read(db, user_id, req.ids)}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid notification id")
+
+
+@app.get("/health/breakers")
+def get_breaker_states():
+    return breaker_states()
+
+
+@app.get("/health/lanes")
+def get_lane_stats():
+    return lane_stats()
+
+
+@app.get("/health/tasks")
+def get_task_stats():
+    return pool_stats()
+
+
+@app.get("/health/replicas")
+def get_replica_status():
+    router = get_replica_router()
+    router.healthy_replicas()
+    return router.status()
@@ -0,0 +1,509 @@
+"""
+Schema migrations owned by this service, plus a query-plan check for the hot queries.
+
+    python migrations.py                 # apply pending migrations to PROD_DATABASE_URL
+    python migrations.py --check-plans   # load synthetic data into PLAN_CHECK_DATABASE_URL and EXPLAIN
+"""
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PLAN_CHECK_DATABASE_URL = os.getenv("PLAN_CHECK_DATABASE_URL")
+
+# (id, statement). Applied in order, each exactly once, outside a transaction so
+# CREATE INDEX CONCURRENTLY does not lock the hot tables.
+MIGRATIONS: List[Tuple[str, str]] = [
+    # badge_checks weekly/monthly windows: user_id + streak_date range
+    ("0001_user_streaks_user_date", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_streaks_user_id_streak_date
+        ON user_streaks (user_id, streak_date)
+    """),
+    # badge_checks night owl / early bird: user_id + streak_date::time
+    # (streak_date is timestamp without time zone, so the cast is immutable)
+    ("0002_user_streaks_user_time", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_streaks_user_id_streak_time
+        ON user_streaks (user_id, (streak_date::time))
+    """),
+    # user_db_utils.get_friends, both directions
+    ("0003_friends_user_status", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_friends_user_id_request_status
+        ON friends (user_id, request_status) INCLUDE (friend_id)
+    """),
+    ("0004_friends_friend_status", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_friends_friend_id_request_status
+        ON friends (friend_id, request_status) INCLUDE (user_id)
+    """),
+    # daily_nudges.get_all_users, checks.check_user_plant_progress
+    ("0005_user_plants_user_active", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_plants_user_id_is_active
+        ON user_plants (user_id, is_active)
+    """),
+    # checks.check_user_badge_progress
+    ("0006_user_badges_user", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_badges_user_id
+        ON user_badges (user_id)
+    """),
+    ("0007_badge_progress_user", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_badge_progress_user_id
+        ON badge_progress (user_id)
+    """),
+    # badge_checks badge lookups by name
+    ("0008_badges_name", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_badges_name
+        ON badges (name)
+    """),
+    # user_db_utils.get_user_by_name / get_user_by_username
+    ("0009_users_name", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_name
+        ON users (name)
+    """),
+    ("0010_users_username", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_username
+        ON users (username)
+    """),
+    # daily_nudges.get_all_users joins garden_stats per user
+    ("0011_garden_stats_user", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_garden_stats_user_id
+        ON garden_stats (user_id)
+    """),
+    # db_utils user context: per-user recent voyages, posts, likes and comments
+    ("0012_voyages_user_created", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_voyages_user_id_created_at
+        ON voyages (user_id, created_at DESC) WHERE deleted_at IS NULL
+    """),
+    ("0013_posts_user_created", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_user_id_created_at
+        ON posts (user_id, created_at DESC) WHERE deleted_at IS NULL
+    """),
+    ("0014_post_likes_user_created", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_post_likes_user_id_created_at
+        ON post_likes (user_id, created_at DESC NULLS LAST)
+    """),
+    ("0015_comments_user_created", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_comments_user_id_created_at
+        ON comments (user_id, created_at DESC)
+    """),
+    # frequency_cap delivery log
+    ("0016_push_deliveries", """
+        CREATE TABLE IF NOT EXISTS push_deliveries (
+            user_id UUID NOT NULL,
+            sent_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            source TEXT NOT NULL
+        )
+    """),
+    ("0017_push_deliveries_sent_at", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_push_deliveries_sent_at
+        ON push_deliveries (sent_at)
+    """),
+    # inbox read path: keyset pagination on (created_at, id) per recipient
+    ("0018_notifications_read_at", """
+        ALTER TABLE notifications ADD COLUMN IF NOT EXISTS read_at TIMESTAMPTZ
+    """),
+    ("0019_notifications_inbox", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_notifications_to_user_id_created_at_id
+        ON notifications (to_user_id, created_at DESC, id DESC)
+    """),
+    ("0020_notification_unread_counts", """
+        CREATE TABLE IF NOT EXISTS notification_unread_counts (
+            user_id UUID PRIMARY KEY,
+            unread INTEGER NOT NULL DEFAULT 0
+        )
+    """),
+    ("0021_notification_unread_counts_backfill", """
+        INSERT INTO notification_unread_counts (user_id, unread)
+        SELECT to_user_id, COUNT(*) FROM notifications WHERE read_at IS NULL GROUP BY to_user_id
+        ON CONFLICT (user_id) DO NOTHING
+    """),
+    # resumable batch runs: one row per run, updated in the same transaction as each batch
+    ("0022_job_runs", """
+        CREATE TABLE IF NOT EXISTS job_runs (
+            run_id UUID PRIMARY KEY,
+            job TEXT NOT NULL,
+            check_date TIMESTAMPTZ NOT NULL,
+            last_key TEXT,
+            batches INTEGER NOT NULL DEFAULT 0,
+            counters JSONB NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL DEFAULT 'running',
+            started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """),
+    # event-driven badge checks: NOTIFY user_activity with the user id when a user crosses a
+    # threshold the checks report on. The checks are state-based, so a NOTIFY per write would
+    # re-send the same progress push on every watering. (Postgres folds identical payloads
+    # within one transaction into a single notification.)
+    ("0023_notify_user_activity_fn", """
+        CREATE OR REPLACE FUNCTION notify_user_activity() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('user_activity', NEW.user_id::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """),
+    ("0024_notify_badge_progress_fn", """
+        CREATE OR REPLACE FUNCTION notify_badge_progress() RETURNS trigger AS $$
+        DECLARE
+            required numeric;
+        BEGIN
+            SELECT required_progress INTO required FROM badges WHERE id = NEW.badge_id;
+            IF required IS NULL THEN
+                RETURN NULL;
+            END IF;
+            -- crossing "almost there" (90%) or "earned" (100%), as in checks.check_user_badge_progress
+            IF (TG_OP = 'INSERT' AND NEW.progress >= required * 0.9)
+               OR (TG_OP = 'UPDATE' AND (
+                    (OLD.progress < required * 0.9 AND NEW.progress >= required * 0.9)
+                    OR (OLD.progress < required AND NEW.progress >= required))) THEN
+                PERFORM pg_notify('user_activity', NEW.user_id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """),
+    ("0025_badge_progress_notify", """
+        CREATE OR REPLACE TRIGGER badge_progress_notify_activity
+        AFTER INSERT OR UPDATE OF progress ON badge_progress
+        FOR EACH ROW EXECUTE FUNCTION notify_badge_progress()
+    """),
+    # checks.check_user_plant_progress: reaching a 6-day water streak or the medium stage
+    ("0026_user_plants_notify", """
+        CREATE OR REPLACE TRIGGER user_plants_notify_activity
+        AFTER UPDATE ON user_plants
+        FOR EACH ROW
+        WHEN (NEW.is_active AND (
+            (NEW.water_streak = 6 AND OLD.water_streak IS DISTINCT FROM 6)
+            OR (NEW.current_stage = 'medium' AND OLD.current_stage IS DISTINCT FROM 'medium')))
+        EXECUTE FUNCTION notify_user_activity()
+    """),
+    # multi-host batch runs: one lease row per (job, run_key, shard), see shard_leases.py
+    ("0027_job_shards", """
+        CREATE TABLE IF NOT EXISTS job_shards (
+            job TEXT NOT NULL,
+            run_key TEXT NOT NULL,
+            shard INTEGER NOT NULL,
+            start_after UUID NOT NULL,
+            end_at UUID NOT NULL,
+            check_date TIMESTAMPTZ NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            owner TEXT,
+            lease_until TIMESTAMPTZ,
+            last_key TEXT,
+            batches INTEGER NOT NULL DEFAULT 0,
+            counters JSONB NOT NULL DEFAULT '{}',
+            started_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (job, run_key, shard)
+        )
+    """),
+    # notifications becomes range-partitioned by month on created_at (notification_partitions.py
+    # keeps partitions ahead and expires old ones). The existing table is attached as one
+    # legacy partition; the NOT VALID check + separate VALIDATE let both SET NOT NULL and
+    # ATTACH skip their full-table scans while holding the exclusive lock.
+    ("0028_notifications_created_at_backfill", """
+        UPDATE notifications SET created_at = COALESCE(updated_at, NOW()) WHERE created_at IS NULL
+    """),
+    ("0029_notifications_id_created_at", """
+        CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_notifications_id_created_at
+        ON notifications (id, created_at)
+    """),
+    ("0030_notifications_legacy_bounds", """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'notifications'::regclass)
+               OR EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'notifications_legacy_bounds') THEN
+                RETURN;
+            END IF;
+            -- two months of headroom: the swap below must run before rows reach the bound
+            EXECUTE format(
+                'ALTER TABLE notifications ADD CONSTRAINT notifications_legacy_bounds '
+                'CHECK (created_at IS NOT NULL AND created_at < %L) NOT VALID',
+                (date_trunc('month', NOW() AT TIME ZONE 'UTC') + interval '2 months') AT TIME ZONE 'UTC'
+            );
+        END;
+        $$
+    """),
+    ("0031_notifications_legacy_bounds_validate", """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'notifications'::regclass) THEN
+                ALTER TABLE notifications VALIDATE CONSTRAINT notifications_legacy_bounds;
+            END IF;
+        END;
+        $$
+    """),
+    ("0032_notifications_partitioned", """
+        DO $$
+        DECLARE
+            legacy_upper timestamptz;
+            month_start timestamp;  -- UTC wall time, so month arithmetic ignores the session zone
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'notifications'::regclass) THEN
+                RETURN;
+            END IF;
+            SELECT CAST((regexp_match(pg_get_constraintdef(oid), '< ''([^'']+)'''))[1] AS timestamptz)
+            INTO legacy_upper
+            FROM pg_constraint
+            WHERE conname = 'notifications_legacy_bounds' AND conrelid = 'notifications'::regclass;
+
+            ALTER TABLE notifications ALTER COLUMN created_at SET NOT NULL;
+            ALTER TABLE notifications RENAME TO notifications_legacy;
+            CREATE TABLE notifications (LIKE notifications_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (created_at);
+            ALTER TABLE notifications ADD CONSTRAINT notifications_partitioned_pkey PRIMARY KEY (id, created_at);
+            CREATE INDEX ix_notifications_inbox ON notifications (to_user_id, created_at DESC, id DESC);
+            -- reuses ux_notifications_id_created_at and ix_notifications_to_user_id_created_at_id
+            EXECUTE format(
+                'ALTER TABLE notifications ATTACH PARTITION notifications_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+                legacy_upper
+            );
+
+            month_start := legacy_upper AT TIME ZONE 'UTC';
+            FOR i IN 1..3 LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF notifications FOR VALUES FROM (%L) TO (%L)',
+                    'notifications_' || to_char(month_start, '"y"YYYY"m"MM'),
+                    month_start AT TIME ZONE 'UTC', (month_start + interval '1 month') AT TIME ZONE 'UTC'
+                );
+                month_start := month_start + interval '1 month';
+            END LOOP;
+        END;
+        $$
+    """),
+    # cross-source push digests: pending messages per recipient until digest.flush_due sends them
+    ("0033_pending_pushes", """
+        CREATE TABLE IF NOT EXISTS pending_pushes (
+            id BIGSERIAL PRIMARY KEY,
+            user_id UUID NOT NULL,
+            token TEXT NOT NULL,
+            title TEXT NOT NULL,
+            body TEXT NOT NULL,
+            data JSONB NOT NULL DEFAULT '{}',
+            lane TEXT NOT NULL,
+            source TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """),
+    ("0034_pending_pushes_token", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pending_pushes_token_created_at
+        ON pending_pushes (token, created_at)
+    """),
+]
+
+
+def apply_migrations(engine) -> List[str]:
+    """Applies pending migrations and returns the ids that were applied."""
+    applied = []
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                id TEXT PRIMARY KEY,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """))
+        done = set(conn.execute(text("SELECT id FROM schema_migrations")).scalars().all())
+
+        for migration_id, statement in MIGRATIONS:
+            if migration_id in done:
+                continue
+            conn.execute(text(statement))
+            conn.execute(text("INSERT INTO schema_migrations (id) VALUES (:id)"), {"id": migration_id})
+            applied.append(migration_id)
+            print(f"✅ Applied {migration_id}")
+    return applied
+
+
+# ======== Query-plan check ========
+
+# Minimal versions of the tables the hot queries touch; only used on a scratch database.
+SYNTHETIC_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS phases (id UUID PRIMARY KEY, name TEXT);
+    CREATE TABLE IF NOT EXISTS users (
+        id UUID PRIMARY KEY, name TEXT, username TEXT, push_token TEXT, current_phase UUID,
+        dob DATE, gender TEXT, pronouns TEXT, device_type TEXT
+    );
+    CREATE TABLE IF NOT EXISTS friends (
+        id UUID PRIMARY KEY, user_id UUID, friend_id UUID, request_status TEXT
+    );
+    CREATE TABLE IF NOT EXISTS user_streaks (id UUID PRIMARY KEY, user_id UUID, streak_date TIMESTAMP);
+    CREATE TABLE IF NOT EXISTS user_plants (
+        id UUID PRIMARY KEY, user_id UUID, name TEXT, current_stage TEXT,
+        water_streak INT, last_watered_date DATE, is_active BOOLEAN
+    );
+    CREATE TABLE IF NOT EXISTS garden_stats (id UUID PRIMARY KEY, user_id UUID, current_streak INT);
+    CREATE TABLE IF NOT EXISTS badges (
+        id UUID PRIMARY KEY, name TEXT, required_progress INT, rarity TEXT
+    );
+    CREATE TABLE IF NOT EXISTS badge_progress (id UUID PRIMARY KEY, user_id UUID, badge_id UUID, progress INT);
+    CREATE TABLE IF NOT EXISTS user_badges (user_id UUID, badge_id UUID, awarded_at TIMESTAMPTZ);
+    CREATE TABLE IF NOT EXISTS voyages (
+        id UUID PRIMARY KEY, user_id UUID, phase_id UUID, created_at TIMESTAMPTZ, deleted_at TIMESTAMPTZ
+    );
+    CREATE TABLE IF NOT EXISTS posts (
+        id UUID PRIMARY KEY, user_id UUID, description TEXT, created_at TIMESTAMPTZ, deleted_at TIMESTAMPTZ
+    );
+    CREATE TABLE IF NOT EXISTS post_likes (id UUID PRIMARY KEY, user_id UUID, post_id UUID, created_at TIMESTAMPTZ);
+    CREATE TABLE IF NOT EXISTS comments (
+        id UUID PRIMARY KEY, user_id UUID, post_id UUID, comment TEXT, created_at TIMESTAMPTZ
+    );
+    CREATE TABLE IF NOT EXISTS notifications (
+        id UUID PRIMARY KEY, to_user_id UUID, from_user_id UUID, message TEXT, type TEXT, type_id UUID,
+        created_at TIMESTAMPTZ DEFAULT NOW(), updated_at TIMESTAMPTZ
+    );
+"""
+
+SYNTHETIC_DATA = """
+    INSERT INTO phases SELECT gen_random_uuid(), 'phase ' || g FROM generate_series(1, 8) g;
+    INSERT INTO users
+        SELECT gen_random_uuid(), 'name ' || g, 'user' || g,
+               CASE WHEN g % 4 = 0 THEN NULL ELSE 'token-' || g END,
+               (SELECT id FROM phases LIMIT 1)
+        FROM generate_series(1, :users) g;
+    INSERT INTO friends
+        SELECT gen_random_uuid(), a.id, b.id, CASE WHEN random() < 0.8 THEN 'accept' ELSE 'pending' END
+        FROM (SELECT id, row_number() OVER () AS rn FROM users) a
+        CROSS JOIN generate_series(1, 10) AS s(k)
+        JOIN (SELECT id, row_number() OVER () AS rn FROM users) b
+          ON b.rn = (a.rn * 7 + s.k) % :users + 1;
+    INSERT INTO user_streaks
+        SELECT gen_random_uuid(), u.id, NOW() - (d || ' days')::interval - (random() * 86400 || ' seconds')::interval
+        FROM users u CROSS JOIN generate_series(0, 59) d;
+    INSERT INTO user_plants
+        SELECT gen_random_uuid(), u.id, 'plant', 'small', (random() * 10)::int,
+               CURRENT_DATE - (random() * 5)::int, p = 1
+        FROM users u CROSS JOIN generate_series(1, 3) p;
+    INSERT INTO garden_stats SELECT gen_random_uuid(), id, (random() * 30)::int FROM users;
+    INSERT INTO badges SELECT gen_random_uuid(), 'badge ' || g, 100, 'common' FROM generate_series(1, 200) g;
+    INSERT INTO badge_progress
+        SELECT gen_random_uuid(), u.id, b.id, (random() * 100)::int
+        FROM users u CROSS JOIN (SELECT id FROM badges LIMIT 5) b;
+    INSERT INTO user_badges
+        SELECT u.id, b.id, NOW() FROM users u CROSS JOIN (SELECT id FROM badges LIMIT 3) b;
+    INSERT INTO voyages
+        SELECT gen_random_uuid(), u.id, (SELECT id FROM phases LIMIT 1), NOW() - (d || ' days')::interval, NULL
+        FROM users u CROSS JOIN generate_series(0, 4) d;
+    INSERT INTO posts
+        SELECT gen_random_uuid(), u.id, 'post ' || d, NOW() - (d || ' days')::interval, NULL
+        FROM users u CROSS JOIN generate_series(0, 4) d;
+    INSERT INTO post_likes
+        SELECT gen_random_uuid(), u.id, p.id, NOW() FROM users u
+        JOIN LATERAL (SELECT id FROM posts WHERE posts.user_id <> u.id LIMIT 3) p ON true;
+    INSERT INTO comments
+        SELECT gen_random_uuid(), p.user_id, p.id, 'comment', p.created_at FROM posts p;
+    INSERT INTO notifications (id, to_user_id, from_user_id, message, type, type_id, created_at)
+        SELECT gen_random_uuid(), u.id, u.id, 'message', 'profile', u.id, NOW() - (d || ' days')::interval
+        FROM users u CROSS JOIN generate_series(0, 19) d;
+"""
+
+
+def hot_queries() -> Dict[str, str]:
+    """
+    {name: SQL} of the per-user queries whose plans must use an index: every statement in
+    the `statements` registry plus the per-user query constants below. They are imported,
+    not copied, so the check always EXPLAINs the SQL the app runs. Full passes by design
+    (daily_nudges.get_users_page walks users in id order, activity_index.ACTIVITY_SCAN_QUERY
+    reads all of user_streaks) are left out.
+    """
+    import badge_checks  # noqa: F401 - registers the streak and badge statements
+    import user_db_utils  # noqa: F401 - registers the profile and friends statements
+    from checks import ACTIVE_PLANTS_QUERY, BADGE_PROGRESS_QUERY, EARNED_BADGES_QUERY
+    from db_utils import USER_CONTEXT_QUERY
+    from statements import STATEMENTS
+    from usecases.inbox import FIRST_PAGE_QUERY, NEXT_PAGE_QUERY
+
+    queries = {name: stmt.sql for name, stmt in STATEMENTS.items()}
+    queries.update({
+        "checks.badge_progress": BADGE_PROGRESS_QUERY.text,
+        "checks.earned_badges": EARNED_BADGES_QUERY.text,
+        "checks.active_plants": ACTIVE_PLANTS_QUERY.text,
+        "db_utils.user_context": USER_CONTEXT_QUERY.text,
+        "inbox.first_page": FIRST_PAGE_QUERY.text,
+        "inbox.next_page": NEXT_PAGE_QUERY.text,
+    })
+    return queries
+
+
+# Tiny lookup tables that Postgres is right to seq scan.
+SEQ_SCAN_ALLOWED = {"phases"}
+
+
+def _seq_scans(plan: Dict) -> List[str]:
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") not in SEQ_SCAN_ALLOWED:
+        found.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+def check_query_plans(conn, queries: Dict[str, str]) -> Dict[str, List[str]]:
+    """EXPLAINs every hot query and returns {query name: [seq-scanned tables]} for the failures."""
+    sample = conn.execute(text("SELECT id, name, username FROM users LIMIT 1")).mappings().first()
+    now = datetime.now(timezone.utc)
+    params = {
+        "uid": sample["id"],
+        "uids": [str(sample["id"])],
+        "user_id": sample["id"],
+        "name": sample["name"],
+        "start_date": (now - timedelta(days=6)).date(),
+        "end_date": now.date(),
+        "since": now - timedelta(days=30),
+        "limit": 20,
+        "before_created_at": now,
+        "before_id": sample["id"],
+        "posts_limit": 5,
+        "liked_limit": 5,
+        "commented_limit": 5,
+    }
+    # The profile lookups share one :value parameter across columns
+    values = {f"user_profile_by_{column}": sample[column] for column in ("id", "name", "username")}
+
+    failures = {}
+    for name, sql in queries.items():
+        query_params = {**params, "value": values[name]} if name in values else params
+        plan = conn.execute(text("EXPLAIN (FORMAT JSON) " + sql), query_params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        scans = _seq_scans(plan[0]["Plan"])
+        if scans:
+            failures[name] = scans
+    return failures
+
+
+def run_plan_check(url: str = PLAN_CHECK_DATABASE_URL, users: int = 20000) -> bool:
+    """Creates synthetic tables on a scratch database, migrates, loads data and checks every plan."""
+    if not url:
+        print("PLAN_CHECK_DATABASE_URL not set")
+        return False
+
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT to_regclass('users')")).scalar() is None:
+            for statement in filter(str.strip, SYNTHETIC_SCHEMA.split(";")):
+                conn.execute(text(statement))
+            for statement in filter(str.strip, SYNTHETIC_DATA.split(";")):
+                conn.execute(text(statement), {"users": users})
+    apply_migrations(engine)
+    queries = hot_queries()
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE"))
+        failures = check_query_plans(conn, queries)
+
+    for name in queries:
+        status = f"❌ seq scan on {', '.join(failures[name])}" if name in failures else "✅ index scan"
+        print(f"{name:40} {status}")
+    return not failures
+
+
+if __name__ == "__main__":
+    if "--check-plans" in sys.argv:
+        sys.exit(0 if run_plan_check() else 1)
+    apply_migrations(create_engine(os.getenv("PROD_DATABASE_URL")))
@@ -0,0 +1,156 @@
+"""
+Monthly partitions of `notifications` (range on created_at, UTC months; see migrations
+0028-0032). Run daily:
+
+    python notification_partitions.py [--dry-run]
+
+It creates the next NOTIFICATION_PARTITIONS_AHEAD months, and retires every partition
+that lies entirely before the retention cutoff (NOTIFICATION_RETENTION_MONTHS whole
+months, counting the current one). A partition is retired in bulk: it is detached
+CONCURRENTLY, copied to NOTIFICATION_ARCHIVE_DIR as gzipped CSV if that is set, and then
+dropped, with the recipients' unread counts reduced by its unread rows. No rows are
+deleted one by one.
+"""
+import argparse
+import gzip
+import os
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+from notification_retention import NOTIFICATION_RETENTION_MONTHS, month_start, retention_cutoff
+from unread_counts import bump_unread_counts
+
+load_dotenv()
+
+NOTIFICATION_PARTITIONS_AHEAD = int(os.getenv("NOTIFICATION_PARTITIONS_AHEAD", "3"))
+NOTIFICATION_ARCHIVE_DIR = os.getenv("NOTIFICATION_ARCHIVE_DIR")
+
+# Attached partitions with their bounds; lower is NULL for the MINVALUE (legacy) partition
+PARTITIONS_QUERY = text("""
+    SELECT c.relname AS name,
+           i.inhdetachpending AS detach_pending,
+           CAST((regexp_match(pg_get_expr(c.relpartbound, c.oid), 'FROM \\(''([^'']+)''\\)'))[1] AS timestamptz) AS lower,
+           CAST((regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''([^'']+)''\\)'))[1] AS timestamptz) AS upper
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = CAST('notifications' AS regclass)
+    ORDER BY upper
+""")
+
+# Partitions detached by an earlier run that stopped before dropping them
+DETACHED_QUERY = text("""
+    SELECT c.relname AS name
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = current_schema()
+    WHERE c.relkind = 'r' AND NOT c.relispartition
+      AND (c.relname ~ '^notifications_y[0-9]{4}m[0-9]{2}$' OR c.relname = 'notifications_legacy')
+""")
+
+_PARTITION_NAME = re.compile(r"^notifications_(y\d{4}m\d{2}|legacy)$")
+
+
+def partition_name(start: datetime) -> str:
+    return f"notifications_y{start.year:04d}m{start.month:02d}"
+
+
+def list_partitions(db) -> List[Dict]:
+    return [dict(r) for r in db.execute(PARTITIONS_QUERY).mappings()]
+
+
+def ensure_partitions(db, now: Optional[datetime] = None, ahead: int = NOTIFICATION_PARTITIONS_AHEAD,
+                      dry_run: bool = False) -> List[str]:
+    """Creates monthly partitions after the newest one, through `ahead` months past the current one."""
+    now = now or datetime.now(timezone.utc)
+    partitions = list_partitions(db)
+    if not partitions:
+        raise RuntimeError("notifications is not partitioned yet; run migrations.py first")
+
+    created = []
+    start = partitions[-1]["upper"].astimezone(timezone.utc)
+    until = month_start(now, ahead + 1)
+    while start < until:
+        end = month_start(start, 1)
+        name = partition_name(start)
+        if not dry_run:
+            db.exec_driver_sql(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF notifications "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+        created.append(name)
+        start = end
+    if not dry_run:
+        db.commit()
+    return created
+
+
+def _archive(db, name: str, archive_dir: str) -> str:
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8", newline="") as f, db.connection.cursor() as cur:
+        cur.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+    os.replace(tmp, path)
+    return path
+
+
+def _drop(db, name: str, archive_dir: Optional[str]):
+    """Archives (optionally) and drops a detached partition, taking its unread rows out of the counts."""
+    if not _PARTITION_NAME.match(name):
+        raise ValueError(f"Refusing to drop {name!r}: not a notifications partition")
+    if archive_dir:
+        print(f"📦 Archived {name} to {_archive(db, name, archive_dir)}")
+    unread = db.exec_driver_sql(
+        f"SELECT to_user_id, COUNT(*) FROM {name} WHERE read_at IS NULL GROUP BY to_user_id"
+    ).all()
+    bump_unread_counts(db, {str(uid): -count for uid, count in unread})
+    db.exec_driver_sql(f"DROP TABLE {name}")
+    db.commit()
+
+
+def expire_partitions(engine, now: Optional[datetime] = None, months: int = NOTIFICATION_RETENTION_MONTHS,
+                      archive_dir: Optional[str] = NOTIFICATION_ARCHIVE_DIR, dry_run: bool = False) -> List[str]:
+    """Detaches, archives and drops every partition that ends at or before the retention cutoff."""
+    cutoff = retention_cutoff(now, months)
+    expired = []
+    # DETACH ... CONCURRENTLY can't run inside a transaction block
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        for p in list_partitions(conn):
+            if p["upper"] > cutoff:
+                continue
+            expired.append(p["name"])
+            if dry_run:
+                continue
+            mode = "FINALIZE" if p["detach_pending"] else "CONCURRENTLY"
+            conn.exec_driver_sql(f"ALTER TABLE notifications DETACH PARTITION {p['name']} {mode}")
+            print(f"✂️ Detached {p['name']} (created_at < {p['upper'].isoformat()})")
+
+    with engine.connect() as conn:
+        leftovers = [r.name for r in conn.execute(DETACHED_QUERY)]
+        if dry_run:
+            return expired + [name for name in leftovers if name not in expired]
+        for name in leftovers:
+            _drop(conn, name, archive_dir)
+            print(f"🗑️ Dropped {name}")
+    return expired
+
+
+def run_maintenance(engine, dry_run: bool = False):
+    with engine.connect() as conn:
+        created = ensure_partitions(conn, dry_run=dry_run)
+    expired = expire_partitions(engine, dry_run=dry_run)
+    prefix = "Would create" if dry_run else "Created"
+    print(f"✅ {prefix} {created or 'no partitions'}; expired {expired or 'none'} "
+          f"(keeping created_at >= {retention_cutoff().date()})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create upcoming notifications partitions and retire old ones.")
+    parser.add_argument("--dry-run", action="store_true", help="list what would be created and dropped")
+    args = parser.parse_args()
+    if NOTIFICATION_ARCHIVE_DIR:
+        os.makedirs(NOTIFICATION_ARCHIVE_DIR, exist_ok=True)
+    run_maintenance(create_engine(os.getenv("PROD_DATABASE_URL")), args.dry_run)
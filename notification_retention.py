@@ -0,0 +1,24 @@
+"""
+Retention window of the monthly `notifications` partitions. Kept free of side effects
+(no dotenv, no engines) so read paths can bound their queries with it without importing
+the partition maintenance job.
+"""
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
+NOTIFICATION_RETENTION_MONTHS = int(os.getenv("NOTIFICATION_RETENTION_MONTHS", "6"))
+
+
+def month_start(dt: datetime, months: int = 0) -> datetime:
+    """First instant (UTC) of the month `months` after dt's month."""
+    index = dt.year * 12 + dt.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def retention_cutoff(now: Optional[datetime] = None, months: int = NOTIFICATION_RETENTION_MONTHS) -> datetime:
+    """
+    Oldest created_at that is kept. Readers bound their queries with it, so they only
+    touch partitions that survive retention.
+    """
+    return month_start(now or datetime.now(timezone.utc), -(months - 1))
@@ -0,0 +1,198 @@
+"""
+Bulk writer for the notifications table. Every path that writes notifications goes through
+`write_notifications`, which streams rows into one `COPY ... FROM STDIN`.
+
+    python notification_writer.py [ROWS]   # rows/second, executemany vs COPY (needs BENCH_DATABASE_URL)
+"""
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import text
+
+from unread_counts import bump_unread_counts
+
+NOTIFICATION_COLUMNS = ("id", "message", "type", "type_id", "to_user_id", "from_user_id", "created_at", "updated_at")
+
+_VERSION_MASK = ~(0xF000 << 64) & ((1 << 128) - 1)
+_VARIANT_MASK = ~(0xC000 << 48) & ((1 << 128) - 1)
+
+
+def fast_uuid4() -> str:
+    """
+    Random version-4 UUID string without uuid.UUID object overhead. Reads the OS CSPRNG
+    like uuid.uuid4(), so ids are unpredictable and forked workers never share a stream.
+    """
+    n = int.from_bytes(os.urandom(16), "big") & _VERSION_MASK & _VARIANT_MASK | (0x4000 << 64) | (0x8000 << 48)
+    h = "%032x" % n
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    value = str(value)
+    if any(c in value for c in "\\\t\n\r"):
+        value = value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    return value
+
+
+class _CopyStream:
+    """File-like object psycopg2 reads from; renders rows to COPY text format lazily."""
+
+    def __init__(self, rows: Iterable[Dict], now: str):
+        self._rows = iter(rows)
+        self._now = now
+        self._buffer = ""
+        self.count = 0
+        self.per_recipient = Counter()
+
+    def _line(self, row: Dict) -> str:
+        self.count += 1
+        self.per_recipient[str(row["to_user_id"])] += 1
+        return "\t".join((
+            _copy_value(row.get("id") or fast_uuid4()),
+            _copy_value(row["message"]),
+            _copy_value(row["type"]),
+            _copy_value(row.get("type_id")),
+            _copy_value(row["to_user_id"]),
+            _copy_value(row.get("from_user_id")),
+            _copy_value(row.get("created_at") or self._now),
+            _copy_value(row.get("updated_at") or self._now),
+        )) + "\n"
+
+    def read(self, size: int = -1) -> str:
+        size = size if size and size > 0 else 1 << 16
+        parts = [self._buffer]
+        length = len(self._buffer)
+        for row in self._rows:
+            line = self._line(row)
+            parts.append(line)
+            length += len(line)
+            if length >= size:
+                break
+        data = "".join(parts)
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def write_notifications(db, rows: Iterable[Dict], commit: bool = True, table: str = "notifications") -> int:
+    """
+    Streams notification rows (dicts with message, type, type_id, to_user_id,
+    from_user_id; id and timestamps are filled in) into one COPY on the
+    session's connection, and bumps the recipients' unread counts in the same
+    transaction. Returns the number of rows written.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    stream = _CopyStream(rows, now)
+    raw = db.connection().connection
+    with raw.cursor() as cur:
+        cur.copy_expert(f"COPY {table} ({', '.join(NOTIFICATION_COLUMNS)}) FROM STDIN", stream)
+    if table == "notifications":
+        bump_unread_counts(db, stream.per_recipient)
+    if commit:
+        db.commit()
+    return stream.count
+
+
+async def write_notifications_async(db, rows: Iterable[Dict], commit: bool = True) -> int:
+    """
+    write_notifications for an AsyncSession on asyncpg: one binary COPY via
+    copy_records_to_table, then the unread-count bump in the same transaction.
+    """
+    now = datetime.now(timezone.utc)
+    per_recipient = Counter()
+    records = []
+    for row in rows:
+        per_recipient[str(row["to_user_id"])] += 1
+        records.append((
+            uuid.UUID(str(row.get("id") or fast_uuid4())),
+            row["message"],
+            row["type"],
+            _as_uuid(row.get("type_id")),
+            _as_uuid(row["to_user_id"]),
+            _as_uuid(row.get("from_user_id")),
+            row.get("created_at") or now,
+            row.get("updated_at") or now,
+        ))
+    if records:
+        conn = await db.connection()
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            "notifications", records=records, columns=NOTIFICATION_COLUMNS
+        )
+        await db.run_sync(bump_unread_counts, per_recipient)
+    if commit:
+        await db.commit()
+    return len(records)
+
+
+def _as_uuid(value):
+    return value if value is None or isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+# ======== Benchmark ========
+def _executemany_baseline(db, rows, table):
+    """The previous insert_notifications: per-row dict with uuid4, executemany."""
+    now = datetime.now(timezone.utc)
+    for r in rows:
+        r["id"] = str(uuid.uuid4())
+        r["created_at"] = now
+        r["updated_at"] = now
+    db.execute(
+        text(f"""
+            INSERT INTO {table}
+                (id, message, type, type_id, to_user_id, from_user_id, created_at, updated_at)
+            VALUES
+                (:id, :message, :type, :type_id, :to_user_id, :from_user_id, :created_at, :updated_at)
+        """),
+        rows,
+    )
+    db.commit()
+
+
+def _bench(n: int, url: Optional[str] = os.getenv("BENCH_DATABASE_URL")):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    if not url:
+        print("BENCH_DATABASE_URL not set")
+        return
+
+    def make_rows():
+        return [
+            {"message": " changed their phase from 'a' to 'b'.", "type": "profile",
+             "type_id": fast_uuid4(), "to_user_id": fast_uuid4(), "from_user_id": fast_uuid4()}
+            for _ in range(n)
+        ]
+
+    engine = create_engine(url)
+    with Session(engine) as db:
+        db.execute(text("""
+            CREATE TABLE IF NOT EXISTS notifications_bench (
+                id UUID PRIMARY KEY, message TEXT, type TEXT, type_id UUID, to_user_id UUID,
+                from_user_id UUID, created_at TIMESTAMPTZ, updated_at TIMESTAMPTZ
+            )
+        """))
+        db.commit()
+        for name, fn in (
+            ("executemany", lambda rows: _executemany_baseline(db, rows, "notifications_bench")),
+            ("COPY", lambda rows: write_notifications(db, rows, table="notifications_bench")),
+        ):
+            db.execute(text("TRUNCATE notifications_bench"))
+            db.commit()
+            rows = make_rows()
+            start = time.perf_counter()
+            fn(rows)
+            elapsed = time.perf_counter() - start
+            print(f"{name:12} {n / elapsed:12,.0f} rows/s ({elapsed:.2f}s for {n:,} rows)")
+        db.execute(text("DROP TABLE notifications_bench"))
+        db.commit()
+
+
+if __name__ == "__main__":
+    _bench(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
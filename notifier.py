@@ -1,13 +1,50 @@
-from typing import List, Optional, Dict
-import firebase_admin
-from firebase_admin import credentials, messaging
+import fcntl
+import json
 import os
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Dict, Tuple
 
-SERVICE_ACCOUNT_PATH = os.path.join(os.getcwd(), 'firebase/hue-social-app-firebase-adminsdk-x72wc-e694a20e99.json')
+from circuit_breaker import get_breaker
+from push_transports import get_async_transport, get_transport, RecordingTransport
+from retry_queue import RETRYABLE_CODES, retryable_tokens
+
+# While the FCM breaker is open, sends are spilled here (JSON lines) if set, else fast-failed
+PUSH_OUTBOX_PATH = os.getenv("PUSH_OUTBOX_PATH")
+# Replays an entry's retryably failed tokens get before they are dropped
+PUSH_OUTBOX_MAX_ATTEMPTS = int(os.getenv("PUSH_OUTBOX_MAX_ATTEMPTS", "5"))
+
+_outbox = RecordingTransport(PUSH_OUTBOX_PATH, keep=0) if PUSH_OUTBOX_PATH else None
+
+
+@contextmanager
+def _outbox_append_lock():
+    """
+    Held around every append to the live outbox and around moving it aside for replay, so
+    an append never lands in a file the replayer has already read. Separate from the
+    replayer's own lock, which is held while sending: appends only wait for a rename.
+    """
+    with open(PUSH_OUTBOX_PATH + ".append.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _spill(tokens: List[str], title: str, body: str, image: Optional[str], data: Optional[Dict[str, str]]) -> Dict:
+    """Accepted for later delivery by replay_outbox(); callers must not retry it themselves."""
+    with _outbox_append_lock():
+        _outbox.send(tokens=tokens, title=title, body=body, image=image, data=data)
+    return {"success": True, "spilled": True, "success_count": 0, "failure_count": 0, "responses": []}
+
+
+def _provider_degraded(result: Dict) -> bool:
+    """A batch counts against the breaker when the call failed or every token failed retryably."""
+    if not result.get("success"):
+        return True
+    responses = result.get("responses") or []
+    return bool(responses) and all(
+        not r.get("success") and r.get("code") in RETRYABLE_CODES for r in responses
+    )
 
-if not firebase_admin._apps:
-    cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
-    firebase_admin.initialize_app(cred)
 
 def send_push_notification(
     tokens: List[str],
@@ -19,54 +56,129 @@ def send_push_notification(
     if not tokens:
         return {"success": False, "detail": "No tokens provided"}
 
-    notification = messaging.Notification(title=title, body=body, image=image)
+    breaker = get_breaker("fcm")
+    if not breaker.allow():
+        retry_after = breaker.retry_after()
+        if _outbox is not None:
+            return _spill(tokens, title, body, image, data)
+        return {"success": False, "error": "fcm circuit open", "retry_after": retry_after}
 
+    start = time.monotonic()
     try:
-        if hasattr(messaging, 'send_multicast'):
-            message = messaging.MulticastMessage(
-                notification=notification,
-                tokens=tokens,
-                data=data or {}
-            )
-            result = messaging.send_multicast(message)
-
-            responses = [
-                {
-                    "token": tokens[i],
-                    "success": resp.success,
-                    "message_id": getattr(resp, "message_id", None),
-                    "exception": str(resp.exception) if resp.exception else None
-                }
-                for i, resp in enumerate(result.responses)
-            ]
-
-            return {
-                "success": True,
-                "success_count": result.success_count,
-                "failure_count": result.failure_count,
-                "responses": responses
-            }
-
-        else:
-            responses = []
-            for token in tokens:
-                try:
-                    message = messaging.Message(
-                        notification=notification,
-                        token=token,
-                        data=data or {}
-                    )
-                    message_id = messaging.send(message)
-                    responses.append({"token": token, "success": True, "message_id": message_id})
-                except Exception as e:
-                    responses.append({"token": token, "success": False, "error": str(e)})
-
-            return {
-                "success": True,
-                "success_count": sum(1 for r in responses if r["success"]),
-                "failure_count": sum(1 for r in responses if not r["success"]),
-                "responses": responses
-            }
+        result = get_transport().send(tokens=tokens, title=title, body=body, image=image, data=data)
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
+    breaker.record(_provider_degraded(result), time.monotonic() - start)
+    return result
+
 
+async def send_push_notification_async(
+    tokens: List[str],
+    title: str,
+    body: str,
+    image: Optional[str] = None,
+    data: Optional[Dict[str, str]] = None
+):
+    """send_push_notification for the event loop: same breaker, outbox and result shape."""
+    if not tokens:
+        return {"success": False, "detail": "No tokens provided"}
+
+    breaker = get_breaker("fcm")
+    if not breaker.allow():
+        retry_after = breaker.retry_after()
+        if _outbox is not None:
+            return _spill(tokens, title, body, image, data)
+        return {"success": False, "error": "fcm circuit open", "retry_after": retry_after}
+
+    start = time.monotonic()
+    try:
+        result = await get_async_transport().send(tokens=tokens, title=title, body=body, image=image, data=data)
     except Exception as e:
-        return {"success": False, "error": str(e)}
+        result = {"success": False, "error": str(e)}
+    breaker.record(_provider_degraded(result), time.monotonic() - start)
+    return result
+
+
+def _replay_file(path: str) -> Tuple[int, bool]:
+    """
+    Sends the entries in `path` in order. Stops at the first one the breaker refuses or the
+    provider fails, and rewrites `path` with it and everything after it. Tokens of a sent
+    entry that failed retryably are appended to the live outbox as a new entry, up to
+    PUSH_OUTBOX_MAX_ATTEMPTS times. Returns (sent, finished); the file is removed once finished.
+    """
+    with open(path, encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+
+    breaker = get_breaker("fcm")
+    requeue = []
+    for i, line in enumerate(lines):
+        entry = json.loads(line)
+        # Not send_push_notification: that would spill the entry straight back into the outbox
+        if not breaker.allow():
+            break
+        start = time.monotonic()
+        try:
+            result = get_transport().send(tokens=entry["tokens"], title=entry["title"], body=entry["body"],
+                                          image=entry.get("image"), data=entry.get("data"))
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        degraded = _provider_degraded(result)
+        breaker.record(degraded, time.monotonic() - start)
+        if degraded:
+            break
+        failed = retryable_tokens(result, entry["tokens"])
+        attempts = entry.get("attempts", 0) + 1
+        if failed and attempts < PUSH_OUTBOX_MAX_ATTEMPTS:
+            requeue.append(json.dumps(dict(entry, tokens=failed, attempts=attempts), ensure_ascii=False) + "\n")
+    else:
+        i = len(lines)
+
+    if requeue:
+        with _outbox_append_lock():
+            with open(PUSH_OUTBOX_PATH, "a", encoding="utf-8") as f:
+                f.writelines(requeue)
+    if i == len(lines):
+        os.remove(path)
+        return i, True
+
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.writelines(lines[i:])
+    os.replace(tmp, path)
+    return i, False
+
+
+def replay_outbox() -> int:
+    """
+    Resends spilled messages while the FCM breaker lets calls through. A `.replaying` file
+    left by an interrupted run is finished first; only then is the live outbox moved aside.
+    Whatever isn't sent stays queued for the next call. Returns how many were sent.
+    """
+    if not PUSH_OUTBOX_PATH:
+        return 0
+
+    pending_path = PUSH_OUTBOX_PATH + ".replaying"
+    with open(PUSH_OUTBOX_PATH + ".lock", "w") as lock:
+        try:
+            # One replayer at a time across web workers and jobs
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0
+        replayed = 0
+        for _ in range(2):
+            if not os.path.exists(pending_path):
+                if not os.path.exists(PUSH_OUTBOX_PATH):
+                    break
+                with _outbox_append_lock():
+                    os.replace(PUSH_OUTBOX_PATH, pending_path)
+            sent, finished = _replay_file(pending_path)
+            replayed += sent
+            if not finished:
+                break
+    return replayed
+
+
+if __name__ == "__main__":
+    if not PUSH_OUTBOX_PATH:
+        raise SystemExit("PUSH_OUTBOX_PATH not set")
+    print(f"📤 Replayed {replay_outbox()} spilled notifications from {PUSH_OUTBOX_PATH}")
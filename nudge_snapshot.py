@@ -0,0 +1,250 @@
+"""
+Columnar snapshot of everything the daily nudge computation reads, for offline runs.
+
+    python nudge_snapshot.py export DIR [--check-date YYYY-MM-DD]
+    python nudge_snapshot.py compute DIR [--seed N] [--out report.json] [--profile]
+
+`export` streams the user rows (users + garden_stats + user_plants, one row per user as
+in daily_nudges.get_users_page), the user_streaks activity scan and the badge rows out
+with COPY ... TO STDOUT, and writes them as NumPy arrays plus meta.json. `compute`
+memory-maps the arrays and classifies and renders every user's nudge with no database
+access and nothing sent, so a day can be re-run, diffed (fixed --seed) or benchmarked.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import Date, Integer, bindparam, create_engine
+from sqlalchemy.dialects import postgresql
+
+from activity_index import ACTIVITY_DAYS, ACTIVITY_SCAN_QUERY, ActivityIndex
+from badge_checks import pin_badges
+from constants import BADGES, PLANT_BADGES
+from daily_nudges import MAIN_DATABASE_URL, NUDGE_BATCH_SIZE, plan_batch
+from db import get_read_engine
+from frequency_cap import FrequencyCap
+from profiling import NO_PROFILER, RunProfiler
+from user_records import UserRecord
+
+SNAPSHOT_FORMAT = 1
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_NULL_TIME = np.iinfo(np.int64).min
+
+BadgeRow = namedtuple("BadgeRow", ["id", "name"])
+
+# Same rows as daily_nudges.get_users_page, over the whole table, with timestamps as epoch µs
+USERS_SNAPSHOT_SQL = """
+    SELECT DISTINCT ON (u.id)
+        u.id,
+        u.push_token,
+        COALESCE(gs.current_streak, 0),
+        CAST(EXTRACT(EPOCH FROM p.last_watered_date) * 1000000 AS bigint)
+    FROM users u
+    LEFT JOIN garden_stats gs
+        ON gs.user_id = u.id
+    LEFT JOIN user_plants p
+        ON p.user_id = u.id
+       AND p.is_active = true
+    WHERE u.push_token IS NOT NULL
+    ORDER BY u.id, p.last_watered_date DESC NULLS LAST
+"""
+
+
+def _copy_rows(conn, sql: str):
+    """Runs `COPY (sql) TO STDOUT` as CSV into a temp file and yields its rows as string lists."""
+    with tempfile.TemporaryFile("w+", newline="", encoding="utf-8") as buffer:
+        with conn.connection.cursor() as cur:
+            cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv)", buffer)
+        buffer.seek(0)
+        yield from csv.reader(buffer)
+
+
+def _uuid_bytes(ids: List[bytes]) -> np.ndarray:
+    return np.frombuffer(b"".join(ids), dtype=np.uint8).reshape(-1, 16)
+
+
+def export_snapshot(engine, path: str, check_date: datetime) -> Dict:
+    """Writes the snapshot directory at `path` (atomically, via a temp dir next to it)."""
+    today = check_date.date()
+    activity_sql = str(ACTIVITY_SCAN_QUERY.bindparams(
+        bindparam("today", today, type_=Date), bindparam("days", ACTIVITY_DAYS, type_=Integer),
+    ).compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+    started = time.monotonic()
+    with engine.connect() as conn:
+        ids, offsets, token_blob, streaks, watered = [], [0], bytearray(), [], []
+        for user_id, token, streak, watered_us in _copy_rows(conn, USERS_SNAPSHOT_SQL):
+            ids.append(uuid.UUID(user_id).bytes)
+            token_blob += token.encode("utf-8")
+            offsets.append(len(token_blob))
+            streaks.append(int(streak))
+            watered.append(int(watered_us) if watered_us else _NULL_TIME)
+
+        activity_ids, masks, nights, earlies = [], [], [], []
+        for user_id, mask, night, early in _copy_rows(conn, activity_sql):
+            activity_ids.append(uuid.UUID(user_id).bytes)
+            masks.append(int(mask))
+            nights.append(int(night))
+            earlies.append(int(early))
+
+        names = ", ".join(f"'{n.replace(chr(39), chr(39) * 2)}'" for n in list(BADGES.values()) + list(PLANT_BADGES.values()))
+        badges = {name: badge_id for badge_id, name in _copy_rows(conn, f"SELECT id, name FROM badges WHERE name IN ({names})")}
+
+    arrays = {
+        "users_id": _uuid_bytes(ids),
+        "users_token_offsets": np.asarray(offsets, dtype=np.int64),
+        "users_token": np.frombuffer(bytes(token_blob), dtype=np.uint8),
+        "users_streak": np.asarray(streaks, dtype=np.int32),
+        "users_watered_us": np.asarray(watered, dtype=np.int64),
+        "activity_id": _uuid_bytes(activity_ids),
+        "activity_mask": np.asarray(masks, dtype=np.int64),
+        "activity_night": np.asarray(nights, dtype=np.int64),
+        "activity_early": np.asarray(earlies, dtype=np.int64),
+    }
+    meta = {
+        "format": SNAPSHOT_FORMAT,
+        "check_date": check_date.isoformat(),
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "activity_days": ACTIVITY_DAYS,
+        "users": len(ids),
+        "activity_users": len(activity_ids),
+        "badges": badges,
+        "bytes": int(sum(a.nbytes for a in arrays.values())),
+    }
+
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(os.path.abspath(path)) + ".", dir=os.path.dirname(os.path.abspath(path)))
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, name + ".npy"), array)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, path)
+    print(f"📦 Snapshot of {meta['users']} users ({meta['bytes'] / 1e6:.1f} MB) written to {path} "
+          f"in {time.monotonic() - started:.1f}s")
+    return meta
+
+
+class NudgeSnapshot:
+    """A snapshot directory, memory-mapped. Users are materialized as UserRecords one page at a time."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"{path}: unsupported snapshot format {self.meta.get('format')}")
+        self.path = path
+        self.check_date = datetime.fromisoformat(self.meta["check_date"])
+        load = lambda name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+        self.ids = load("users_id")
+        self.token_offsets = load("users_token_offsets")
+        self.tokens = load("users_token")
+        self.streaks = load("users_streak")
+        self.watered_us = load("users_watered_us")
+        self._activity = {name: load("activity_" + name) for name in ("id", "mask", "night", "early")}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def badges(self) -> Dict[str, BadgeRow]:
+        return {name: BadgeRow(uuid.UUID(badge_id), name) for name, badge_id in self.meta["badges"].items()}
+
+    def activity_index(self, today: Optional[date] = None) -> ActivityIndex:
+        a = self._activity
+        ids = [str(uuid.UUID(bytes=row.tobytes())) for row in a["id"]]
+        return ActivityIndex(today or self.check_date.date(), ids, a["mask"], a["night"], a["early"],
+                             self.meta["activity_days"])
+
+    def users(self, start: int, stop: int) -> List[UserRecord]:
+        stop = min(stop, len(self))
+        offsets = self.token_offsets[start:stop + 1]
+        blob = self.tokens[offsets[0]:offsets[-1]].tobytes()
+        base = int(offsets[0])
+        records = []
+        for i in range(stop - start):
+            watered = int(self.watered_us[start + i])
+            records.append(UserRecord(
+                uuid.UUID(bytes=self.ids[start + i].tobytes()),
+                blob[int(offsets[i]) - base:int(offsets[i + 1]) - base].decode("utf-8"),
+                int(self.streaks[start + i]),
+                None if watered == _NULL_TIME else _EPOCH + timedelta(microseconds=watered),
+            ))
+        return records
+
+
+def compute_offline(path: str, batch_size: int = NUDGE_BATCH_SIZE, seed: Optional[int] = None,
+                    out: Optional[str] = None, profiler: RunProfiler = NO_PROFILER) -> Dict:
+    """
+    Classifies and renders every user's nudge from the snapshot. Nothing is sent or
+    capped (push_deliveries isn't in the snapshot). Returns counters; with `out`, also
+    writes {time_slot: {title\\nbody: users}} for diffing runs.
+    """
+    snapshot = NudgeSnapshot(path)
+    if seed is not None:
+        random.seed(seed)
+    pin_badges(snapshot.badges())
+    cap = FrequencyCap(per_hour=0, per_day=0, source="offline")
+
+    started = time.monotonic()
+    with profiler.stage("activity_index"):
+        activity = snapshot.activity_index()
+    counters: Dict = {}
+    rendered: Dict[str, Dict[str, int]] = {}
+    for start in range(0, len(snapshot), batch_size):
+        with profiler.stage("load_page"):
+            users = snapshot.users(start, start + batch_size)
+        schedules, _ = plan_batch(users, snapshot.check_date, activity, cap, counters, profiler)
+        counters["users"] = counters.get("users", 0) + len(users)
+        for time_slot, messages in schedules.items():
+            slot = rendered.setdefault(time_slot, {})
+            for (title, body), tokens in messages.items():
+                key = f"{title}\n{body}"
+                slot[key] = slot.get(key, 0) + len(tokens)
+
+    elapsed = time.monotonic() - started
+    counters["seconds"] = round(elapsed, 3)
+    counters["users_per_second"] = round(counters.get("users", 0) / max(elapsed, 1e-9))
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump({"check_date": snapshot.meta["check_date"], "seed": seed, "counters": counters,
+                       "rendered": rendered}, f, indent=2, ensure_ascii=False, sort_keys=True)
+    print(f"🧮 Offline nudges for {snapshot.meta['check_date']}: {counters}")
+    return counters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or replay a columnar snapshot of the daily nudge inputs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="snapshot the nudge inputs from the database")
+    export.add_argument("path")
+    export.add_argument("--check-date", type=date.fromisoformat, help="day to compute activity for (default today, UTC)")
+    compute = sub.add_parser("compute", help="classify and render nudges from a snapshot, offline")
+    compute.add_argument("path")
+    compute.add_argument("--batch-size", type=int, default=NUDGE_BATCH_SIZE)
+    compute.add_argument("--seed", type=int, help="seed the message template choice, for reproducible output")
+    compute.add_argument("--out", metavar="PATH", help="write the rendered messages and counts as JSON")
+    compute.add_argument("--profile", action="store_true", help="profile the run and write a report")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        if not MAIN_DATABASE_URL:
+            raise SystemExit("MAIN_DATABASE_URL not set")
+        now = datetime.now(timezone.utc)
+        check_date = datetime.combine(args.check_date, now.timetz()) if args.check_date else now
+        export_snapshot(get_read_engine(default=create_engine(MAIN_DATABASE_URL)), args.path, check_date)
+    else:
+        profiler = RunProfiler("nudge_snapshot", enabled=args.profile)
+        profiler.start()
+        try:
+            compute_offline(args.path, args.batch_size, args.seed, args.out, profiler)
+        finally:
+            report = profiler.report()
+            if report:
+                print(f"📈 Profile report written to {report}")
@@ -0,0 +1,152 @@
+"""
+Opt-in profiling for the batch jobs (`--profile`): cProfile over the whole run, wall time
+and tracemalloc deltas per stage, and wall time per user. `report()` writes a text report
+of the slowest stages, slowest users, hottest functions and top allocation sites, plus the
+raw cProfile stats next to it (`<path>.prof`, loadable with pstats or snakeviz).
+
+Jobs call `stage()` / `user()` unconditionally; with profiling off they are no-ops.
+"""
+import cProfile
+import heapq
+import io
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+TRACEMALLOC_FRAMES = 10
+
+
+class _StageStats:
+    __slots__ = ("calls", "seconds", "max_seconds", "net_bytes", "peak_bytes", "top_sites")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.net_bytes = 0
+        self.peak_bytes = 0
+        self.top_sites: List[str] = []
+
+
+class RunProfiler:
+    def __init__(self, job: str, enabled: bool = True, top_n: int = 20):
+        self.job = job
+        self.enabled = enabled
+        self.top_n = top_n
+        self.stages: Dict[str, _StageStats] = {}
+        self._slowest: List[Tuple[float, str, str]] = []  # min-heap of (seconds, user_id, note)
+        self.users_timed = 0
+        self.user_seconds = 0.0
+        self._profile: Optional[cProfile.Profile] = None
+        self._started_at = 0.0
+        self._elapsed = 0.0
+
+    def start(self):
+        if not self.enabled:
+            return
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self._profile = cProfile.Profile()
+        self._started_at = time.perf_counter()
+        self._profile.enable()
+
+    def stop(self):
+        if not self.enabled or self._profile is None:
+            return
+        self._profile.disable()
+        self._elapsed = time.perf_counter() - self._started_at
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times a stage; the first call of each stage also records its top allocation sites."""
+        if not self.enabled:
+            yield
+            return
+        stats = self.stages.setdefault(name, _StageStats())
+        first = stats.calls == 0
+        before = tracemalloc.take_snapshot() if first else None
+        current_before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.net_bytes += current - current_before
+            stats.peak_bytes = max(stats.peak_bytes, peak - current_before)
+            if first:
+                diff = tracemalloc.take_snapshot().compare_to(before, "lineno")
+                stats.top_sites = [str(d) for d in diff[:5]]
+
+    @contextmanager
+    def user(self, user_id, note: str = ""):
+        """Times the work for one user; only the `top_n` slowest are kept."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.users_timed += 1
+            self.user_seconds += seconds
+            entry = (seconds, str(user_id), note)
+            if len(self._slowest) < self.top_n:
+                heapq.heappush(self._slowest, entry)
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def report(self, path: Optional[str] = None) -> Optional[str]:
+        """Writes the report to `path` (default profile-<job>-<timestamp>.txt) and returns the path."""
+        if not self.enabled or self._profile is None:
+            return None
+        self.stop()
+        path = path or f"profile-{self.job}-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+        self._profile.dump_stats(path + ".prof")
+
+        out = io.StringIO()
+        out.write(f"Profile of {self.job}: {self._elapsed:.2f}s wall\n\n")
+
+        out.write("== Slowest stages ==\n")
+        for name, s in sorted(self.stages.items(), key=lambda kv: kv[1].seconds, reverse=True):
+            out.write(
+                f"{name:24} {s.seconds:9.3f}s total  {s.calls:6d} calls  {s.max_seconds * 1000:9.1f} ms max  "
+                f"{s.net_bytes / 1024:10.1f} KiB net  {s.peak_bytes / 1024:10.1f} KiB peak\n"
+            )
+
+        out.write(f"\n== Slowest users ({self.users_timed} timed, "
+                  f"{self.user_seconds / max(self.users_timed, 1) * 1000:.2f} ms avg) ==\n")
+        for seconds, user_id, note in sorted(self._slowest, reverse=True):
+            out.write(f"{seconds * 1000:9.1f} ms  {user_id}  {note}\n")
+
+        out.write("\n== Top functions by cumulative time ==\n")
+        pstats.Stats(self._profile, stream=out).sort_stats("cumulative").print_stats(self.top_n)
+
+        out.write("== Top allocation sites (live at end of run) ==\n")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        for stat in snapshot.statistics("lineno")[:self.top_n]:
+            out.write(f"{stat}\n")
+
+        out.write("\n== Allocation sites per stage (first call) ==\n")
+        for name, s in self.stages.items():
+            out.write(f"{name}:\n")
+            for site in s.top_sites:
+                out.write(f"    {site}\n")
+        tracemalloc.stop()
+
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(out.getvalue())
+        return path
+
+
+# Shared disabled instance for callers that weren't given a profiler
+NO_PROFILER = RunProfiler("none", enabled=False)
@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from notifier import send_push_notification
+
+REALTIME = "realtime"            # phase-change / friend pushes
+TRANSACTIONAL = "transactional"  # badge earned, plant milestones
+BULK = "bulk"                    # daily nudges
+
+LANE_WEIGHTS = {REALTIME: 6, TRANSACTIONAL: 3, BULK: 1}
+
+# Messages per second this process may hand to FCM (0 = unlimited). Bulk and
+# transactional lanes may only use (1 - PUSH_REALTIME_RESERVED) of it, so a bulk
+# job configured with the project quota always leaves headroom for realtime.
+# Both are per process: at 0 (the default) there is no reserve at all, and N
+# processes sharing one FCM quota should each get quota / N.
+PUSH_RATE_PER_SECOND = float(os.getenv("PUSH_RATE_PER_SECOND", "0"))
+PUSH_REALTIME_RESERVED = float(os.getenv("PUSH_REALTIME_RESERVED", "0.2"))
+PUSH_LANE_WORKERS = int(os.getenv("PUSH_LANE_WORKERS", "4"))
+
+LATENCY_SAMPLES = 1000
+
+
+class _Job:
+    __slots__ = ("kwargs", "cost", "future", "enqueued_at")
+
+    def __init__(self, kwargs: Dict, cost: int):
+        self.kwargs = kwargs
+        self.cost = cost
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class _LaneStats:
+    __slots__ = ("submitted", "completed", "failed", "waits")
+
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.waits = deque(maxlen=LATENCY_SAMPLES)  # seconds from submit to dispatch
+
+
+class LaneDispatcher:
+    """
+    Sends pushes from three priority lanes with smooth weighted round-robin
+    between non-empty lanes and a token bucket over the message rate, part of
+    which only the realtime lane may use.
+    """
+
+    def __init__(
+        self,
+        send: Callable[..., Dict] = send_push_notification,
+        weights: Optional[Dict[str, int]] = None,
+        rate_per_second: float = PUSH_RATE_PER_SECOND,
+        realtime_reserved: float = PUSH_REALTIME_RESERVED,
+        workers: int = PUSH_LANE_WORKERS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.send = send
+        self.clock = clock
+        self.weights = weights or dict(LANE_WEIGHTS)
+        self.rate = rate_per_second
+        self.reserve = rate_per_second * realtime_reserved
+        self._queues = {lane: deque() for lane in self.weights}
+        self._current = {lane: 0 for lane in self.weights}
+        self._stats = {lane: _LaneStats() for lane in self.weights}
+        self._cond = threading.Condition()
+        self._bucket = rate_per_second
+        self._refilled_at = clock()
+        self._workers = [
+            threading.Thread(target=self._run, name=f"push-lane-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for w in self._workers:
+            w.start()
+
+    # ---- public ----
+    def submit(self, lane: str, tokens: List[str], title: str, body: str,
+               image: Optional[str] = None, data: Optional[Dict[str, str]] = None) -> Future:
+        if lane not in self._queues:
+            raise ValueError(f"Invalid lane '{lane}'. Use one of {list(self._queues)}.")
+        job = _Job({"tokens": tokens, "title": title, "body": body, "image": image, "data": data}, max(1, len(tokens)))
+        with self._cond:
+            self._queues[lane].append(job)
+            self._stats[lane].submitted += 1
+            self._cond.notify()
+        return job.future
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._cond:
+            out = {}
+            for lane, stats in self._stats.items():
+                waits = sorted(stats.waits)
+                out[lane] = {
+                    "depth": len(self._queues[lane]),
+                    "submitted": stats.submitted,
+                    "completed": stats.completed,
+                    "failed": stats.failed,
+                    "avg_wait_ms": (sum(waits) / len(waits) * 1000) if waits else 0.0,
+                    "p95_wait_ms": (waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000) if waits else 0.0,
+                }
+            return out
+
+    # ---- scheduling ----
+    def _refill(self):
+        if not self.rate:
+            return
+        now = self.clock()
+        self._bucket = min(self.rate, self._bucket + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _floor(self, lane: str) -> float:
+        return 0 if lane == REALTIME else self.reserve
+
+    def _charge(self, lane: str, cost: int) -> float:
+        """
+        Tokens a send takes from the bucket. Capped at what the lane can ever use (rate minus
+        its floor), so a batch larger than that waits for a full bucket instead of forever.
+        """
+        return min(cost, self.rate - self._floor(lane))
+
+    def _eligible(self, lane: str, cost: int) -> bool:
+        if not self.rate:
+            return True
+        return self._bucket - self._charge(lane, cost) >= self._floor(lane)
+
+    def _pick(self) -> Optional[str]:
+        """Smooth weighted round-robin over lanes that have work and capacity."""
+        self._refill()
+        eligible = [
+            lane for lane, q in self._queues.items()
+            if q and self._eligible(lane, q[0].cost)
+        ]
+        if not eligible:
+            return None
+        total = sum(self.weights[lane] for lane in eligible)
+        for lane in eligible:
+            self._current[lane] += self.weights[lane]
+        best = max(eligible, key=lambda lane: self._current[lane])
+        self._current[best] -= total
+        return best
+
+    def _run(self):
+        while True:
+            with self._cond:
+                lane = self._pick()
+                while lane is None:
+                    # Wake on new work, or shortly after to re-check the bucket
+                    self._cond.wait(timeout=0.05 if any(self._queues.values()) else None)
+                    lane = self._pick()
+                job = self._queues[lane].popleft()
+                if self.rate:
+                    self._bucket -= self._charge(lane, job.cost)
+                self._stats[lane].waits.append(time.monotonic() - job.enqueued_at)
+
+            try:
+                result = self.send(**job.kwargs)
+                job.future.set_result(result)
+                ok = bool(result.get("success"))
+            except Exception as e:
+                job.future.set_exception(e)
+                ok = False
+            with self._cond:
+                self._stats[lane].completed += 1
+                if not ok:
+                    self._stats[lane].failed += 1
+
+
+_dispatcher: Optional[LaneDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> LaneDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = LaneDispatcher()
+    return _dispatcher
+
+
+def submit_push(lane: str, **kwargs) -> Future:
+    """Queues a push on a lane; the Future resolves to the send_push_notification result."""
+    return get_dispatcher().submit(lane, **kwargs)
+
+
+def send_in_lane(lane: str, **kwargs) -> Dict:
+    """Blocking form of submit_push, usable wherever send_push_notification was called."""
+    return submit_push(lane, **kwargs).result()
+
+
+def lane_stats() -> Dict[str, Dict]:
+    return get_dispatcher().snapshot() if _dispatcher is not None else {}
+
@@ -0,0 +1,380 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Deque, List, Optional, Dict
+
+# Transport selection: firebase (default), null, record, emulator
+PUSH_TRANSPORT = os.getenv("PUSH_TRANSPORT", "firebase")
+PUSH_RECORD_PATH = os.getenv("PUSH_RECORD_PATH")
+# Most recent sends the record transport keeps in memory (0 = none)
+PUSH_RECORD_KEEP = int(os.getenv("PUSH_RECORD_KEEP", "1000"))
+PUSH_EMULATOR_LATENCY_MS = float(os.getenv("PUSH_EMULATOR_LATENCY_MS", "0"))
+PUSH_EMULATOR_ERROR_RATE = float(os.getenv("PUSH_EMULATOR_ERROR_RATE", "0"))
+PUSH_EMULATOR_INVALID_RATE = float(os.getenv("PUSH_EMULATOR_INVALID_RATE", "0"))
+PUSH_EMULATOR_QUOTA_PER_MINUTE = int(os.getenv("PUSH_EMULATOR_QUOTA_PER_MINUTE", "0"))
+
+# Max in-flight FCM HTTP v1 requests per process on the async path
+FCM_ASYNC_CONCURRENCY = int(os.getenv("FCM_ASYNC_CONCURRENCY", "100"))
+
+SERVICE_ACCOUNT_PATH = os.path.join(os.getcwd(), 'firebase/hue-social-app-firebase-adminsdk-x72wc-e694a20e99.json')
+
+
+def _summarize(responses: List[Dict]) -> Dict:
+    return {
+        "success": True,
+        "success_count": sum(1 for r in responses if r["success"]),
+        "failure_count": sum(1 for r in responses if not r["success"]),
+        "responses": responses
+    }
+
+
+def _response(token: str, message_id: Optional[str] = None, exception: Optional[str] = None,
+              code: Optional[str] = None, retry_after: Optional[float] = None) -> Dict:
+    return {
+        "token": token,
+        "success": exception is None,
+        "message_id": message_id,
+        "exception": exception,
+        "code": code,
+        "retry_after": retry_after,
+    }
+
+
+class PushTransport:
+    """Base transport. `send` returns the result dict shape used by `send_push_notification`."""
+
+    name = "base"
+
+    def send(self, tokens: List[str], title: str, body: str,
+             image: Optional[str] = None, data: Optional[Dict[str, str]] = None) -> Dict:
+        raise NotImplementedError
+
+    def prewarm(self):
+        """Does any slow first-use setup (credentials, tokens) ahead of the first send."""
+
+
+class FirebaseTransport(PushTransport):
+    name = "firebase"
+
+    def __init__(self, service_account_path: str = SERVICE_ACCOUNT_PATH):
+        import firebase_admin
+        from firebase_admin import credentials, messaging
+
+        if not firebase_admin._apps:
+            cred = credentials.Certificate(service_account_path)
+            firebase_admin.initialize_app(cred)
+        self.app = firebase_admin.get_app()
+        self.messaging = messaging
+
+    def prewarm(self):
+        # Fetches and caches the OAuth access token the first send would otherwise wait for
+        self.app.credential.get_access_token()
+
+    @staticmethod
+    def _error_details(exc) -> Dict:
+        if exc is None:
+            return {}
+        retry_after = None
+        http_response = getattr(exc, "http_response", None)
+        if http_response is not None:
+            header = http_response.headers.get("Retry-After")
+            if header and header.isdigit():
+                retry_after = float(header)
+        return {"exception": str(exc), "code": getattr(exc, "code", None), "retry_after": retry_after}
+
+    def send(self, tokens, title, body, image=None, data=None):
+        messaging = self.messaging
+        notification = messaging.Notification(title=title, body=body, image=image)
+
+        if hasattr(messaging, 'send_multicast'):
+            message = messaging.MulticastMessage(
+                notification=notification,
+                tokens=tokens,
+                data=data or {}
+            )
+            result = messaging.send_multicast(message)
+
+            responses = [
+                _response(tokens[i], getattr(resp, "message_id", None), **self._error_details(resp.exception))
+                for i, resp in enumerate(result.responses)
+            ]
+            return _summarize(responses)
+
+        responses = []
+        for token in tokens:
+            try:
+                message = messaging.Message(
+                    notification=notification,
+                    token=token,
+                    data=data or {}
+                )
+                responses.append(_response(token, messaging.send(message)))
+            except Exception as e:
+                responses.append(_response(token, **self._error_details(e)))
+        return _summarize(responses)
+
+
+class NullTransport(PushTransport):
+    """Accepts everything and sends nothing."""
+
+    name = "null"
+
+    def send(self, tokens, title, body, image=None, data=None):
+        return _summarize([_response(t, f"null-{i}") for i, t in enumerate(tokens)])
+
+
+class RecordingTransport(PushTransport):
+    """Keeps the last `keep` sends in memory and, if `path` is set, appends every send as a JSON line."""
+
+    name = "record"
+
+    def __init__(self, path: Optional[str] = PUSH_RECORD_PATH, keep: int = PUSH_RECORD_KEEP):
+        self.path = path
+        self.keep = keep
+        self.count = 0
+        self.sent: Deque[Dict] = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def send(self, tokens, title, body, image=None, data=None):
+        entry = {
+            "ts": time.time(),
+            "tokens": list(tokens),
+            "title": title,
+            "body": body,
+            "image": image,
+            "data": data or {},
+        }
+        with self._lock:
+            self.count += 1
+            seq = self.count
+            if self.keep:
+                self.sent.append(entry)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return _summarize([_response(t, f"record-{seq}-{i}") for i, t in enumerate(tokens)])
+
+
+class EmulatorTransport(PushTransport):
+    """
+    Local FCM stand-in with configurable latency, per-token error rates and a
+    per-minute quota. Over quota, every token fails with QUOTA_EXCEEDED and a
+    retry_after hint, the way FCM answers with 429 + Retry-After.
+    """
+
+    name = "emulator"
+
+    def __init__(
+        self,
+        latency_ms: float = PUSH_EMULATOR_LATENCY_MS,
+        error_rate: float = PUSH_EMULATOR_ERROR_RATE,
+        invalid_rate: float = PUSH_EMULATOR_INVALID_RATE,
+        quota_per_minute: int = PUSH_EMULATOR_QUOTA_PER_MINUTE,
+        seed: Optional[int] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.invalid_rate = invalid_rate
+        self.quota_per_minute = quota_per_minute
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def _take_quota(self, n: int) -> Optional[float]:
+        """Returns None if n messages fit in the current minute, else seconds until it resets."""
+        if not self.quota_per_minute:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._window_start
+            if elapsed >= 60:
+                self._window_start = now
+                self._window_count = 0
+                elapsed = 0
+            if self._window_count + n > self.quota_per_minute:
+                return max(1.0, 60 - elapsed)
+            self._window_count += n
+            return None
+
+    def send(self, tokens, title, body, image=None, data=None):
+        if self.latency_ms:
+            time.sleep(self._rng.uniform(0.5, 1.5) * self.latency_ms / 1000)
+
+        retry_after = self._take_quota(len(tokens))
+        if retry_after is not None:
+            return _summarize([
+                _response(t, exception="Quota exceeded", code="QUOTA_EXCEEDED", retry_after=retry_after)
+                for t in tokens
+            ])
+
+        responses = []
+        for token in tokens:
+            roll = self._rng.random()
+            if roll < self.invalid_rate:
+                responses.append(_response(token, exception="Requested entity was not found.", code="UNREGISTERED"))
+            elif roll < self.invalid_rate + self.error_rate:
+                responses.append(_response(token, exception="Service unavailable", code="UNAVAILABLE"))
+            else:
+                responses.append(_response(token, f"emulator-{uuid.uuid4().hex[:16]}"))
+        return _summarize(responses)
+
+
+TRANSPORTS = {
+    "firebase": FirebaseTransport,
+    "null": NullTransport,
+    "record": RecordingTransport,
+    "emulator": EmulatorTransport,
+}
+
+_transport: Optional[PushTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> PushTransport:
+    """Returns the process-wide transport, building it from PUSH_TRANSPORT on first use."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                if PUSH_TRANSPORT not in TRANSPORTS:
+                    raise ValueError(f"Invalid PUSH_TRANSPORT '{PUSH_TRANSPORT}'. Use one of {sorted(TRANSPORTS)}.")
+                _transport = TRANSPORTS[PUSH_TRANSPORT]()
+    return _transport
+
+
+def set_transport(transport: Optional[PushTransport]):
+    """Overrides the process-wide transport (None resets to the env default)."""
+    global _transport
+    with _transport_lock:
+        _transport = transport
+
+
+# ======== Async transports ========
+class AsyncPushTransport:
+    """Async counterpart of PushTransport: `await send(...)` returns the same result dict."""
+
+    name = "base"
+
+    async def send(self, tokens: List[str], title: str, body: str,
+                   image: Optional[str] = None, data: Optional[Dict[str, str]] = None) -> Dict:
+        raise NotImplementedError
+
+    async def prewarm(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+class ThreadedAsyncTransport(AsyncPushTransport):
+    """Runs a sync transport in the default executor; used for null/record/emulator."""
+
+    def __init__(self, transport: PushTransport):
+        self.transport = transport
+        self.name = transport.name
+
+    async def send(self, tokens, title, body, image=None, data=None):
+        return await asyncio.to_thread(self.transport.send, tokens, title, body, image, data)
+
+    async def prewarm(self):
+        await asyncio.to_thread(self.transport.prewarm)
+
+
+class AsyncFirebaseTransport(AsyncPushTransport):
+    """
+    FCM HTTP v1 over one shared HTTP/2 client. v1 has no multicast endpoint, so each
+    token is its own request; at most `concurrency` are in flight at once.
+    """
+
+    name = "firebase"
+    SCOPES = ["https://www.googleapis.com/auth/firebase.messaging"]
+
+    def __init__(self, service_account_path: str = SERVICE_ACCOUNT_PATH, concurrency: int = FCM_ASYNC_CONCURRENCY):
+        import httpx
+        from google.oauth2 import service_account
+
+        self._httpx = httpx
+        self._credentials = service_account.Credentials.from_service_account_file(
+            service_account_path, scopes=self.SCOPES
+        )
+        self._url = f"https://fcm.googleapis.com/v1/projects/{self._credentials.project_id}/messages:send"
+        self._client = httpx.AsyncClient(http2=True, timeout=10)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._token_lock = asyncio.Lock()
+
+    async def _access_token(self) -> str:
+        if not self._credentials.valid:
+            async with self._token_lock:
+                if not self._credentials.valid:
+                    from google.auth.transport.requests import Request
+                    await asyncio.to_thread(self._credentials.refresh, Request())
+        return self._credentials.token
+
+    @staticmethod
+    def _error_details(resp) -> Dict:
+        try:
+            error = resp.json().get("error", {})
+        except ValueError:
+            error = {}
+        code = error.get("status") or str(resp.status_code)
+        for detail in error.get("details", []):
+            # FCM-specific code (UNREGISTERED, QUOTA_EXCEEDED, ...) is more precise than the HTTP status
+            if detail.get("errorCode"):
+                code = detail["errorCode"]
+        header = resp.headers.get("Retry-After")
+        return {
+            "exception": error.get("message") or resp.text,
+            "code": code,
+            "retry_after": float(header) if header and header.isdigit() else None,
+        }
+
+    async def _send_one(self, token: str, message: Dict, headers: Dict) -> Dict:
+        async with self._semaphore:
+            try:
+                resp = await self._client.post(self._url, json={"message": {**message, "token": token}}, headers=headers)
+            except self._httpx.HTTPError as e:
+                return _response(token, exception=str(e), code="UNAVAILABLE")
+        if resp.status_code == 200:
+            return _response(token, resp.json().get("name"))
+        return _response(token, **self._error_details(resp))
+
+    async def send(self, tokens, title, body, image=None, data=None):
+        notification = {"title": title, "body": body}
+        if image:
+            notification["image"] = image
+        message = {"notification": notification, "data": data or {}}
+        headers = {"Authorization": f"Bearer {await self._access_token()}"}
+        responses = await asyncio.gather(*(self._send_one(t, message, headers) for t in tokens))
+        return _summarize(list(responses))
+
+    async def prewarm(self):
+        await self._access_token()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_async_transport: Optional[AsyncPushTransport] = None
+
+
+def get_async_transport() -> AsyncPushTransport:
+    """Process-wide async transport for PUSH_TRANSPORT; non-firebase transports run in threads."""
+    global _async_transport
+    if _async_transport is None:
+        if PUSH_TRANSPORT == "firebase":
+            _async_transport = AsyncFirebaseTransport()
+        else:
+            _async_transport = ThreadedAsyncTransport(get_transport())
+    return _async_transport
+
+
+def set_async_transport(transport: Optional[AsyncPushTransport]):
+    """Overrides the process-wide async transport (None resets to the env default)."""
+    global _async_transport
+    _async_transport = transport
@@ -0,0 +1,169 @@
+import heapq
+import itertools
+import logging
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# FCM / firebase_admin error codes worth retrying. Anything else (UNREGISTERED,
+# INVALID_ARGUMENT, SENDER_ID_MISMATCH, ...) is permanent for that token.
+RETRYABLE_CODES = {
+    "UNAVAILABLE",
+    "INTERNAL",
+    "UNKNOWN",
+    "ABORTED",
+    "DEADLINE_EXCEEDED",
+    "RESOURCE_EXHAUSTED",
+    "QUOTA_EXCEEDED",
+}
+
+
+def delivered_tokens(result: Dict) -> List[str]:
+    """Tokens a send result reports as delivered (none when the whole call failed or was spilled)."""
+    if not result.get("success"):
+        return []
+    return [r["token"] for r in result.get("responses") or [] if r.get("success")]
+
+
+def retryable_tokens(result: Dict, tokens: List[str]) -> List[str]:
+    """Tokens worth resending: all of them when the whole call failed, else those that failed with a retryable code."""
+    if not result.get("success"):
+        return list(tokens)
+    return [r["token"] for r in result.get("responses") or []
+            if not r.get("success") and r.get("code") in RETRYABLE_CODES]
+
+
+def backoff_delay(attempt: int, base: float, cap: float = 300.0, rng: Optional[random.Random] = None) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**(attempt-1)))."""
+    rng = rng or random
+    return rng.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+class RetryJob:
+    __slots__ = ("tokens", "title", "body", "kwargs", "attempt")
+
+    def __init__(self, tokens: List[str], title: str, body: str, kwargs: Dict, attempt: int = 1):
+        self.tokens = tokens
+        self.title = title
+        self.body = body
+        self.kwargs = kwargs
+        self.attempt = attempt
+
+
+class RetryScheduler:
+    """
+    Sends push batches and parks failed tokens in a delay queue instead of
+    sleeping inline. Callers keep submitting new batches and call `run_due()`
+    between them; `drain()` waits out whatever is still parked at the end.
+
+    Only tokens that failed with a retryable code are retried. Retry-After hints
+    from the transport (`retry_after` on a response) are honored as a minimum delay.
+    With track_delivered=True, `take_delivered()` returns the tokens that got through.
+    """
+
+    def __init__(
+        self,
+        send: Callable[..., Dict],
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        rng: Optional[random.Random] = None,
+        track_delivered: bool = False,
+    ):
+        self.send = send
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self._queue = []  # (due_at, seq, RetryJob)
+        self._seq = itertools.count()
+        self.track_delivered = track_delivered
+        self._delivered: List[str] = []
+        self.stats = {
+            "sent": 0,        # tokens delivered on first attempt
+            "retried": 0,     # token retries scheduled
+            "recovered": 0,   # tokens delivered on a retry
+            "abandoned": 0,   # retryable tokens that ran out of attempts
+            "rejected": 0,    # tokens that failed permanently
+        }
+
+    def __len__(self):
+        return len(self._queue)
+
+    def submit(self, tokens: List[str], title: str, body: str, **kwargs):
+        """Sends a batch now; failed tokens are parked for a later `run_due()`."""
+        self._attempt(RetryJob(list(tokens), title, body, kwargs))
+
+    def run_due(self) -> int:
+        """Resends every parked batch whose delay has expired. Returns how many ran."""
+        ran = 0
+        now = self.clock()
+        while self._queue and self._queue[0][0] <= now:
+            _, _, job = heapq.heappop(self._queue)
+            self._attempt(job)
+            ran += 1
+        return ran
+
+    def drain(self):
+        """Blocks until the delay queue is empty, sleeping only until the next due batch."""
+        while self._queue:
+            wait = self._queue[0][0] - self.clock()
+            if wait > 0:
+                self.sleep(wait)
+            self.run_due()
+
+    def take_delivered(self) -> List[str]:
+        """Tokens delivered since the last call (collected only with track_delivered=True)."""
+        delivered, self._delivered = self._delivered, []
+        return delivered
+
+    def _attempt(self, job: RetryJob):
+        try:
+            result = self.send(tokens=job.tokens, title=job.title, body=job.body, **job.kwargs)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+
+        if not result.get("success"):
+            # The whole call failed (network, auth, transport error): every token is retryable
+            failed = job.tokens
+            retry_after = result.get("retry_after")
+            delivered = 0
+            logger.warning("Push batch of %d failed (attempt %d/%d): %s",
+                           len(job.tokens), job.attempt, self.max_attempts, result.get("error"))
+        else:
+            failed, retry_after, rejected = [], None, 0
+            for r in result.get("responses", []):
+                if r.get("success"):
+                    continue
+                if r.get("code") in RETRYABLE_CODES:
+                    failed.append(r["token"])
+                    if r.get("retry_after"):
+                        retry_after = max(retry_after or 0, r["retry_after"])
+                else:
+                    rejected += 1
+            delivered = result.get("success_count", len(job.tokens) - len(failed) - rejected)
+            self.stats["rejected"] += rejected
+
+        self.stats["recovered" if job.attempt > 1 else "sent"] += delivered
+        if self.track_delivered:
+            self._delivered.extend(delivered_tokens(result))
+
+        if not failed:
+            return
+        if job.attempt >= self.max_attempts:
+            self.stats["abandoned"] += len(failed)
+            logger.error("Abandoning %d tokens after %d attempts (title='%s')", len(failed), job.attempt, job.title)
+            return
+
+        delay = backoff_delay(job.attempt, self.base_delay, self.max_delay, self.rng)
+        if retry_after:
+            delay = max(delay, retry_after)
+        self.stats["retried"] += len(failed)
+        retry = RetryJob(failed, job.title, job.body, job.kwargs, job.attempt + 1)
+        heapq.heappush(self._queue, (self.clock() + delay, next(self._seq), retry))
@@ -1,19 +1,156 @@
 from checks import check_user_badge_progress, check_user_plant_progress
-from db import get_db
-from notifier import send_push_notification
+from db import get_db, get_engine
+from push_lanes import TRANSACTIONAL
+from digest import DIGEST_WINDOW_SECONDS, MULTICAST_LIMIT, push, queue_pushes, send_pushes
+from frequency_cap import FrequencyCap
+from profiling import NO_PROFILER, RunProfiler
+from retry_queue import delivered_tokens
+from shard_leases import SHARD_COUNT, LeaseLost, ShardCoordinator, ShardLease
+from datetime import datetime, timezone
+from concurrent.futures import wait
 from sqlalchemy import text
+import argparse
+import os
 
+PRELOAD_BY_ID_MAX = 5000
+# Users per checkpointed page of a sharded run
+CHECKS_PAGE_SIZE = int(os.getenv("CHECKS_PAGE_SIZE", "1000"))
+
+
+def run_background_checks(profiler: RunProfiler = NO_PROFILER):
+    # The user scan can lag a little; the cap and badge awards go to the primary
+    with profiler.stage("fetch_users"):
+        replica = get_db("replica")
+        users = replica.execute(text("SELECT id, push_token FROM users")).all()
+        replica.close()
 
-def run_background_checks():
     db = get_db("prod")
-    user_ids = db.execute(text("SELECT id FROM users")).scalars().all()
+    try:
+        check_users(db, users, profiler=profiler)
+    finally:
+        db.close()
+
+
+def run_sharded_checks(run_key: str, shards: int = SHARD_COUNT, profiler: RunProfiler = NO_PROFILER):
+    """Same checks, split across every host started with this run_key (see shard_leases.py)."""
+    engine = get_engine("prod")
+    coordinator = ShardCoordinator("run_checks", run_key, shards)
+    with engine.connect() as conn:
+        coordinator.ensure(conn, datetime.now(timezone.utc))
+
+    def process_shard(lease: ShardLease) -> bool:
+        # Keyset pages, each checkpointed, so a reclaimed shard resumes after its last page
+        after = lease.last_key or lease.start_after
+        while not lease.lost.is_set():
+            with profiler.stage("fetch_users"):
+                replica = get_db("replica")
+                try:
+                    users = replica.execute(
+                        text("""
+                            SELECT id, push_token FROM users
+                            WHERE id > CAST(:after AS uuid) AND id <= CAST(:end_at AS uuid)
+                            ORDER BY id
+                            LIMIT :limit
+                        """),
+                        {"after": after, "end_at": lease.end_at, "limit": CHECKS_PAGE_SIZE},
+                    ).all()
+                finally:
+                    replica.close()
+            if not users:
+                return True
+
+            db = get_db("prod")
+            try:
+                check_users(db, users, profiler=profiler)
+                lease.counters["users"] = lease.counters.get("users", 0) + len(users)
+                after = str(users[-1][0])
+                lease.save(db, after)
+            finally:
+                db.close()
+        raise LeaseLost(lease)
+
+    coordinator.run(engine, process_shard)
+
+
+def check_users(db, users, profiler: RunProfiler = NO_PROFILER, source: str = "run_checks",
+                plant_db: str = "replica"):
+    """
+    Badge and plant progress checks for (user_id, push_token) pairs, one merged push per
+    user (or queued for the digest). Used by the full periodic scan and by the event listener for just the active users.
+    """
+    cap = FrequencyCap(source=source)
+    with profiler.stage("preload"):
+        # A few users: count just their deliveries. A full scan: one pass over the window.
+        cap.preload(db, user_ids=[u for u, _ in users] if len(users) <= PRELOAD_BY_ID_MAX else None)
+
+    # Each user's messages go out as soon as their checks finish, merged into one push. With
+    # DIGEST_WINDOW_SECONDS set they are queued for the cross-source digest instead, a page at
+    # a time, and the digest flusher logs their deliveries.
+    futures, notified, queued = [], [], []
+    stats = {"pushed": 0, "queued": 0}
+
+    def queue_page():
+        queue_pushes(db, queued, source)
+        db.commit()
+        stats["queued"] += len(queued)
+        queued.clear()
+
+    with profiler.stage("checks"):
+        for user_id, push_token in users:
+            if not push_token:
+                continue
+            # Capped users are skipped before the checks: awarding commits the badge, so checking
+            # them would award it with no push. Their badges are awarded on a later run instead.
+            if not cap.allow(user_id):
+                continue
+            with profiler.user(user_id):
+                badge_msgs = check_user_badge_progress(user_id)
+                plant_msgs = check_user_plant_progress(user_id, plant_db)
+                if not (badge_msgs or plant_msgs):
+                    continue
+
+                pushes = [push(user_id, push_token, "🏅 Badge progress", msg, {"type": "badge", "id": str(user_id)},
+                               lane=TRANSACTIONAL) for msg in badge_msgs]
+                pushes += [push(user_id, push_token, "🌱 Plant progress", msg, {"type": "plant", "id": str(user_id)},
+                                lane=TRANSACTIONAL) for msg in plant_msgs]
+                if DIGEST_WINDOW_SECONDS:
+                    queued.extend(pushes)
+                    if len(queued) >= MULTICAST_LIMIT:
+                        queue_page()
+                    continue
+                futures.extend(send_pushes(pushes))
+                notified.append((user_id, push_token))
+                stats["pushed"] += 1
+        if queued:
+            queue_page()
 
-    for user_id in user_ids:
-        badge_msgs = check_user_badge_progress(user_id)
-        plant_msgs = check_user_plant_progress(user_id)
+    with profiler.stage("send"):
+        wait(futures)
+    with profiler.stage("record_deliveries"):
+        # Only delivered pushes count against the cap
+        delivered = {t for f in futures if f.exception() is None for t in delivered_tokens(f.result())}
+        cap.record([user_id for user_id, push_token in notified if push_token in delivered])
+        cap.flush(db)
+    print(f"✅ Progress pushes: {stats}, frequency cap: {cap.stats}")
 
-        all_msgs = badge_msgs + plant_msgs
-        if all_msgs:
-            send_push_notification(user_id=user_id, messages=all_msgs)
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run badge and plant progress checks for every user.")
+    parser.add_argument("--shards", type=int, metavar="N",
+                        help="cooperate with other hosts on N user-id shards (all hosts must pass the same N and run key)")
+    parser.add_argument("--run-key", help="shared name of the sharded run (default: the current UTC hour)")
+    parser.add_argument("--profile", action="store_true", help="profile the run and write a report")
+    parser.add_argument("--profile-out", metavar="PATH", help="report path (default profile-run_checks-<time>.txt)")
+    args = parser.parse_args()
 
+    profiler = RunProfiler("run_checks", enabled=args.profile)
+    profiler.start()
+    try:
+        if args.shards:
+            run_sharded_checks(args.run_key or datetime.now(timezone.utc).strftime("%Y-%m-%dT%H"), args.shards, profiler)
+        else:
+            run_background_checks(profiler)
+    finally:
+        report = profiler.report(args.profile_out)
+        if report:
+            print(f"📈 Profile report written to {report}")
@@ -0,0 +1,280 @@
+"""
+Cooperative sharding of batch jobs across hosts. A run (job + run_key, e.g. the day)
+splits the user id space into SHARD_COUNT ranges, one row each in job_shards. Every
+instance started with the same run_key claims free shards, renews its lease from a
+heartbeat thread while it works, and marks each shard done. A shard whose lease
+expired (its instance died or stalled) is reclaimed by whoever asks next and resumes
+from the shard's last checkpoint. Lease times use the database clock, so host clock
+skew doesn't matter.
+
+Use more shards than hosts (the default 16 is fine for up to ~8) so a slow shard or
+an extra node still balances out.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "16"))
+SHARD_LEASE_SECONDS = int(os.getenv("SHARD_LEASE_SECONDS", "120"))
+SHARD_HEARTBEAT_SECONDS = int(os.getenv("SHARD_HEARTBEAT_SECONDS", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    def __init__(self, lease: "ShardLease"):
+        super().__init__(f"Lease on {lease.job}/{lease.run_key} shard {lease.shard} was taken over")
+        self.lease = lease
+
+
+def shard_bounds(shard: int, count: int):
+    """
+    (start_after, end_at) of a shard as uuid strings: ids with start_after < id <= end_at.
+    Ranges split the uuid space evenly, which is even in users too for random (v4) ids.
+    """
+    size = 1 << 128
+    lo = shard * size // count
+    hi = (shard + 1) * size // count - 1
+    return str(uuid.UUID(int=max(lo - 1, 0))), str(uuid.UUID(int=hi))
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class ShardLease:
+    """
+    One claimed shard. Has the same `last_key` / `counters` / `batches` / `save()` shape
+    as JobRun, so a batch loop can checkpoint either one. `save()` only commits while this
+    instance still owns the lease; otherwise it rolls back and raises LeaseLost.
+    """
+
+    def __init__(self, job: str, run_key: str, shard: int, owner: str, start_after: str, end_at: str,
+                 check_date: datetime, last_key: Optional[str] = None, batches: int = 0,
+                 counters: Optional[Dict] = None, previous_owner: Optional[str] = None):
+        self.job = job
+        self.run_key = run_key
+        self.shard = shard
+        self.owner = owner
+        self.start_after = start_after
+        self.end_at = end_at
+        self.check_date = check_date
+        self.last_key = last_key
+        self.batches = batches
+        self.counters = counters or {}
+        self.previous_owner = previous_owner
+        self.lost = threading.Event()
+
+    @property
+    def key(self) -> Dict:
+        return {"job": self.job, "run_key": self.run_key, "shard": self.shard, "owner": self.owner}
+
+    def save(self, db, last_key: str):
+        result = db.execute(
+            text("""
+                UPDATE job_shards
+                SET last_key = :last_key, batches = :batches, counters = CAST(:counters AS jsonb),
+                    lease_until = NOW() + make_interval(secs => :lease), updated_at = NOW()
+                WHERE job = :job AND run_key = :run_key AND shard = :shard AND owner = :owner
+            """),
+            {**self.key, "last_key": last_key, "batches": self.batches + 1,
+             "counters": json.dumps(self.counters), "lease": SHARD_LEASE_SECONDS},
+        )
+        if result.rowcount != 1:
+            db.rollback()
+            self.lost.set()
+            raise LeaseLost(self)
+        db.commit()
+        self.last_key = last_key
+        self.batches += 1
+
+    def renew(self, db) -> bool:
+        result = db.execute(
+            text("""
+                UPDATE job_shards SET lease_until = NOW() + make_interval(secs => :lease), updated_at = NOW()
+                WHERE job = :job AND run_key = :run_key AND shard = :shard AND owner = :owner AND status = 'running'
+            """),
+            {**self.key, "lease": SHARD_LEASE_SECONDS},
+        )
+        db.commit()
+        return result.rowcount == 1
+
+    def finish(self, db):
+        result = db.execute(
+            text("""
+                UPDATE job_shards
+                SET status = 'done', counters = CAST(:counters AS jsonb), lease_until = NULL,
+                    finished_at = NOW(), updated_at = NOW()
+                WHERE job = :job AND run_key = :run_key AND shard = :shard AND owner = :owner
+            """),
+            {**self.key, "counters": json.dumps(self.counters)},
+        )
+        if result.rowcount != 1:
+            db.rollback()
+            raise LeaseLost(self)
+        db.commit()
+
+    def release(self, db):
+        """Gives the shard back (e.g. after a DB failure) so another instance can pick it up now."""
+        db.execute(
+            text("""
+                UPDATE job_shards SET owner = NULL, lease_until = NULL, status = 'pending', updated_at = NOW()
+                WHERE job = :job AND run_key = :run_key AND shard = :shard AND owner = :owner
+            """),
+            self.key,
+        )
+        db.commit()
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, engine, lease: ShardLease, interval: float):
+        super().__init__(name=f"shard-heartbeat-{lease.shard}", daemon=True)
+        self.engine = engine
+        self.lease = lease
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                with self.engine.connect() as conn:
+                    if not self.lease.renew(conn):
+                        logger.error("Lost lease on shard %d", self.lease.shard)
+                        self.lease.lost.set()
+                        return
+            except Exception as e:
+                # Keep trying; the lease only lapses after SHARD_LEASE_SECONDS without a renewal
+                logger.warning("Heartbeat for shard %d failed: %s", self.lease.shard, e)
+
+
+class ShardCoordinator:
+    def __init__(self, job: str, run_key: str, count: int = SHARD_COUNT, owner: Optional[str] = None):
+        self.job = job
+        self.run_key = run_key
+        self.count = count
+        self.owner = owner or default_owner()
+        self.stats = {"claimed": 0, "reclaimed": 0, "done": 0, "lost": 0, "released": 0}
+
+    def ensure(self, db, check_date: datetime) -> datetime:
+        """
+        Creates the run's shard rows if this is the first instance to arrive. Returns the
+        run's check_date, which is the first instance's, so all hosts compute the same day.
+        """
+        rows = []
+        for shard in range(self.count):
+            start_after, end_at = shard_bounds(shard, self.count)
+            rows.append({"job": self.job, "run_key": self.run_key, "shard": shard,
+                         "start_after": start_after, "end_at": end_at, "check_date": check_date})
+        db.execute(
+            text("""
+                INSERT INTO job_shards (job, run_key, shard, start_after, end_at, check_date)
+                VALUES (:job, :run_key, :shard, :start_after, :end_at, :check_date)
+                ON CONFLICT (job, run_key, shard) DO NOTHING
+            """),
+            rows,
+        )
+        db.commit()
+        stored = db.execute(
+            text("SELECT check_date, COUNT(*) AS shards FROM job_shards WHERE job = :job AND run_key = :run_key GROUP BY check_date"),
+            {"job": self.job, "run_key": self.run_key},
+        ).all()
+        if len(stored) != 1 or stored[0].shards != self.count:
+            raise RuntimeError(f"Run {self.job}/{self.run_key} already exists with a different shard layout")
+        return stored[0].check_date
+
+    def claim(self, db) -> Optional[ShardLease]:
+        """Takes the lowest unfinished shard that is free or whose lease expired, or None."""
+        row = db.execute(
+            text("""
+                WITH next AS (
+                    SELECT job, run_key, shard, owner AS previous_owner
+                    FROM job_shards
+                    WHERE job = :job AND run_key = :run_key AND status <> 'done'
+                      AND (lease_until IS NULL OR lease_until < NOW())
+                    ORDER BY shard
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE job_shards s
+                SET owner = :owner, status = 'running', lease_until = NOW() + make_interval(secs => :lease),
+                    started_at = COALESCE(s.started_at, NOW()), updated_at = NOW()
+                FROM next
+                WHERE s.job = next.job AND s.run_key = next.run_key AND s.shard = next.shard
+                RETURNING s.job, s.run_key, s.shard, s.start_after, s.end_at, s.check_date, s.last_key,
+                          s.batches, s.counters, next.previous_owner
+            """),
+            {"job": self.job, "run_key": self.run_key, "owner": self.owner, "lease": SHARD_LEASE_SECONDS},
+        ).mappings().first()
+        db.commit()
+        if not row:
+            return None
+        counters = row["counters"]
+        if isinstance(counters, str):
+            counters = json.loads(counters)
+        lease = ShardLease(row["job"], row["run_key"], row["shard"], self.owner, str(row["start_after"]),
+                           str(row["end_at"]), row["check_date"], row["last_key"], row["batches"], counters,
+                           row["previous_owner"])
+        self.stats["claimed"] += 1
+        if lease.previous_owner:
+            self.stats["reclaimed"] += 1
+            logger.warning("Reclaimed shard %d from %s (resuming after %s)",
+                           lease.shard, lease.previous_owner, lease.last_key or lease.start_after)
+        return lease
+
+    def progress(self, db) -> List[Dict]:
+        """Per-shard status for the run, e.g. for a dashboard or the end-of-run log."""
+        return [dict(r) for r in db.execute(
+            text("""
+                SELECT shard, status, owner, batches, counters, lease_until, started_at, finished_at
+                FROM job_shards WHERE job = :job AND run_key = :run_key ORDER BY shard
+            """),
+            {"job": self.job, "run_key": self.run_key},
+        ).mappings()]
+
+    def run(self, engine, process_shard: Callable[[ShardLease], bool]):
+        """
+        Claims and processes shards until none are left to claim. `process_shard` returns
+        True when the shard's range is finished; False stops this instance and releases
+        the shard for the others.
+        """
+        while True:
+            with engine.connect() as conn:
+                lease = self.claim(conn)
+            if lease is None:
+                break
+            logger.info("Shard %d/%d claimed by %s", lease.shard, self.count, self.owner)
+
+            heartbeat = _Heartbeat(engine, lease, SHARD_HEARTBEAT_SECONDS)
+            heartbeat.start()
+            try:
+                finished = process_shard(lease)
+                with engine.connect() as conn:
+                    if finished:
+                        lease.finish(conn)
+                        self.stats["done"] += 1
+                        logger.info("Shard %d done: %s", lease.shard, lease.counters)
+                    else:
+                        lease.release(conn)
+                        self.stats["released"] += 1
+                        return
+            except LeaseLost as e:
+                self.stats["lost"] += 1
+                logger.error("%s; moving on", e)
+            finally:
+                heartbeat.stopped.set()
+
+        with engine.connect() as conn:
+            shards = self.progress(conn)
+        pending = [s["shard"] for s in shards if s["status"] != "done"]
+        if pending:
+            logger.info("No free shards left for %s; %d still running elsewhere: %s", self.owner, len(pending), pending)
+        else:
+            logger.info("Run %s/%s complete: all %d shards done", self.job, self.run_key, self.count)
+        logger.info("Shard stats for %s: %s", self.owner, self.stats)
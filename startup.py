@@ -0,0 +1,97 @@
+"""
+Startup helpers. `prewarm` opens pool connections and initializes the push transport
+(including its access token) so the first request doesn't pay for it; main.py runs it
+from the FastAPI lifespan.
+
+    python startup.py --import-budget [SECONDS]   # fail if `import main` is slower than the budget
+"""
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+PREWARM_DB_CONNECTIONS = int(os.getenv("PREWARM_DB_CONNECTIONS", "2"))
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "1.5"))
+
+
+def prewarm(async_path: bool = False):
+    """Sync prewarm; each step is best-effort and only logged on failure."""
+    from db import prewarm_engine
+    from push_transports import get_transport
+
+    start = time.monotonic()
+    try:
+        prewarm_engine("prod", PREWARM_DB_CONNECTIONS)
+    except Exception as e:
+        logger.warning("DB prewarm failed: %s", e)
+    if not async_path:
+        try:
+            get_transport().prewarm()
+        except Exception as e:
+            logger.warning("Push transport prewarm failed: %s", e)
+    logger.info("Prewarm done in %.2fs", time.monotonic() - start)
+
+
+async def prewarm_async(async_path: bool = False):
+    """Runs `prewarm` off the loop; with async_path also warms the asyncpg pool and async transport."""
+    await asyncio.to_thread(prewarm, async_path)
+    if not async_path:
+        return
+    from sqlalchemy import text
+    from db import get_async_prod_engine
+    from push_transports import get_async_transport
+
+    try:
+        async with get_async_prod_engine().connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    except Exception as e:
+        logger.warning("Async DB prewarm failed: %s", e)
+    try:
+        await get_async_transport().prewarm()
+    except Exception as e:
+        logger.warning("Async push transport prewarm failed: %s", e)
+
+
+# ======== Import-time budget ========
+def measure_import(module: str = "main"):
+    """
+    Imports `module` in a fresh interpreter with no database URLs set (nothing may
+    connect or need credentials at import). Returns (seconds, top modules by cumulative µs).
+    """
+    env = {k: v for k, v in os.environ.items() if not k.endswith("DATABASE_URL") and k != "REPLICA_DATABASE_URLS"}
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    top = []
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            top.append((int(parts[1]), parts[2].strip()))
+    top.sort(reverse=True)
+    return float(proc.stdout.strip().splitlines()[-1]), top[:15]
+
+
+def check_import_budget(budget: float = IMPORT_BUDGET_SECONDS, module: str = "main") -> bool:
+    seconds, top = measure_import(module)
+    print(f"import {module}: {seconds:.3f}s (budget {budget:.2f}s)")
+    for cumulative_us, name in top:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+    return seconds <= budget
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--import-budget":
+        ok = check_import_budget(float(sys.argv[2]) if len(sys.argv) > 2 else IMPORT_BUDGET_SECONDS)
+        sys.exit(0 if ok else 1)
+    print(__doc__)
@@ -0,0 +1,112 @@
+"""
+Statement registry for the hot per-user queries. Each query is defined once at import
+with `register`, and `run` executes it through a server-side prepared statement: the
+first use on a pooled connection sends `PREPARE`, later uses send only `EXECUTE name(...)`
+with the parameters, so Postgres skips parsing and (after its generic plan kicks in)
+planning. Prepared names are tracked per DBAPI connection in the pool entry's `info`.
+
+Set PREPARED_STATEMENTS=0 behind a transaction-mode pooler (pgbouncer), where session
+state like prepared statements does not survive between transactions.
+
+    python statements.py [USERS]   # per-user query path, text() vs prepared (needs BENCH_DATABASE_URL)
+"""
+import os
+import re
+import sys
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+PREPARED_STATEMENTS = os.getenv("PREPARED_STATEMENTS", "1") != "0"
+
+# Same bind-parameter syntax text() accepts; leaves `::type` casts alone
+_BIND = re.compile(r"(?<![:\w\\]):(\w+)(?!:)")
+
+STATEMENTS: Dict[str, "Statement"] = {}
+stats = {"prepared": 0, "executed": 0}
+
+
+class Statement:
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.text = text(sql)
+
+        params = []
+        for p in _BIND.findall(sql):
+            if p not in params:
+                params.append(p)
+        self.params = params
+        positional = _BIND.sub(lambda m: f"${params.index(m.group(1)) + 1}", sql)
+        self.prepare_sql = f"PREPARE {name} AS {positional}"
+        args = "(" + ", ".join(f":{p}" for p in params) + ")" if params else ""
+        self.execute_text = text(f"EXECUTE {name}{args}")
+
+    def __repr__(self):
+        return f"Statement({self.name!r})"
+
+
+def register(name: str, sql: str) -> Statement:
+    """Defines a named statement. Names are global to the process and must be unique."""
+    if name in STATEMENTS:
+        raise ValueError(f"Statement {name!r} is already registered")
+    stmt = STATEMENTS[name] = Statement(name, sql)
+    return stmt
+
+
+def run(db, stmt: Statement, params: Optional[Dict] = None):
+    """
+    Executes a registered statement on a Session or Connection and returns the usual
+    SQLAlchemy Result. Falls back to plain text() off Postgres, on asyncpg, or when disabled.
+    """
+    params = params or {}
+    conn = db if isinstance(db, Connection) else db.connection()
+    # asyncpg already prepares and caches every statement per connection
+    if not PREPARED_STATEMENTS or conn.dialect.name != "postgresql" or conn.dialect.driver == "asyncpg":
+        return conn.execute(stmt.text, params)
+
+    prepared = conn.connection.info.setdefault("prepared_statements", set())
+    if stmt.name not in prepared:
+        conn.exec_driver_sql(stmt.prepare_sql)
+        prepared.add(stmt.name)
+        stats["prepared"] += 1
+    stats["executed"] += 1
+    return conn.execute(stmt.execute_text, {p: params[p] for p in stmt.params})
+
+
+# ======== Benchmark ========
+def _bench(n: int, url: Optional[str] = os.getenv("BENCH_DATABASE_URL")):
+    """Profile + friends + streak stats for n existing users, once via text() and once prepared."""
+    from datetime import datetime, timezone
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    import statements  # the module the query helpers use, not __main__
+    import user_db_utils
+    from badge_checks import get_app_activity
+
+    if not url:
+        print("BENCH_DATABASE_URL not set")
+        return
+
+    engine = create_engine(url)
+    now = datetime.now(timezone.utc)
+    with Session(engine) as db:
+        user_ids = db.execute(text("SELECT id FROM users LIMIT :n"), {"n": n}).scalars().all()
+        for label, enabled in (("text()", False), ("prepared", True)):
+            statements.PREPARED_STATEMENTS = enabled
+            start = time.perf_counter()
+            for uid in user_ids:
+                user_db_utils.clear_user_cache()
+                user_db_utils.get_user(db, uid)
+                user_db_utils.get_friends(db, uid)
+                get_app_activity(db, uid, now)
+            elapsed = time.perf_counter() - start
+            print(f"{label:9} {len(user_ids) / elapsed:10,.0f} users/s ({elapsed * 1000 / max(len(user_ids), 1):.2f} ms/user)")
+            db.rollback()
+    print(f"statements: {statements.stats}")
+
+
+if __name__ == "__main__":
+    _bench(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
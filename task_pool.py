@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+# Phase-change fan-outs: how many run at once and how many may wait behind them
+PHASE_CHANGE_WORKERS = int(os.getenv("PHASE_CHANGE_WORKERS", "8"))
+PHASE_CHANGE_QUEUE = int(os.getenv("PHASE_CHANGE_QUEUE", "200"))
+
+LATENCY_SAMPLES = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class PoolFull(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} queue is full")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def _percentile_ms(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] * 1000
+
+
+class BoundedPool:
+    """
+    Runs tasks on `workers` slots with at most `max_queue` more waiting. `submit`
+    raises PoolFull instead of queueing past that, with a retry_after estimated
+    from recent run times. Plain functions run on a dedicated thread pool;
+    coroutine functions run on the caller's event loop behind a semaphore.
+    """
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks = set()  # the loop only keeps weak references to tasks
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self._waits = deque(maxlen=LATENCY_SAMPLES)  # seconds from submit to start
+        self._runs = deque(maxlen=LATENCY_SAMPLES)   # seconds from start to finish
+
+    def _admit(self):
+        with self._lock:
+            if self._queued + self._running >= self.workers + self.max_queue:
+                self.stats["rejected"] += 1
+                raise PoolFull(self.name, self._retry_after())
+            self._queued += 1
+            self.stats["submitted"] += 1
+        return time.monotonic()
+
+    def _retry_after(self) -> float:
+        """Roughly how long until the queue drains by one worker's worth of tasks."""
+        avg_run = sum(self._runs) / len(self._runs) if self._runs else 1.0
+        return max(1.0, avg_run * self._queued / max(self.workers, 1))
+
+    def _started(self, submitted_at: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._waits.append(now - submitted_at)
+        return now
+
+    def _finished(self, started_at: float, failed: bool):
+        with self._lock:
+            self._running -= 1
+            self._runs.append(time.monotonic() - started_at)
+            self.stats["failed" if failed else "completed"] += 1
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """Schedules fn; returns a Future (plain function) or an asyncio.Task (coroutine function)."""
+        submitted_at = self._admit()
+        if asyncio.iscoroutinefunction(fn):
+            task = asyncio.get_running_loop().create_task(self._run_async(submitted_at, fn, args, kwargs))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return task
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._executor.submit(self._run, submitted_at, fn, args, kwargs)
+
+    def _run(self, submitted_at, fn, args, kwargs):
+        started_at = self._started(submitted_at)
+        failed = True
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+            return result
+        except Exception:
+            # Callers usually drop the future, so this is the only trace of the failure
+            logger.exception("%s task %s failed", self.name, getattr(fn, "__name__", fn))
+            raise
+        finally:
+            self._finished(started_at, failed)
+
+    async def _run_async(self, submitted_at, fn, args, kwargs):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        async with self._slots:
+            started_at = self._started(submitted_at)
+            failed = True
+            try:
+                result = await fn(*args, **kwargs)
+                failed = False
+                return result
+            except Exception:
+                logger.exception("%s task %s failed", self.name, getattr(fn, "__name__", fn))
+                raise
+            finally:
+                self._finished(started_at, failed)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queued": self._queued,
+                "running": self._running,
+                **self.stats,
+                "avg_wait_ms": (sum(self._waits) / len(self._waits) * 1000) if self._waits else 0.0,
+                "p95_wait_ms": _percentile_ms(self._waits, 0.95),
+                "avg_run_ms": (sum(self._runs) / len(self._runs) * 1000) if self._runs else 0.0,
+                "p95_run_ms": _percentile_ms(self._runs, 0.95),
+            }
+
+
+_pools: Dict[str, BoundedPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name: str, workers: int, max_queue: int) -> BoundedPool:
+    """Process-wide pool by name, created on first use."""
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = BoundedPool(name, workers, max_queue)
+        return _pools[name]
+
+
+def get_phase_change_pool() -> BoundedPool:
+    return get_pool("phase_change", PHASE_CHANGE_WORKERS, PHASE_CHANGE_QUEUE)
+
+
+def pool_stats() -> Dict[str, Dict]:
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {p.name: p.snapshot() for p in pools}
@@ -0,0 +1,102 @@
+import os
+import threading
+from collections import Counter
+from typing import Dict
+
+from cachetools import TTLCache
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+# Unread counts live in notification_unread_counts, maintained on every insert and
+# read, so the inbox badge is a primary-key lookup (plus this cache), never a COUNT(*).
+UNREAD_CACHE_SIZE = int(os.getenv("UNREAD_CACHE_SIZE", "100000"))
+UNREAD_CACHE_TTL = int(os.getenv("UNREAD_CACHE_TTL", "30"))
+
+_cache = TTLCache(maxsize=UNREAD_CACHE_SIZE, ttl=UNREAD_CACHE_TTL)
+_lock = threading.Lock()
+
+
+def bump_unread_counts(db, counts: Dict[str, int]):
+    """
+    Adds `counts` ({user_id: n}) to the stored unread counts in one statement. Caller
+    commits; the cache only changes once that commit happens.
+    """
+    if not counts:
+        return
+    # Upsert in a fixed order so concurrent fan-outs with overlapping recipients lock rows
+    # in the same order instead of deadlocking
+    deltas = sorted((str(uid), n) for uid, n in counts.items())
+    # Counts never go below 0. Only increments insert rows; decrements just update existing
+    # ones (a missing row already reads as 0), so a negative count is never stored.
+    increments = [(uid, n) for uid, n in deltas if n > 0]
+    decrements = [(uid, n) for uid, n in deltas if n < 0]
+    if increments:
+        db.execute(
+            text("""
+                INSERT INTO notification_unread_counts (user_id, unread)
+                SELECT * FROM unnest(CAST(:user_ids AS uuid[]), CAST(:deltas AS int[]))
+                ON CONFLICT (user_id)
+                DO UPDATE SET unread = notification_unread_counts.unread + EXCLUDED.unread
+            """),
+            {"user_ids": [uid for uid, _ in increments], "deltas": [n for _, n in increments]},
+        )
+    if decrements:
+        db.execute(
+            text("""
+                UPDATE notification_unread_counts c
+                SET unread = GREATEST(c.unread + d.delta, 0)
+                FROM unnest(CAST(:user_ids AS uuid[]), CAST(:deltas AS int[])) AS d(user_id, delta)
+                WHERE c.user_id = d.user_id
+            """),
+            {"user_ids": [uid for uid, _ in decrements], "deltas": [n for _, n in decrements]},
+        )
+    _after_commit(db, dict(deltas))
+
+
+def _after_commit(db, deltas: Dict[str, int]):
+    """Queues cache updates on the session until it commits; a rollback discards them."""
+    if not isinstance(db, Session):
+        # A plain Connection (maintenance scripts): its commit can't be observed, so drop the entries
+        with _lock:
+            for uid in deltas:
+                _cache.pop(uid, None)
+        return
+    if "unread_deltas" not in db.info:
+        db.info["unread_deltas"] = Counter()
+        event.listen(db, "after_commit", _apply_pending)
+        event.listen(db, "after_rollback", _discard_pending)
+    db.info["unread_deltas"].update(deltas)
+
+
+def _apply_pending(session):
+    pending = session.info.get("unread_deltas")
+    if not pending:
+        return
+    with _lock:
+        for uid, delta in pending.items():
+            if uid in _cache:
+                _cache[uid] = max(_cache[uid] + delta, 0)
+    pending.clear()
+
+
+def _discard_pending(session):
+    pending = session.info.get("unread_deltas")
+    if pending:
+        with _lock:
+            for uid in pending:
+                _cache.pop(uid, None)
+        pending.clear()
+
+
+def get_unread_count(db, user_id) -> int:
+    uid = str(user_id)
+    with _lock:
+        if uid in _cache:
+            return _cache[uid]
+    count = db.execute(
+        text("SELECT unread FROM notification_unread_counts WHERE user_id = :uid"),
+        {"uid": user_id},
+    ).scalar() or 0
+    with _lock:
+        _cache[uid] = count
+    return count
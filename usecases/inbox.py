@@ -0,0 +1,124 @@
+import base64
+import binascii
+import uuid
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from notification_retention import retention_cutoff
+from unread_counts import bump_unread_counts, get_unread_count
+
+INBOX_PAGE_LIMIT = 100
+
+_PAGE_COLUMNS = """
+    SELECT id, message, type, type_id, from_user_id, created_at, read_at
+    FROM notifications
+"""
+
+# The created_at lower bound (the retention cutoff) prunes partitions that are due to be dropped
+FIRST_PAGE_QUERY = text(_PAGE_COLUMNS + """
+    WHERE to_user_id = :uid
+      AND created_at >= :since
+    ORDER BY created_at DESC, id DESC
+    LIMIT :limit
+""")
+
+NEXT_PAGE_QUERY = text(_PAGE_COLUMNS + """
+    WHERE to_user_id = :uid
+      AND created_at >= :since
+      AND (created_at, id) < (:before_created_at, CAST(:before_id AS uuid))
+    ORDER BY created_at DESC, id DESC
+    LIMIT :limit
+""")
+
+
+def encode_cursor(created_at: datetime, notification_id) -> str:
+    raw = f"{created_at.isoformat()}|{notification_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """(created_at, notification id) from an encode_cursor string. Raises ValueError if malformed."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        created_at, notification_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), str(uuid.UUID(notification_id))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def list_notifications(db, user_id, limit: int = 20, cursor: Optional[str] = None):
+    """
+    One page of a user's inbox, newest first, keyset-paginated on (created_at, id).
+    Pass the returned next_cursor to get the following page.
+    """
+    limit = max(1, min(limit, INBOX_PAGE_LIMIT))
+    since = retention_cutoff()
+    if cursor:
+        before_created_at, before_id = decode_cursor(cursor)
+        rows = db.execute(NEXT_PAGE_QUERY, {
+            "uid": user_id,
+            "before_created_at": before_created_at,
+            "before_id": before_id,
+            "since": since,
+            "limit": limit + 1,
+        }).mappings().all()
+    else:
+        rows = db.execute(FIRST_PAGE_QUERY, {"uid": user_id, "since": since, "limit": limit + 1}).mappings().all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [
+            {
+                "id": str(r["id"]),
+                "message": r["message"],
+                "type": r["type"],
+                "type_id": str(r["type_id"]) if r["type_id"] else None,
+                "from_user_id": str(r["from_user_id"]) if r["from_user_id"] else None,
+                "created_at": r["created_at"].isoformat() if r["created_at"] else None,
+                "read": r["read_at"] is not None,
+            }
+            for r in rows
+        ],
+        "next_cursor": encode_cursor(rows[-1]["created_at"], rows[-1]["id"]) if has_more else None,
+        "unread_count": get_unread_count(db, user_id),
+    }
+
+
+def mark_read(db, user_id, notification_ids: Optional[List[str]] = None) -> int:
+    """
+    Marks the given notifications (or all of them when ids is None) read. Returns how many
+    changed. Raises ValueError, before touching the database, if an id is not a UUID.
+    """
+    if notification_ids:
+        notification_ids = [str(uuid.UUID(i)) for i in notification_ids]
+    if notification_ids is None:
+        # Not bounded by the retention cutoff: the stored count includes every unread row,
+        # so every one has to be marked, including ones in partitions not yet dropped
+        changed = db.execute(
+            text("""
+                UPDATE notifications SET read_at = NOW(), updated_at = NOW()
+                WHERE to_user_id = :uid AND read_at IS NULL
+            """),
+            {"uid": user_id},
+        ).rowcount
+        # Decrement rather than reset, so a notification committed meanwhile keeps its count
+        if changed:
+            bump_unread_counts(db, {str(user_id): -changed})
+    else:
+        if not notification_ids:
+            return 0
+        changed = db.execute(
+            text("""
+                UPDATE notifications SET read_at = NOW(), updated_at = NOW()
+                WHERE to_user_id = :uid AND id = ANY(CAST(:ids AS uuid[])) AND read_at IS NULL
+                  AND created_at >= :since
+            """),
+            {"uid": user_id, "ids": list(notification_ids), "since": retention_cutoff()},
+        ).rowcount
+        if changed:
+            bump_unread_counts(db, {str(user_id): -changed})
+    db.commit()
+    return changed
@@ -1,14 +1,34 @@
-import uuid
-from sqlalchemy import text
-from user_db_utils import get_user, get_friends
-from notifier import send_push_notification
+import os
+
+from user_db_utils import get_user, iter_friends
+from push_lanes import REALTIME
+from digest import DIGEST_WINDOW_SECONDS, push, queue_pushes, send_pushes
+from frequency_cap import log_deliveries
+from concurrent.futures import wait
+from retry_queue import delivered_tokens
 from db import get_db
-from datetime import datetime, timezone
+from circuit_breaker import CircuitOpenError, get_breaker
+from notification_writer import write_notifications
+
+# Friends per streamed chunk: one COPY + commit and ceil(chunk / 500) multicasts each
+FANOUT_CHUNK_SIZE = int(os.getenv("FANOUT_CHUNK_SIZE", "1000"))
 
 
 def process_phase_change(user_id, previous_phase):
     db = get_db("prod")
-    user = get_user(db, user_id)
+    try:
+        _process_phase_change(db, user_id, previous_phase)
+    except CircuitOpenError as e:
+        # Prod DB is degraded; drop this fan-out rather than pile up blocked threads
+        print(f"⚠️ Skipping phase change for {user_id}: {e}")
+    finally:
+        db.close()
+
+
+def _process_phase_change(db, user_id, previous_phase):
+    prod_db = get_breaker("prod_db")
+    with prod_db.guard():
+        user = get_user(db, user_id)
     print('User: ', user)
 
     if not user:
@@ -18,60 +38,57 @@ def process_phase_change(user_id, previous_phase):
     name = user["username"] or user["name"]
     db_text = f" changed their phase from '{previous_phase}' to '{current_phase}'."
 
-    friends = get_friends(db, user_id)
-
-    # testing
-    # friends = list(filter(lambda f: str(f["id"]) == "9e35fd93-b0c3-4d30-afdd-17a20c0f6a1e", friends))
-
-    print(friends)
-
-    # Build notifications
-    notif_rows = [
-        {
-            "message": db_text,
-            "type": "profile",
-            "type_id": user_id,
-            "to_user_id": friend["id"],
-            "from_user_id": user_id,
-        }
-        for friend in friends
-    ]
-
-    # Insert notifications in bulk
-    insert_notifications(db, notif_rows)
-
-    # Dispatch push notifications
-    for f in friends:
-        if f["push_token"]:
-            send_push_notification(
-                tokens=[f["push_token"]],
-                title=f"{name} changed their phase",
-                body=f"{name} changed their phase to '{current_phase}'",
-                image=None,
-                data={"type": "friend", "id": user_id},
-            )
-
+    title = f"{name} changed their phase"
+    body = f"{name} changed their phase to '{current_phase}'"
+    data = {"type": "friend", "id": str(user_id)}
+
+    # Stream friends in chunks so memory and per-transaction size stay bounded however many
+    # friends there are. Each chunk's notifications commit, then its pushes go out as
+    # multicasts on the realtime lane while the next chunk is written. Realtime friend
+    # pushes themselves are never capped, but the ones delivered are logged so they count
+    # against the caps of later jobs. With DIGEST_WINDOW_SECONDS set, the pushes are queued
+    # for the digest in the chunk's transaction instead, and the flusher logs them.
+    in_flight, owners = [], {}
+    friend_count = 0
+    for friends in iter_friends(db, user_id, FANOUT_CHUNK_SIZE):
+        friend_count += len(friends)
+        pushes = [push(f["id"], f["push_token"], title, body, data, lane=REALTIME) for f in friends if f["push_token"]]
+        with prod_db.guard():
+            if DIGEST_WINDOW_SECONDS:
+                queue_pushes(db, pushes, "phase_change")
+            insert_notifications(db, [
+                {
+                    "message": db_text,
+                    "type": "profile",
+                    "type_id": user_id,
+                    "to_user_id": friend["id"],
+                    "from_user_id": user_id,
+                }
+                for friend in friends
+            ])
+
+        wait(in_flight)
+        _log_delivered(db, in_flight, owners)
+        if not DIGEST_WINDOW_SECONDS:
+            owners = {p["token"]: p["user_id"] for p in pushes}
+            in_flight = send_pushes(pushes)
+    wait(in_flight)
+    _log_delivered(db, in_flight, owners)
+    print(f"Phase change for {user_id} fanned out to {friend_count} friends")
+
+
+def _log_delivered(db, futures, owners):
+    """Logs (and commits) deliveries to the friends whose tokens the finished sends got through to."""
+    delivered = [owners[t] for f in futures if f.exception() is None
+                 for t in delivered_tokens(f.result()) if t in owners]
+    if not delivered:
+        return
+    with get_breaker("prod_db").guard():
+        log_deliveries(db, delivered, "phase_change")
+        db.commit()
 
 
 def insert_notifications(db, rows):
     if not rows:
         return
-
-    now = datetime.now(timezone.utc)
-
-    # add id + timestamps
-    for r in rows:
-        r["id"] = str(uuid.uuid4())
-        r["created_at"] = now
-        r["updated_at"] = now
-
-    db.execute(
-        text("""
-            INSERT INTO notifications
-                (id, message, type, type_id, to_user_id, from_user_id, created_at, updated_at)
-            VALUES
-                (:id, :message, :type, :type_id, :to_user_id, :from_user_id, :created_at, :updated_at)
-        """),
-        rows
-    )
-    db.commit()
+    write_notifications(db, rows)
@@ -0,0 +1,95 @@
+import asyncio
+
+from user_db_utils import FRIENDS_QUERY, get_user
+from frequency_cap import log_deliveries
+from db import get_async_db, get_async_streaming_engine
+from circuit_breaker import CircuitOpenError, get_breaker
+from digest import DIGEST_WINDOW_SECONDS, MULTICAST_LIMIT, push, queue_pushes
+from push_lanes import REALTIME
+from notification_writer import write_notifications_async
+from notifier import send_push_notification_async
+from retry_queue import delivered_tokens
+from usecases.phase_change import FANOUT_CHUNK_SIZE
+
+
+async def process_phase_change_async(user_id, previous_phase):
+    """
+    Event-loop version of process_phase_change: asyncpg for the DB, the async push
+    transport for FCM. The sync version stays for scripts.
+    """
+    async with get_async_db() as db:
+        try:
+            await _process_phase_change(db, user_id, previous_phase)
+        except CircuitOpenError as e:
+            print(f"⚠️ Skipping phase change for {user_id}: {e}")
+
+
+async def _process_phase_change(db, user_id, previous_phase):
+    prod_db = get_breaker("prod_db")
+    # The sync query helpers (profile cache, registered statements) run unchanged via run_sync
+    with prod_db.guard():
+        user = await db.run_sync(get_user, user_id)
+
+    if not user:
+        return
+
+    current_phase = user["current_phase_name"]
+    name = user["username"] or user["name"]
+    db_text = f" changed their phase from '{previous_phase}' to '{current_phase}'."
+
+    title = f"{name} changed their phase"
+    body = f"{name} changed their phase to '{current_phase}'"
+    data = {"type": "friend", "id": str(user_id)}
+
+    # Same chunked fan-out as the sync version: each chunk's rows commit, then its pushes
+    # go out as concurrent multicast-sized batches while the next chunk is written.
+    # This path bypasses the thread-based lanes; the FCM breaker still applies. With
+    # DIGEST_WINDOW_SECONDS set, the pushes are queued for the digest in the chunk's transaction.
+    in_flight, owners = None, {}
+    async for friends in _iter_friends(user_id, FANOUT_CHUNK_SIZE):
+        tokens = [f["push_token"] for f in friends if f["push_token"]]
+        with prod_db.guard():
+            if DIGEST_WINDOW_SECONDS:
+                pushes = [push(f["id"], f["push_token"], title, body, data, lane=REALTIME) for f in friends if f["push_token"]]
+                await db.run_sync(queue_pushes, pushes, "phase_change")
+            await write_notifications_async(db, [
+                {
+                    "message": db_text,
+                    "type": "profile",
+                    "type_id": user_id,
+                    "to_user_id": friend["id"],
+                    "from_user_id": user_id,
+                }
+                for friend in friends
+            ])
+
+        if in_flight is not None:
+            await _log_delivered(db, await in_flight, owners)
+            in_flight = None
+        if DIGEST_WINDOW_SECONDS:
+            continue
+        owners = {f["push_token"]: f["id"] for f in friends if f["push_token"]}
+        in_flight = asyncio.gather(*(
+            send_push_notification_async(tokens[i:i + MULTICAST_LIMIT], title=title, body=body, data=data)
+            for i in range(0, len(tokens), MULTICAST_LIMIT)
+        ))
+    if in_flight is not None:
+        await _log_delivered(db, await in_flight, owners)
+
+
+async def _log_delivered(db, results, owners):
+    """Logs (and commits) deliveries to the friends whose tokens the sends got through to."""
+    delivered = [owners[t] for result in results for t in delivered_tokens(result) if t in owners]
+    if not delivered:
+        return
+    with get_breaker("prod_db").guard():
+        await db.run_sync(log_deliveries, delivered, "phase_change")
+        await db.commit()
+
+
+async def _iter_friends(user_id, chunk_size: int):
+    """Friends in chunks from a server-side cursor on a connection from the streaming pool."""
+    async with get_async_streaming_engine().connect() as conn:
+        result = await conn.stream(FRIENDS_QUERY.text, {"uid": user_id})
+        async for chunk in result.mappings().partitions(chunk_size):
+            yield chunk
@@ -1,68 +1,122 @@
-from sqlalchemy import text
+import os
+import threading
 
+from cachetools import TTLCache
+
+from db import get_streaming_engine
+from statements import register, run
+
+# Bounded LRU + TTL profile cache shared by get_user / get_user_by_name / get_user_by_username
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))
+
+_profiles = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)        # id -> profile
+_profile_ids = TTLCache(maxsize=USER_CACHE_SIZE * 2, ttl=USER_CACHE_TTL)  # (column, value) -> id
+_cache_lock = threading.Lock()
+cache_stats = {"hits": 0, "misses": 0}
+
+_PROFILE_SQL = """
+    SELECT id, name, username, push_token,
+           (SELECT name FROM phases WHERE id = users.current_phase) AS current_phase_name
+    FROM users
+    WHERE {column} = :value
+"""
+_PROFILE_QUERIES = {
+    column: register(f"user_profile_by_{column}", _PROFILE_SQL.format(column=column))
+    for column in ("id", "name", "username")
+}
+
+FRIENDS_QUERY = register("user_friends", """
+    SELECT DISTINCT u.id, u.push_token
+    FROM users u
+
+    -- outgoing accepted friend requests
+    INNER JOIN friends fr1
+        ON fr1.friend_id = u.id
+        AND fr1.user_id = :uid
+        AND fr1.request_status = 'accept'
+
+    UNION
+
+    SELECT DISTINCT u2.id, u2.push_token
+    FROM users u2
+
+    -- incoming accepted friend requests
+    INNER JOIN friends fr2
+        ON fr2.user_id = u2.id
+        AND fr2.friend_id = :uid
+        AND fr2.request_status = 'accept'
+""")
+
+
+def _get_profile(db, column, value):
+    key = (column, str(value))
+    with _cache_lock:
+        user_id = str(value) if column == "id" else _profile_ids.get(key)
+        profile = _profiles.get(user_id) if user_id is not None else None
+        if profile is not None:
+            cache_stats["hits"] += 1
+            return profile
+        cache_stats["misses"] += 1
+
+    row = run(db, _PROFILE_QUERIES[column], {"value": value}).mappings().first()
+    if not row:
+        return None
+
+    profile = dict(row)
+    user_id = str(profile["id"])
+    with _cache_lock:
+        _profiles[user_id] = profile
+        _profile_ids[("name", str(profile["name"]))] = user_id
+        _profile_ids[("username", str(profile["username"]))] = user_id
+    return profile
+
+
+def invalidate_user(user_id):
+    """
+    Drops a cached profile, and its name/username lookups, so the next lookup by any of
+    them reads through to the database.
+    """
+    user_id = str(user_id)
+    with _cache_lock:
+        profile = _profiles.pop(user_id, None)
+        if profile is None:
+            return
+        for key in (("name", str(profile["name"])), ("username", str(profile["username"]))):
+            # The name may already point at another user that took it since
+            if _profile_ids.get(key) == user_id:
+                del _profile_ids[key]
+
+
+def clear_user_cache():
+    with _cache_lock:
+        _profiles.clear()
+        _profile_ids.clear()
+        cache_stats["hits"] = cache_stats["misses"] = 0
 
 
 def get_user(db, user_id):
-    result = db.execute(
-        text("""
-            SELECT id, name, username,
-                   (SELECT name FROM phases WHERE id = users.current_phase) AS current_phase_name
-            FROM users
-            WHERE id = :uid
-        """),
-        {"uid": user_id}
-    )
-    return result.mappings().first()
+    return _get_profile(db, "id", user_id)
 
 def get_friends(db, user_id):
-    result = db.execute(
-        text("""
-            SELECT DISTINCT u.id, u.push_token
-            FROM users u
-            
-            -- outgoing accepted friend requests
-            INNER JOIN friends fr1 
-                ON fr1.friend_id = u.id
-                AND fr1.user_id = :uid
-                AND fr1.request_status = 'accept'
-            
-            UNION
-
-            SELECT DISTINCT u2.id, u2.push_token
-            FROM users u2
-            
-            -- incoming accepted friend requests
-            INNER JOIN friends fr2
-                ON fr2.user_id = u2.id
-                AND fr2.friend_id = :uid
-                AND fr2.request_status = 'accept'
-        """),
-        {"uid": user_id}
-    )
-
-    return result.mappings().all()
+    return run(db, FRIENDS_QUERY, {"uid": user_id}).mappings().all()
+
+
+def iter_friends(db, user_id, chunk_size: int = 1000):
+    """
+    Friends in chunks of `chunk_size` mappings, streamed through a server-side cursor on
+    a prod connection from the streaming pool (see db.STREAM_POOL_SIZE), so the caller
+    can commit on `db` between chunks without holding two main-pool connections.
+    """
+    with get_streaming_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(
+            FRIENDS_QUERY.text, {"uid": user_id}
+        )
+        for chunk in result.mappings().partitions(chunk_size):
+            yield chunk
 
 def get_user_by_name(db, name):
-    result = db.execute(
-        text("""
-            SELECT id, name, username,
-                   (SELECT name FROM phases WHERE id = users.current_phase) AS current_phase_name
-            FROM users
-            WHERE name = :name
-        """),
-        {"name": name}
-    )
-    return result.mappings().first()
+    return _get_profile(db, "name", name)
 
 def get_user_by_username(db, username):
-    result = db.execute(
-        text("""
-            SELECT id, name, username,
-                   (SELECT name FROM phases WHERE id = users.current_phase) AS current_phase_name
-            FROM users
-            WHERE username = :username
-        """),
-        {"username": username}
-    )
-    return result.mappings().first()
-
+    return _get_profile(db, "username", username)
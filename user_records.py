@@ -0,0 +1,93 @@
+import sys
+from datetime import date, datetime
+from typing import Optional, Union
+
+# Schedule keys are stored on records as an index into this tuple.
+SCHEDULE_KEYS = ("lost_streak", "inconsistent", "consistent", "not_started")
+SCHEDULE_INDEX = {key: i for i, key in enumerate(SCHEDULE_KEYS)}
+NO_SCHEDULE = -1
+
+
+class UserRecord:
+    """
+    Compact per-user record for the batch jobs. One instance per user is created
+    at fetch time and annotated in place by classification and scheduling, so
+    the pipeline never copies a user. Tokens are interned once on creation.
+    """
+
+    __slots__ = ("user_id", "token", "current_streak", "last_watered_date", "app_type", "plant_type", "schedule")
+
+    def __init__(
+        self,
+        user_id,
+        token: Optional[str],
+        current_streak: int = 0,
+        last_watered_date: Optional[Union[date, datetime]] = None,
+    ):
+        self.user_id = user_id
+        self.token = sys.intern(token) if token else token
+        self.current_streak = current_streak or 0
+        self.last_watered_date = last_watered_date
+        # app_type / plant_type hold the shared module-level literals, never per-user strings
+        self.app_type: Optional[str] = None
+        self.plant_type: Optional[str] = None
+        self.schedule = NO_SCHEDULE
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.user_id, row.push_token, row.current_streak, row.last_watered_date)
+
+    @property
+    def schedule_key(self) -> Optional[str]:
+        return SCHEDULE_KEYS[self.schedule] if self.schedule != NO_SCHEDULE else None
+
+    def __repr__(self):
+        return f"UserRecord(user_id={self.user_id!r}, app_type={self.app_type!r}, plant_type={self.plant_type!r}, schedule={self.schedule_key!r})"
+
+
+# ======== Memory benchmark ========
+def _bench(n: int = 100_000):
+    """Bytes per user for the old dict pipeline vs UserRecord, measured with tracemalloc."""
+    import tracemalloc
+    import uuid
+    from datetime import timezone
+
+    watered = datetime(2025, 8, 7, tzinfo=timezone.utc)
+    ids = [uuid.uuid4() for _ in range(n)]
+    tokens = [f"tok-{i:0>140}" for i in range(n)]
+
+    def measure(build):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        return (after - before) / n
+
+    def old_pipeline():
+        # fetch dict -> classify copy -> grouped copy (daily_nudges + db_utils before the change)
+        users = [
+            {"user_id": ids[i], "token": tokens[i][:], "current_streak": 3, "last_watered_date": watered}
+            for i in range(n)
+        ]
+        classified = [{**u, "app_type": "consistent", "plant_type": "thriving", "current_streak": 3} for u in users]
+        grouped = [{"user_id": u["user_id"], "token": u["token"], "default_body": "x"} for u in classified]
+        return users, classified, grouped
+
+    def new_pipeline():
+        records = [UserRecord(ids[i], tokens[i], 3, watered) for i in range(n)]
+        for r in records:
+            r.app_type, r.plant_type, r.schedule = "consistent", "thriving", SCHEDULE_INDEX["consistent"]
+        return records
+
+    old = measure(old_pipeline)
+    new = measure(new_pipeline)
+    print(f"users: {n}")
+    print(f"dict pipeline:       {old:8.1f} bytes/user")
+    print(f"UserRecord pipeline: {new:8.1f} bytes/user")
+    print(f"saved:               {old - new:8.1f} bytes/user ({(1 - new / old) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    _bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)